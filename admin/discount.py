@@ -1,10 +1,15 @@
-from db.models import get_db
+from db.models import SETTINGS_VERSION, bump_version, get_db, get_version
+from services.cache import VersionedCache
+from services.pricing import PricingIndex
 
-def get_markup_amount():
-    """Получить текущую сумму наценки"""
+# Наценки в памяти процесса до изменения настроек (в любом процессе бота)
+_markups = VersionedCache(lambda: get_version(SETTINGS_VERSION))
+
+def _query_amount_setting(key):
+    """Сумма наценки из settings (0, если не задана или некорректна)"""
     with get_db() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT value FROM settings WHERE key = 'markup_amount'")
+        cur.execute("SELECT value FROM settings WHERE key = ?", (key,))
         row = cur.fetchone()
         if row:
             try:
@@ -13,6 +18,23 @@ def get_markup_amount():
                 return 0.0
         return 0.0
 
+def _query_user_markups():
+    """Персональные наценки всех пользователей: {user_id: сумма или None, если некорректна}"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT user_id, markup_amount FROM user_markups")
+        markups = {}
+        for user_id, amount in cur.fetchall():
+            try:
+                markups[user_id] = float(amount)
+            except:
+                markups[user_id] = None
+        return markups
+
+def get_markup_amount():
+    """Получить текущую сумму наценки"""
+    return _markups.get('markup_amount', lambda: _query_amount_setting('markup_amount'))
+
 def set_markup_amount(amount):
     """Установить сумму наценки"""
     with get_db() as conn:
@@ -21,20 +43,12 @@ def set_markup_amount(amount):
             INSERT OR REPLACE INTO settings (key, value) 
             VALUES ('markup_amount', ?)
         """, (str(amount),))
+        bump_version(cur, SETTINGS_VERSION)
         conn.commit()
 
 def get_user_markup_amount(user_id):
     """Получить персональную сумму наценки для пользователя"""
-    with get_db() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT markup_amount FROM user_markups WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        if row:
-            try:
-                return float(row[0])
-            except:
-                return None
-        return None
+    return _markups.get('user_markups', _query_user_markups).get(user_id)
 
 def set_user_markup_amount(user_id, amount):
     """Установить персональную сумму наценки для пользователя"""
@@ -44,6 +58,7 @@ def set_user_markup_amount(user_id, amount):
             INSERT OR REPLACE INTO user_markups (user_id, markup_amount, updated_at)
             VALUES (?, ?, CURRENT_TIMESTAMP)
         """, (user_id, amount))
+        bump_version(cur, SETTINGS_VERSION)
         conn.commit()
 
 def delete_user_markup(user_id):
@@ -51,8 +66,10 @@ def delete_user_markup(user_id):
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("DELETE FROM user_markups WHERE user_id = ?", (user_id,))
+        deleted = cur.rowcount > 0
+        bump_version(cur, SETTINGS_VERSION)
         conn.commit()
-        return cur.rowcount > 0
+        return deleted
 
 def get_all_user_markups():
     """Получить все персональные суммы наценки пользователей"""
@@ -73,18 +90,126 @@ def get_all_user_markups():
             } for row in rows
         ]
 
-def get_preorder_markup_amount():
-    """Получить текущую сумму наценки для предзаказа"""
+def _query_customer_groups():
+    """Группы покупателей: ({group_id: группа}, {user_id: group_id})"""
     with get_db() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT value FROM settings WHERE key = 'preorder_markup_amount'")
+        cur.execute("SELECT id, name, markup_amount FROM customer_groups")
+        groups = {
+            row[0]: {"id": row[0], "name": row[1], "markup_amount": row[2]}
+            for row in cur.fetchall()
+        }
+        cur.execute("SELECT user_id, group_id FROM customer_group_members")
+        members = {user_id: group_id for user_id, group_id in cur.fetchall() if group_id in groups}
+        return groups, members
+
+def get_user_group(user_id):
+    """Группа покупателя пользователя (id, name, markup_amount) или None"""
+    groups, members = _markups.get('customer_groups', _query_customer_groups)
+    group_id = members.get(user_id)
+    return dict(groups[group_id]) if group_id is not None else None
+
+def get_customer_groups():
+    """Получить все группы покупателей с количеством участников (по названию)"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT g.id, g.name, g.markup_amount, COUNT(m.user_id)
+            FROM customer_groups g
+            LEFT JOIN customer_group_members m ON m.group_id = g.id
+            GROUP BY g.id
+            ORDER BY g.name
+        """)
+        rows = cur.fetchall()
+        return [
+            {
+                "id": row[0],
+                "name": row[1],
+                "markup_amount": row[2],
+                "member_count": row[3],
+            } for row in rows
+        ]
+
+def set_customer_group(name, amount):
+    """Создать группу покупателей или изменить ее сумму наценки, возвращает ID группы"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO customer_groups (name, markup_amount)
+            VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET markup_amount = excluded.markup_amount, updated_at = CURRENT_TIMESTAMP
+        """, (name, amount))
+        cur.execute("SELECT id FROM customer_groups WHERE name = ?", (name,))
+        group_id = cur.fetchone()[0]
+        bump_version(cur, SETTINGS_VERSION)
+        conn.commit()
+        return group_id
+
+def delete_customer_group(name):
+    """Удалить группу покупателей (ее участники переходят на стандартную наценку)"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM customer_groups WHERE name = ?", (name,))
         row = cur.fetchone()
-        if row:
-            try:
-                return float(row[0])
-            except:
-                return 0.0
-        return 0.0
+        if not row:
+            return False
+        cur.execute("DELETE FROM customer_group_members WHERE group_id = ?", (row[0],))
+        cur.execute("DELETE FROM customer_groups WHERE id = ?", (row[0],))
+        bump_version(cur, SETTINGS_VERSION)
+        conn.commit()
+        return True
+
+def set_user_group(user_id, name):
+    """Включить пользователя в группу покупателей (из прежней группы он удаляется); False, если группы нет"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM customer_groups WHERE name = ?", (name,))
+        row = cur.fetchone()
+        if not row:
+            return False
+        cur.execute("""
+            INSERT OR REPLACE INTO customer_group_members (user_id, group_id, created_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        """, (user_id, row[0]))
+        bump_version(cur, SETTINGS_VERSION)
+        conn.commit()
+        return True
+
+def remove_user_group(user_id):
+    """Исключить пользователя из группы покупателей"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM customer_group_members WHERE user_id = ?", (user_id,))
+        deleted = cur.rowcount > 0
+        bump_version(cur, SETTINGS_VERSION)
+        conn.commit()
+        return deleted
+
+def get_customer_markup(user_id):
+    """Наценка покупателя: персональная, иначе наценка его группы, иначе None (правила и стандартная наценка)"""
+    if not user_id:
+        return None
+    user_markup = get_user_markup_amount(user_id)
+    if user_markup is not None:
+        return user_markup
+    group = get_user_group(user_id)
+    return group['markup_amount'] if group else None
+
+def price_group_key(user_id):
+    """
+    Ключ набора цен пользователя: пользователи с одинаковым ключом видят одинаковые цены.
+    ('user', user_id) - персональная наценка, ('group', group_id) - наценка группы, None - общие цены
+    """
+    if not user_id:
+        return None
+    if get_user_markup_amount(user_id) is not None:
+        return ('user', user_id)
+    group = get_user_group(user_id)
+    return ('group', group['id']) if group else None
+
+def get_preorder_markup_amount():
+    """Получить текущую сумму наценки для предзаказа"""
+    return _markups.get('preorder_markup_amount', lambda: _query_amount_setting('preorder_markup_amount'))
 
 def set_preorder_markup_amount(amount):
     """Установить сумму наценки для предзаказа"""
@@ -94,14 +219,71 @@ def set_preorder_markup_amount(amount):
             INSERT OR REPLACE INTO settings (key, value) 
             VALUES ('preorder_markup_amount', ?)
         """, (str(amount),))
+        bump_version(cur, SETTINGS_VERSION)
+        conn.commit()
+
+def _query_pricing_rules():
+    """Все правила наценки по категориям и диапазонам цены"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, is_preorder, parent_category, category, min_price, max_price, markup_amount, created_at
+            FROM pricing_rules
+            ORDER BY id
+        """)
+        rows = cur.fetchall()
+        return [
+            {
+                "id": row[0],
+                "is_preorder": bool(row[1]),
+                "parent_category": row[2],
+                "category": row[3],
+                "min_price": row[4],
+                "max_price": row[5],
+                "markup_amount": row[6],
+                "created_at": row[7],
+            } for row in rows
+        ]
+
+def get_pricing_rules():
+    """Получить все правила наценки (в порядке добавления)"""
+    return [dict(rule) for rule in _markups.get('pricing_rules', _query_pricing_rules)]
+
+def get_pricing_index():
+    """Скомпилированные правила наценки (пересобираются при изменении настроек)"""
+    return _markups.get('pricing_index', lambda: PricingIndex(_markups.get('pricing_rules', _query_pricing_rules)))
+
+def add_pricing_rule(markup_amount, parent_category=None, category=None, min_price=None, max_price=None, is_preorder=False):
+    """Добавить правило наценки (None - любая категория / цена без ограничения), возвращает ID правила"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO pricing_rules (is_preorder, parent_category, category, min_price, max_price, markup_amount)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (int(bool(is_preorder)), parent_category, category, min_price, max_price, markup_amount))
+        rule_id = cur.lastrowid
+        bump_version(cur, SETTINGS_VERSION)
+        conn.commit()
+        return rule_id
+
+def delete_pricing_rule(rule_id):
+    """Удалить правило наценки"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM pricing_rules WHERE id = ?", (rule_id,))
+        deleted = cur.rowcount > 0
+        bump_version(cur, SETTINGS_VERSION)
         conn.commit()
+        return deleted
 
-def calculate_price_with_markup(base_price, user_id=None, is_preorder=False):
+def calculate_price_with_markup(base_price, user_id=None, is_preorder=False, parent_category=None, category=None):
     """Рассчитать цену с учетом персональной суммы наценки пользователя
     
     В БД хранится базовая цена БЕЗ наценки, поэтому:
     - Если есть индивидуальная наценка для пользователя - добавляем её к базовой цене
-    - Если нет индивидуальной наценки - добавляем стандартную наценку к базовой цене
+    - Если пользователь входит в группу покупателей - добавляем наценку группы
+    - Если для категории и цены товара есть правило наценки (pricing_rules) - добавляем его сумму
+    - Иначе добавляем стандартную наценку к базовой цене
     """
     # Получаем стандартную наценку
     if is_preorder:
@@ -109,13 +291,42 @@ def calculate_price_with_markup(base_price, user_id=None, is_preorder=False):
     else:
         standard_markup = get_markup_amount()
     
-    if user_id:
-        user_markup = get_user_markup_amount(user_id)
-        if user_markup is not None:
-            # Если есть персональная наценка, применяем её к базовой цене
-            # В БД хранится базовая цена без наценки, поэтому просто добавляем индивидуальную наценку
-            return int(base_price + user_markup)
+    customer_markup = get_customer_markup(user_id)
+    if customer_markup is not None:
+        # Если есть персональная наценка или наценка группы, применяем её к базовой цене
+        # В БД хранится базовая цена без наценки, поэтому просто добавляем наценку покупателя
+        return int(base_price + customer_markup)
     
-    # Применяем стандартную наценку (для предзаказа или обычного прайса)
-    return int(base_price + standard_markup)
+    # Применяем наценку правила категории или стандартную (для предзаказа или обычного прайса)
+    markup = get_pricing_index().markup(base_price, standard_markup, is_preorder, parent_category, category)
+    return int(base_price + markup)
 
+def calculate_product_price(product, user_id=None, is_preorder=False):
+    """Цена товара (словарь с price, parent_category и category) с учетом наценки"""
+    return calculate_price_with_markup(
+        product['price'], user_id, is_preorder,
+        product.get('parent_category'), product.get('category')
+    )
+
+def price_listing(products, user_id=None, is_preorder=False):
+    """
+    Цены списка товаров (например, всей категории) с учетом наценки, в порядке products.
+    Наценки и таблица диапазонов категории определяются один раз на список, а не на каждую строку.
+    """
+    customer_markup = get_customer_markup(user_id)
+    if customer_markup is not None:
+        return [int(product['price'] + customer_markup) for product in products]
+    
+    standard_markup = get_preorder_markup_amount() if is_preorder else get_markup_amount()
+    index = get_pricing_index()
+    if not index:
+        return [int(product['price'] + standard_markup) for product in products]
+    
+    prices = []
+    table_key = table = None
+    for product in products:
+        key = (product.get('parent_category'), product.get('category'))
+        if key != table_key:
+            table_key, table = key, index.table(is_preorder, *key)
+        prices.append(int(product['price'] + table.markup(product['price'], standard_markup)))
+    return prices
@@ -0,0 +1,106 @@
+"""
+Выгрузка заказов с позициями в Excel (.xlsx) или CSV для админа.
+
+Строки читаются курсором SQLite по мере записи и сразу пишутся в файл
+(openpyxl в режиме write_only / csv.writer), поэтому память не зависит
+от количества заказов в выгрузке.
+"""
+import csv
+import datetime
+from db.models import get_db
+
+EXPORT_FORMATS = ('xlsx', 'csv')
+
+EXPORT_COLUMNS = [
+    "Заказ", "Дата", "ID пользователя", "Username", "Имя", "Фамилия", "Статус", "Сумма заказа",
+    "ID товара", "Товар", "Количество", "Цена", "Сумма позиции",
+]
+
+# Строк за одно чтение из курсора
+FETCH_SIZE = 1000
+
+def parse_export_date(text):
+    """Дата из 'ГГГГ-ММ-ДД' или 'ДД.ММ.ГГГГ'"""
+    for date_format in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.datetime.strptime(text, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Неверная дата: {text}")
+
+def iter_order_rows(date_from=None, date_to=None):
+    """
+    Позиции заказов вместе с данными заказа за период [date_from, date_to] (даты включительно,
+    None - без ограничения), по дате заказа. Порядок берется из индексов idx_orders_created
+    и idx_order_items_order без сортировки результата, строки читаются порциями по мере обхода.
+    """
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append("o.created_at >= ?")
+        params.append(date_from.isoformat())
+    if date_to:
+        conditions.append("o.created_at < ?")
+        params.append((date_to + datetime.timedelta(days=1)).isoformat())
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT o.id, o.created_at, o.user_id, o.user_username, o.user_first_name, o.user_last_name,
+                   o.status, o.total_price,
+                   i.product_id, i.product_name, i.quantity, i.price, i.quantity * i.price
+            FROM orders o
+            JOIN order_items i ON i.order_id = o.id
+            {where}
+            ORDER BY o.created_at, o.id, i.id
+        """, params)
+        while True:
+            rows = cur.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+def export_orders(path, date_from=None, date_to=None, file_format='xlsx'):
+    """
+    Записывает заказы за период в файл path (xlsx или csv).
+    Возвращает (количество заказов, количество позиций).
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {file_format}")
+
+    orders = items = 0
+    last_order_id = None
+    rows = iter_order_rows(date_from, date_to)
+
+    if file_format == 'csv':
+        # utf-8-sig - чтобы Excel открывал файл с кириллицей без выбора кодировки
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(EXPORT_COLUMNS)
+            for row in rows:
+                writer.writerow(row)
+                # Позиции одного заказа идут подряд - считаем заказы без хранения их ID
+                if row[0] != last_order_id:
+                    orders += 1
+                    last_order_id = row[0]
+                items += 1
+        return orders, items
+
+    # openpyxl нужен только для выгрузки - не импортируем его при запуске бота
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Заказы")
+    sheet.append(EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+        if row[0] != last_order_id:
+            orders += 1
+            last_order_id = row[0]
+        items += 1
+    workbook.save(path)
+    return orders, items
@@ -7,6 +7,8 @@ def get_admin_keyboard():
         [KeyboardButton(text="⚙️ Настройка наценки"), KeyboardButton(text="📈 Текущая наценка")],
         [KeyboardButton(text="⚙️ Наценка предзаказа"), KeyboardButton(text="📋 Статистика")],
         [KeyboardButton(text="👤 Персональные проценты"), KeyboardButton(text="📦 Заказы")],
+        [KeyboardButton(text="💲 Правила наценки"), KeyboardButton(text="👥 Группы покупателей")],
+        [KeyboardButton(text="📤 Выгрузка заказов")],
         [KeyboardButton(text="🗑️ Очистить базу от товаров")],
         [KeyboardButton(text="🔙 Назад")]
     ]
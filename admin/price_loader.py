@@ -1,7 +1,26 @@
+import codecs
+import csv
+import io
+import logging
+import multiprocessing
+import os
 import pandas as pd
 import re
+import shutil
+import tempfile
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice, repeat
 from db.models import get_db
 from admin.discount import get_markup_amount, get_preorder_markup_amount
+from services.history import make_product_key, record_price_changes
+from services.brands import BRAND_HEADERS, find_brand_header, normalize_brand_header, parent_for_category
+from services.ordering import sort_key_value
+from services.category import PREORDER_SOURCE, bump_catalog_version, rebuild_category_tree
+from services.stats import refresh_catalog_stats
+
+logger = logging.getLogger(__name__)
 
 # Список всех поддерживаемых флагов стран
 SUPPORTED_COUNTRY_FLAGS = [
@@ -535,101 +554,295 @@ def parse_price(price_str):
     except:
         return None
 
-def load_price_from_excel(file_path, markup_amount=None, source='standard'):
-    """Загружает прайс из Excel файла в базу данных"""
-    if markup_amount is None:
-        markup_amount = get_markup_amount()
+# Эмодзи, с которых начинаются заголовки товаров в стандартном формате
+PRODUCT_HEADER_EMOJIS = ['📱', '⌚', '🔳', '💻', '🖥', '🎧', '⌨️', '🖊']
+
+def parse_standard_rows(rows):
+    """
+    Разбирает строки стандартного формата: заголовок товара с эмодзи,
+    под ним строки предложений (артикул | страна | наличие | цена | количество).
+    rows - кортежи значений ячеек (строки листа Excel или CSV).
+    Генерирует кортежи (parent_category, category, name, memory, color, country, price).
+    """
+    current_category = None
+    current_product_name = None
     
+    for values in rows:
+        num_cols = len(values)
+        if num_cols == 0:
+            continue
+        
+        # Первая колонка - название товара
+        col1 = values[0]
+        
+        if pd.notna(col1):
+            col1_str = str(col1)
+            # Проверяем, является ли это заголовком товара (с эмодзи)
+            if any(emoji in col1_str for emoji in PRODUCT_HEADER_EMOJIS):
+                # Это новый товар
+                current_product_name = col1_str
+                current_category = extract_category(col1_str)
+                continue
+        
+        # Строка с данными обрабатывается только после заголовка товара
+        if not (current_category and current_product_name):
+            continue
+        
+        # Проверяем, что это не пустая строка и есть модель
+        model_code = str(col1) if pd.notna(col1) else None
+        if not model_code or model_code == 'nan' or model_code == 'None':
+            continue
+        
+        # Колонка B (индекс 1) - страна с флагом, колонка D (индекс 3) - цена
+        country_flag = str(values[1]).strip() if num_cols > 1 and pd.notna(values[1]) else None
+        price_str = values[3] if num_cols > 3 and pd.notna(values[3]) else None
+        
+        price = parse_price(price_str)
+        if price is None:
+            continue
+        
+        # Сохраняем базовую цену БЕЗ наценки (наценка будет применяться при отображении)
+        # Формируем полное название товара
+        full_name = re.sub(r'[📱⌚🔳💻🖥🎧⌨️🖊]', '', current_product_name).strip()
+        yield (
+            None, current_category, full_name,
+            extract_memory(current_product_name), extract_color(current_product_name),
+            parse_country(country_flag), price
+        )
+
+def iter_sheet_rows(df):
+    """Строки листа Excel как кортежи значений ячеек (пустые ячейки - NaN)"""
+    return df.itertuples(index=False, name=None)
+
+def get_sheet_names(file_path):
+    """Возвращает названия всех листов книги Excel"""
+    with pd.ExcelFile(_rewind(file_path)) as workbook:
+        return workbook.sheet_names
+
+def _parse_sheet(file_path, sheet_name, parse_rows):
+    """Читает и разбирает один лист книги (выполняется в процессе пула)"""
+    df = pd.read_excel(_rewind(file_path), sheet_name=sheet_name)
+    return list(parse_rows(iter_sheet_rows(df)))
+
+def _pool_context():
+    """Контекст multiprocessing для пула разбора листов (см. parse_workbook)"""
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    # Сервер запускается один раз и сразу импортирует модуль разбора: процессам пула остается fork от него
+    context.set_forkserver_preload([__name__])
+    return context
+
+def parse_workbook(file_path, parse_rows):
+    """
+    Разбирает все листы книги функцией parse_rows (строки листа -> кортежи товаров).
+    Листы разбираются параллельно в пуле процессов (по одному листу на процесс),
+    результат объединяется в порядке листов. Книга из одного листа разбирается без пула,
+    как и любая книга в daemon-процессе (им нельзя создавать дочерние процессы).
+    Процессы пула запускаются через forkserver (spawn, где его нет), а не fork: разбор
+    вызывается из потока работающего бота, и fork скопировал бы в дочерний процесс
+    блокировки, захваченные другими потоками (логирование, sqlite), - процесс мог зависнуть.
+    """
+    sheet_names = get_sheet_names(file_path)
+    if len(sheet_names) == 1:
+        return _parse_sheet(file_path, sheet_names[0], parse_rows)
+    if multiprocessing.current_process().daemon:
+        rows = []
+        for sheet_name in sheet_names:
+            rows.extend(_parse_sheet(file_path, sheet_name, parse_rows))
+        return rows
+    
+    if not _is_path(file_path):
+        # Загруженный файл процессы пула читают с диска: копия во временном файле, а не в памяти каждого процесса
+        with tempfile.NamedTemporaryFile(prefix='price-upload-', delete=False) as workbook:
+            shutil.copyfileobj(_rewind(file_path), workbook)
+        try:
+            return parse_workbook(workbook.name, parse_rows)
+        finally:
+            os.remove(workbook.name)
+    
+    workers = min(len(sheet_names), os.cpu_count() or 1)
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as executor:
+        sheets_rows = executor.map(
+            _parse_sheet,
+            repeat(file_path, len(sheet_names)),
+            sheet_names,
+            repeat(parse_rows, len(sheet_names))
+        )
+        for sheet_rows in sheets_rows:
+            rows.extend(sheet_rows)
+    logger.info("Разобрано листов: %d, товаров: %d", len(sheet_names), len(rows))
+    return rows
+
+# Расширения текстовых прайсов, которые читаются потоково модулем csv
+CSV_EXTENSIONS = ('.csv', '.tsv')
+
+# Начало файла книги Excel: xlsx (zip-архив) и xls (OLE2)
+EXCEL_SIGNATURES = (b'PK\x03\x04', b'\xd0\xcf\x11\xe0')
+
+# Размер пакета вставки товаров при загрузке прайса
+IMPORT_BATCH_SIZE = 5000
+
+# Функции чтения прайса принимают путь к файлу или загруженный файл - двоичный file-like объект
+# с seek (BytesIO, SpooledTemporaryFile); загруженный файл перематывается в начало перед каждым чтением
+
+def _is_path(file_path):
+    return isinstance(file_path, (str, os.PathLike))
+
+def _rewind(file_path):
+    """Путь к файлу как есть, загруженный файл - перемотанный в начало"""
+    if not _is_path(file_path):
+        file_path.seek(0)
+    return file_path
+
+def is_csv_file(file_path):
+    """
+    Проверяет, является ли файл текстовым прайсом (CSV/TSV): путь - по расширению,
+    загруженный файл - по содержимому (все, что не книга Excel)
+    """
+    if _is_path(file_path):
+        return os.fspath(file_path).lower().endswith(CSV_EXTENSIONS)
+    return not _rewind(file_path).read(4).startswith(EXCEL_SIGNATURES)
+
+def _detect_csv_encoding(sample):
+    """Кодировка CSV по началу файла: UTF-8 (в том числе с BOM), иначе cp1251 (экспорт из Excel)"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    try:
+        # final=False - многобайтовый символ может быть обрезан на границе образца
+        decoder.decode(sample, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp1251'
+
+@contextmanager
+def _open_csv_text(file_path):
+    """Текстовый поток CSV/TSV в кодировке, определенной по началу файла"""
+    if _is_path(file_path):
+        with open(file_path, 'rb') as f:
+            sample = f.read(65536)
+        with open(file_path, newline='', encoding=_detect_csv_encoding(sample)) as f:
+            yield f
+        return
+    
+    sample = _rewind(file_path).read(65536)
+    text = io.TextIOWrapper(_rewind(file_path), encoding=_detect_csv_encoding(sample), newline='')
     try:
-        df = pd.read_excel(file_path)
+        yield text
+    finally:
+        # Загруженный файл остается открытым: его читают еще раз (определение формата, загрузка)
+        text.detach()
+
+def iter_csv_rows(file_path, skip_header=True):
+    """
+    Построчно читает прайс CSV/TSV (память не зависит от размера файла).
+    Разделитель: табуляция для .tsv, для .csv и загруженных файлов определяется по началу файла
+    (',' ';' или табуляция). Строка заголовка пропускается, как при чтении Excel; пустые ячейки заменяются на None.
+    """
+    with _open_csv_text(file_path) as f:
+        if _is_path(file_path) and os.fspath(file_path).lower().endswith('.tsv'):
+            dialect = csv.excel_tab
+        else:
+            try:
+                dialect = csv.Sniffer().sniff(f.read(65536), delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            f.seek(0)
         
-        current_category = None
-        current_product_name = None
-        products_loaded = 0
+        reader = csv.reader(f, dialect)
+        if skip_header:
+            next(reader, None)
+        for values in reader:
+            yield tuple(value or None for value in values)
+
+def read_products(file_path, parse_rows):
+    """
+    Читает товары из файла прайса функцией parse_rows (строки -> кортежи товаров).
+    CSV/TSV разбирается потоково (возвращается генератор), книга Excel - по листам.
+    """
+    if is_csv_file(file_path):
+        return parse_rows(iter_csv_rows(file_path))
+    return parse_workbook(file_path, parse_rows)
+
+def _insert_batches(cur, sql, params):
+    """Пакетная вставка по IMPORT_BATCH_SIZE строк, возвращает количество вставленных строк"""
+    count = 0
+    while True:
+        batch = list(islice(params, IMPORT_BATCH_SIZE))
+        if not batch:
+            return count
+        cur.executemany(sql, batch)
+        count += len(batch)
+
+def store_products(rows, source):
+    """
+    Заменяет товары прайса source одной транзакцией: удаление старых товаров,
+    пакетная вставка новых и запись изменений цен в историю.
+    rows - кортежи (parent_category, category, name, memory, color, country, price),
+    список или генератор (товары вставляются по мере разбора файла).
+    Если родительская категория не задана в прайсе, она определяется по бренду в категории.
+    """
+    with get_db() as conn:
+        cur = conn.cursor()
         
-        with get_db() as conn:
-            cur = conn.cursor()
-            
-            # Очищаем старые данные только этого типа прайса перед загрузкой нового
-            cur.execute("DELETE FROM products WHERE source = ?", (source,))
-            
-            for idx, row in df.iterrows():
-                # Проверяем количество колонок в строке
-                num_cols = len(row)
-                if num_cols == 0:
-                    continue
-                
-                # Первая колонка - название товара
-                col1 = row.iloc[0] if num_cols > 0 else None
-                
-                if pd.notna(col1):
-                    col1_str = str(col1)
-                    # Проверяем, является ли это заголовком товара (с эмодзи)
-                    if any(emoji in col1_str for emoji in ['📱', '⌚', '🔳', '💻', '🖥', '🎧', '⌨️', '🖊']):
-                        # Это новый товар
-                        current_product_name = col1_str
-                        current_category = extract_category(col1_str)
-                        continue
-                
-                # Если есть категория и название товара, обрабатываем строку с данными
-                if current_category and current_product_name:
-                    # Безопасно извлекаем данные из строки с проверкой индексов
-                    model_code = None
-                    country_flag = None
-                    stock = None
-                    price_str = None
-                    quantity = None
-                    
-                    if num_cols > 0:
-                        model_code = str(row.iloc[0]) if pd.notna(row.iloc[0]) else None
-                    if num_cols > 1:
-                        # Колонка B (индекс 1) - страна с флагом
-                        country_flag_raw = row.iloc[1]
-                        if pd.notna(country_flag_raw):
-                            country_flag = str(country_flag_raw).strip()
-                        else:
-                            country_flag = None
-                    if num_cols > 2:
-                        stock = str(row.iloc[2]) if pd.notna(row.iloc[2]) else None
-                    if num_cols > 3:
-                        # Колонка D (индекс 3) - цена
-                        price_str = row.iloc[3] if pd.notna(row.iloc[3]) else None
-                    if num_cols > 4:
-                        # Колонка E (индекс 4) - количество
-                        quantity = row.iloc[4] if pd.notna(row.iloc[4]) else None
-                    
-                    # Проверяем, что это не пустая строка и есть модель
-                    if not model_code or model_code == 'nan' or model_code == 'None':
-                        continue
-                    
-                    # Извлекаем данные
-                    memory = extract_memory(current_product_name)
-                    color = extract_color(current_product_name)
-                    country = parse_country(country_flag)
-                    price = parse_price(price_str)
-                    
-                    if price is None:
-                        continue
-                    
-                    # Сохраняем базовую цену БЕЗ наценки (наценка будет применяться при отображении)
-                    # Формируем полное название товара
-                    full_name = re.sub(r'[📱⌚🔳💻🖥🎧⌨️🖊]', '', current_product_name).strip()
-                    
-                    # Сохраняем в БД
-                    try:
-                        cur.execute("""
-                            INSERT INTO products (category, name, memory, color, country, price, source)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)
-                        """, (current_category, full_name, memory, color, country, price, source))
-                        
-                        products_loaded += 1
-                    except Exception as e:
-                        # Пропускаем проблемные записи, но продолжаем обработку
-                        continue
-            
-            conn.commit()
+        # Очищаем старые данные только этого типа прайса перед загрузкой нового
+        cur.execute("DELETE FROM products WHERE source = ?", (source,))
+        count = _insert_batches(cur, """
+            INSERT INTO products (parent_category, category, name, memory, color, country, price, source, product_key, sort_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            (row[0] or parent_for_category(row[1]),) + row[1:]
+            + (source, make_product_key(*row[1:6]), sort_key_value(row[1]))
+            for row in rows
+        ))
         
-        return products_loaded
+        # Записываем изменения цен в историю (в той же транзакции)
+        record_price_changes(cur, source)
+        
+        # Пересчитываем дерево категорий для навигации (в той же транзакции)
+        rebuild_category_tree(cur, source)
+        
+        # Статистика каталога для админа (в той же транзакции)
+        refresh_catalog_stats(cur)
+        
+        # Сбрасываем кеши навигации и клавиатур во всех процессах (видно после commit)
+        bump_catalog_version(cur)
+        
+        conn.commit()
+    return count
+
+def store_preorder_products(rows):
+    """Заменяет товары предзаказа одной транзакцией (аналог store_products для preorder_products)"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        
+        # Очищаем старые данные предзаказа перед загрузкой нового
+        cur.execute("DELETE FROM preorder_products")
+        count = _insert_batches(cur, """
+            INSERT INTO preorder_products (parent_category, category, name, memory, color, country, price, product_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            (row[0] or parent_for_category(row[1]),) + row[1:] + (make_product_key(*row[1:6]),)
+            for row in rows
+        ))
+        
+        # Записываем изменения цен в историю (в той же транзакции)
+        record_price_changes(cur, PREORDER_SOURCE, table='preorder_products')
+        rebuild_category_tree(cur, PREORDER_SOURCE)
+        refresh_catalog_stats(cur)
+        bump_catalog_version(cur)
+        
+        conn.commit()
+    return count
+
+def load_price_from_excel(file_path, markup_amount=None, source='standard'):
+    """Загружает прайс из Excel файла (все листы книги) или CSV/TSV в базу данных"""
+    if markup_amount is None:
+        markup_amount = get_markup_amount()
+    
+    try:
+        rows = read_products(file_path, parse_standard_rows)
+        return store_products(rows, source)
     
     except Exception as e:
         # Упрощенное сообщение об ошибке
@@ -638,14 +851,26 @@ def load_price_from_excel(file_path, markup_amount=None, source='standard'):
             error_msg = "Ошибка: файл имеет неожиданную структуру. Проверьте, что файл содержит все необходимые колонки."
         raise Exception(f"Ошибка при загрузке прайса: {error_msg}")
 
+def _count_csv_columns(file_path, nrows=10):
+    """Количество столбцов в заголовке и первых nrows строках CSV/TSV (без пустых ячеек в конце строки)"""
+    num_cols = 0
+    for values in islice(iter_csv_rows(file_path, skip_header=False), nrows + 1):
+        while values and values[-1] is None:
+            values = values[:-1]
+        num_cols = max(num_cols, len(values))
+    return num_cols
+
 def detect_file_format(file_path):
     """
-    Определяет формат файла Excel.
+    Определяет формат файла Excel или CSV/TSV.
     Возвращает 'simple' если 2 столбца, 'standard' если больше столбцов.
     """
     try:
-        df = pd.read_excel(file_path, nrows=10)  # Читаем первые 10 строк для анализа
-        num_cols = len(df.columns)
+        if is_csv_file(file_path):
+            num_cols = _count_csv_columns(file_path)
+        else:
+            df = pd.read_excel(_rewind(file_path), nrows=10)  # Читаем первые 10 строк для анализа
+            num_cols = len(df.columns)
         
         # Если 2 столбца - простой формат (название, цена)
         if num_cols == 2:
@@ -656,9 +881,10 @@ def detect_file_format(file_path):
         # По умолчанию пытаемся стандартный формат
         return 'standard'
 
-def extract_categories_from_excel_v2(file_path):
+def iter_simple_structure(rows):
     """
-    Извлекает иерархию категорий из Excel файла (новая версия).
+    Извлекает иерархию категорий из строк простого формата за один проход
+    (rows - кортежи значений ячеек листа Excel или CSV).
     
     Структура:
     - Родительские категории (например, META, APPLE) - строки БЕЗ цены, окруженные пустыми строками
@@ -666,115 +892,90 @@ def extract_categories_from_excel_v2(file_path):
     - Подкатегории (например, "Apple iPhone 17 256GB") - строки БЕЗ цены, идущие после родительской категории
     - Товары - строки С ценой
     
-    Возвращает словарь: {номер_строки: {'type': 'parent'|'subcategory'|'product', 'name': 'название', 'parent': 'родитель'}}
+    Генерирует пары (номер_строки, {'type': 'parent'|'subcategory'|'product', 'name': 'название', 'parent': 'родитель'})
     """
-    try:
-        df = pd.read_excel(file_path)
+    current_parent = None
+    prev_row_type = None
+    
+    for idx, values in enumerate(rows):
+        # Определяем тип строки (пустая, с ценой, без цены)
+        col1 = values[0] if len(values) > 0 and pd.notna(values[0]) else None
+        col2 = values[1] if len(values) > 1 and pd.notna(values[1]) else None
         
-        # Первый проход: определяем типы всех строк (пустая, с ценой, без цены)
-        row_types = []
-        for idx, row in df.iterrows():
-            col1 = row.iloc[0] if pd.notna(row.iloc[0]) else None
-            col2 = row.iloc[1] if len(row) > 1 and pd.notna(row.iloc[1]) else None
-            
-            is_empty = not col1 or str(col1).strip() == '' or str(col1).lower() == 'nan'
-            
-            if is_empty:
-                row_types.append('empty')
-            else:
-                has_price = False
-                if col2 is not None:
-                    try:
-                        float(str(col2).replace(' ', '').replace(',', ''))
-                        has_price = True
-                    except (ValueError, AttributeError):
-                        pass
-                
-                if has_price:
-                    row_types.append('with_price')
-                else:
-                    row_types.append('no_price')
+        is_empty = not col1 or str(col1).strip() == '' or str(col1).lower() == 'nan'
         
-        # Второй проход: определяем parent/subcategory
-        structure = {}
-        current_parent = None
+        if is_empty:
+            row_type = 'empty'
+        else:
+            has_price = False
+            if col2 is not None:
+                try:
+                    float(str(col2).replace(' ', '').replace(',', ''))
+                    has_price = True
+                except (ValueError, AttributeError):
+                    pass
+            row_type = 'with_price' if has_price else 'no_price'
         
-        for idx, row in df.iterrows():
-            if idx >= len(row_types):
-                continue
-                
-            row_type = row_types[idx]
-            
-            if row_type == 'empty':
-                continue
-            
-            col1 = row.iloc[0]
-            col2 = row.iloc[1] if len(row) > 1 and pd.notna(row.iloc[1]) else None
-            col1_str = str(col1).strip()
-            
-            if row_type == 'with_price':
-                # Товар
-                structure[idx] = {
-                    'type': 'product',
-                    'name': col1_str,
-                    'parent': current_parent,
-                    'price': col2
-                }
-            else:
-                # Строка без цены - родительская категория или подкатегория
-                # Проверяем, что находится ДО и ПОСЛЕ этой строки
-                
-                prev_empty = (idx == 0) or (idx > 0 and row_types[idx - 1] == 'empty')
-                
-                # Смотрим на следующую непустую строку
-                next_row_type = None
-                for next_idx in range(idx + 1, len(row_types)):
-                    if row_types[next_idx] != 'empty':
-                        next_row_type = row_types[next_idx]
-                        break
-                
-                # Родительская категория:
-                # 1. До неё пустая строка (или это первая строка)
-                # 2. После неё следующая непустая строка - это либо подкатегория (no_price), либо товар (with_price)
-                #    Если товар - значит у родительской категории нет подкатегорий
-                #    Если подкатегория - значит есть иерархия
-                
-                # Проверяем, является ли это родительской категорией:
-                # - Перед ней пустая строка
-                # - Это не внутри уже определенной родительской категории с подкатегориями
-                
-                # Дополнительно: родительские категории обычно короткие (APPLE, META, Apple и т.д.)
-                # или содержат только бренд без деталей
-                # Проверяем известные бренды (список из normalize_category_name)
-                col1_upper = col1_str.upper().replace(':', '').strip()
-                known_parent_brands = [
-                    'META', 'NINTENDO', 'VALVE', 'SONY', 'GOOGLE', 'GOPRO', 
-                    'HONOR', 'APPLE', 'NOTHING', 'SAMSUNG', 'XIAOMI', 'VIVO', 
-                    'REALME', 'GARMIN', 'DYSON', 'HUAWEI', 'YANDEX', 'REDMI', 
-                    'POCO', 'INSTA360'
-                ]
-                is_known_brand = col1_upper in known_parent_brands
-                
-                # Если перед строкой пустая строка И (это известный бренд ИЛИ не было текущего родителя)
-                if prev_empty and (is_known_brand or current_parent is None):
-                    # Родительская категория
-                    category_name = normalize_category_name(col1_str.replace(':', '').strip())
-                    current_parent = category_name
-                    structure[idx] = {
-                        'type': 'parent',
-                        'name': category_name,
-                        'parent': None
-                    }
-                else:
-                    # Подкатегория
-                    category_name = col1_str.replace(':', '').strip()
-                    structure[idx] = {
-                        'type': 'subcategory',
-                        'name': category_name,
-                        'parent': current_parent
-                    }
+        # Для родительской категории нужен только тип предыдущей строки
+        prev_empty = idx == 0 or prev_row_type == 'empty'
+        prev_row_type = row_type
+        
+        if row_type == 'empty':
+            continue
+        
+        col1_str = str(col1).strip()
+        
+        if row_type == 'with_price':
+            # Товар
+            yield idx, {
+                'type': 'product',
+                'name': col1_str,
+                'parent': current_parent,
+                'price': col2
+            }
+            continue
         
-        return structure
+        # Строка без цены - родительская категория или подкатегория
+        # Проверяем, является ли это родительской категорией:
+        # - Перед ней пустая строка (или это первая строка)
+        # - Это не внутри уже определенной родительской категории с подкатегориями
+        
+        # Дополнительно: родительские категории обычно короткие (APPLE, META, Apple и т.д.)
+        # или содержат только бренд без деталей
+        # Проверяем известные бренды (таблица брендов services/brands.py)
+        col1_upper = col1_str.upper().replace(':', '').strip()
+        is_known_brand = col1_upper in BRAND_HEADERS
+        
+        # Если перед строкой пустая строка И (это известный бренд ИЛИ не было текущего родителя)
+        if prev_empty and (is_known_brand or current_parent is None):
+            # Родительская категория
+            category_name = normalize_category_name(col1_str.replace(':', '').strip())
+            current_parent = category_name
+            yield idx, {
+                'type': 'parent',
+                'name': category_name,
+                'parent': None
+            }
+        else:
+            # Подкатегория
+            yield idx, {
+                'type': 'subcategory',
+                'name': col1_str.replace(':', '').strip(),
+                'parent': current_parent
+            }
+
+def classify_simple_rows(df):
+    """
+    Извлекает иерархию категорий из листа Excel простого формата (DataFrame).
+    Возвращает словарь: {номер_строки: {'type': ..., 'name': ..., 'parent': ...}} (см. iter_simple_structure)
+    """
+    return dict(iter_simple_structure(iter_sheet_rows(df)))
+
+def extract_categories_from_excel_v2(file_path):
+    """Извлекает иерархию категорий из первого листа Excel файла (см. classify_simple_rows)"""
+    try:
+        df = pd.read_excel(_rewind(file_path))
+        return classify_simple_rows(df)
     except Exception as e:
         print(f"Ошибка при извлечении категорий: {e}")
         import traceback
@@ -788,12 +989,12 @@ def extract_categories_from_excel(file_path):
     Возвращает словарь: {номер_строки_категории: название_категории_без_двоеточия}
     """
     try:
-        df = pd.read_excel(file_path)
+        df = pd.read_excel(_rewind(file_path))
         categories = {}
         
-        for idx, row in df.iterrows():
-            col1 = row.iloc[0] if pd.notna(row.iloc[0]) else None
-            col2 = row.iloc[1] if len(row) > 1 and pd.notna(row.iloc[1]) else None
+        for idx, values in enumerate(iter_sheet_rows(df)):
+            col1 = values[0] if pd.notna(values[0]) else None
+            col2 = values[1] if len(values) > 1 and pd.notna(values[1]) else None
             
             if not col1:
                 continue
@@ -826,12 +1027,8 @@ def extract_categories_from_excel(file_path):
                 col1_upper = col1_str.upper()
                 
                 # Проверяем, является ли это известным брендом (в верхнем регистре или смешанном)
-                known_brands = ['HONOR', 'DYSON', 'HUAWEI', 'VIVO', 'REALME', 'XIAOMI', 
-                               'SAMSUNG', 'APPLE', 'GOOGLE', 'META', 'NINTENDO', 'VALVE',
-                               'SONY', 'GOPRO', 'INSTA360', 'GARMIN', 'YANDEX', 'REDMI', 'POCO']
-                
                 # Если это известный бренд - точно категория
-                if col1_upper in known_brands or any(brand in col1_upper for brand in known_brands):
+                if find_brand_header(col1_upper):
                     is_category = True
                     category_name = col1_str.strip()
                 # Если строка без цены и не содержит признаков товара (нет типичных паттернов товара),
@@ -900,174 +1097,113 @@ def _looks_like_product(text):
     return False
 
 def normalize_category_name(category_name):
-    """Нормализует название категории (приводит к правильному регистру)"""
-    if not category_name:
-        return category_name
-    
-    category_upper = category_name.upper()
-    
-    # Маппинг известных брендов к правильному написанию
-    brand_mapping = {
-        'HONOR': 'Honor',
-        'DYSON': 'Dyson',
-        'HUAWEI': 'Huawei',
-        'VIVO': 'Vivo',
-        'REALME': 'Realme',
-        'XIAOMI': 'Xiaomi',
-        'SAMSUNG': 'Samsung',
-        'APPLE': 'Apple',
-        'GOOGLE': 'Google Pixel',
-        'META': 'Meta Quest',
-        'NINTENDO': 'Nintendo',
-        'VALVE': 'Valve',
-        'SONY': 'Sony',
-        'GOPRO': 'GoPro',
-        'INSTA360': 'Insta360',
-        'GARMIN': 'Garmin',
-        'YANDEX': 'Yandex',
-        'REDMI': 'Redmi',
-        'POCO': 'POCO'
-    }
-    
-    # Проверяем точное совпадение
-    if category_upper in brand_mapping:
-        return brand_mapping[category_upper]
-    
-    # Проверяем частичное совпадение
-    for brand_upper, brand_normalized in brand_mapping.items():
-        if brand_upper in category_upper:
-            # Заменяем бренд на нормализованный вариант
-            return category_upper.replace(brand_upper, brand_normalized).title()
-    
-    # Если не нашли, возвращаем с правильным регистром (первая буква заглавная)
-    return category_name.strip().title()
+    """Нормализует название категории (приводит к правильному регистру, см. services/brands.py)"""
+    return normalize_brand_header(category_name)
+
+def build_category_index(categories_map):
+    """
+    Индекс заголовков категорий для get_category_for_product_row:
+    отсортированные номера строк и названия в том же порядке.
+    Строится один раз на файл, поиск категории товара - бинарный.
+    """
+    category_rows = sorted(categories_map)
+    return category_rows, [categories_map[row] for row in category_rows]
 
 def get_category_for_product_row(row_idx, categories_map):
     """
     Определяет категорию для товара на основе его позиции в файле.
     Ищет ближайший заголовок категории выше текущей строки.
     Возвращает самую ближайшую категорию (подкатегорию), если есть иерархия.
+    categories_map - индекс build_category_index (для поиска по многим товарам)
+    или словарь {номер_строки: категория} (индекс строится при каждом вызове).
     """
-    current_category = None
+    if isinstance(categories_map, dict):
+        categories_map = build_category_index(categories_map)
+    category_rows, category_names = categories_map
+    
+    # Количество заголовков строго выше строки товара - позиция ближайшего из них
+    position = bisect_left(category_rows, row_idx)
+    return category_names[position - 1] if position else None
+
+def parse_simple_rows(rows):
+    """
+    Разбирает строки простого формата: два столбца (название, цена),
+    категории извлекаются из заголовков в файле (iter_simple_structure).
+    Генерирует кортежи (parent_category, category, name, memory, color, country, price).
+    """
+    counts = {'parent': 0, 'subcategory': 0, 'product': 0}
+    current_parent = None
+    current_subcategory = None
     
-    # Ищем ближайшую категорию выше текущей строки
-    # Берем самую последнюю (ближайшую) категорию перед товаром
-    for cat_row_idx in sorted(categories_map.keys(), reverse=True):
-        if cat_row_idx < row_idx:
-            current_category = categories_map[cat_row_idx]
-            break  # Берем самую ближайшую категорию
+    for idx, item in iter_simple_structure(rows):
+        counts[item['type']] += 1
+        
+        if item['type'] == 'parent':
+            # Обновляем текущую родительскую категорию
+            current_parent = item['name']
+            current_subcategory = None
+            print(f"  Родительская категория: {current_parent}")
+            
+        elif item['type'] == 'subcategory':
+            # Обновляем текущую подкатегорию
+            current_subcategory = item['name']
+            print(f"    Подкатегория: {current_subcategory}")
+            
+        elif item['type'] == 'product':
+            # Обрабатываем товар
+            product_name_str = item['name']
+            
+            # Парсим цену
+            price = parse_price(item['price'])
+            if price is None:
+                continue
             
-    return current_category
+            # Определяем категорию:
+            # - Если есть подкатегория, используем её
+            # - Иначе используем родительскую категорию
+            # - Если ничего нет, используем fallback
+            if current_subcategory:
+                category = current_subcategory
+                parent_category = current_parent
+            elif current_parent:
+                category = current_parent
+                parent_category = current_parent
+            else:
+                # Fallback - определяем автоматически
+                category = extract_category(product_name_str)
+                parent_category = None
+            
+            yield (
+                parent_category, category, _clean_product_name(product_name_str),
+                extract_memory(product_name_str), extract_color(product_name_str),
+                extract_country_flag_from_name(product_name_str), price
+            )
+    
+    # Выводим структуру для отладки
+    print(f"Анализ структуры файла завершен: {sum(counts.values())} записей")
+    print(f"  Родительских категорий: {counts['parent']}")
+    print(f"  Подкатегорий: {counts['subcategory']}")
+    print(f"  Товаров: {counts['product']}")
+
+def _clean_product_name(product_name):
+    """Убирает флаги стран и лишние пробелы из названия товара для сохранения"""
+    clean_name = product_name
+    for flag in SUPPORTED_COUNTRY_FLAGS:
+        clean_name = clean_name.replace(flag, '')
+    return re.sub(r'\s+', ' ', clean_name).strip()
 
 def load_price_from_excel_simple_format(file_path, markup_amount=None, source='simple'):
     """
-    Загружает прайс из Excel файла с простым форматом: два столбца (название, цена).
-    Теперь поддерживает динамическое извлечение категорий из заголовков в файле.
+    Загружает прайс из Excel или CSV/TSV файла с простым форматом: два столбца (название, цена).
+    Поддерживает динамическое извлечение категорий из заголовков в файле
+    и книги с несколькими листами (например, лист на бренд).
     """
     if markup_amount is None:
         markup_amount = get_markup_amount()
     
     try:
-        df = pd.read_excel(file_path)
-        
-        # Используем новую версию извлечения категорий
-        structure = extract_categories_from_excel_v2(file_path)
-        print(f"Анализ структуры файла завершен: {len(structure)} записей")
-        
-        # Выводим структуру для отладки
-        parent_count = sum(1 for item in structure.values() if item['type'] == 'parent')
-        subcat_count = sum(1 for item in structure.values() if item['type'] == 'subcategory')
-        product_count = sum(1 for item in structure.values() if item['type'] == 'product')
-        print(f"  Родительских категорий: {parent_count}")
-        print(f"  Подкатегорий: {subcat_count}")
-        print(f"  Товаров: {product_count}")
-        
-        products_loaded = 0
-        current_parent = None
-        current_subcategory = None
-        
-        with get_db() as conn:
-            cur = conn.cursor()
-            
-            # Очищаем старые данные только этого типа прайса перед загрузкой нового
-            cur.execute("DELETE FROM products WHERE source = ?", (source,))
-            
-            for idx, row in df.iterrows():
-                # Проверяем, есть ли эта строка в структуре
-                if idx not in structure:
-                    continue
-                
-                item = structure[idx]
-                
-                if item['type'] == 'parent':
-                    # Обновляем текущую родительскую категорию
-                    current_parent = item['name']
-                    current_subcategory = None
-                    print(f"  Родительская категория: {current_parent}")
-                    
-                elif item['type'] == 'subcategory':
-                    # Обновляем текущую подкатегорию
-                    current_subcategory = item['name']
-                    print(f"    Подкатегория: {current_subcategory}")
-                    
-                elif item['type'] == 'product':
-                    # Обрабатываем товар
-                    product_name_str = item['name']
-                    price_str = item['price']
-                    
-                    # Определяем категорию:
-                    # - Если есть подкатегория, используем её
-                    # - Иначе используем родительскую категорию
-                    # - Если ничего нет, используем fallback
-                    if current_subcategory:
-                        category = current_subcategory
-                        parent_category = current_parent
-                    elif current_parent:
-                        category = current_parent
-                        parent_category = current_parent
-                    else:
-                        # Fallback - определяем автоматически
-                        category = extract_category(product_name_str)
-                        parent_category = None
-                    
-                    # Извлекаем данные из названия
-                    memory = extract_memory(product_name_str)
-                    color = extract_color(product_name_str)
-                    country_flag = extract_country_flag_from_name(product_name_str)
-                    
-                    # Если флаг не найден, используем None
-                    if not country_flag:
-                        country = None
-                    else:
-                        country = country_flag
-                    
-                    # Парсим цену
-                    price = parse_price(price_str)
-                    
-                    if price is None:
-                        continue
-                    
-                    # Убираем флаг и лишние пробелы из названия для сохранения
-                    clean_name = product_name_str
-                    # Убираем флаги
-                    for flag in SUPPORTED_COUNTRY_FLAGS:
-                        clean_name = clean_name.replace(flag, '')
-                    clean_name = re.sub(r'\s+', ' ', clean_name).strip()
-                    
-                    # Сохраняем в БД
-                    try:
-                        cur.execute("""
-                            INSERT INTO products (parent_category, category, name, memory, color, country, price, source)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                        """, (parent_category, category, clean_name, memory, color, country, price, source))
-                        
-                        products_loaded += 1
-                    except Exception as e:
-                        print(f"Ошибка при сохранении товара: {e}")
-                        continue
-            
-            conn.commit()
-        
+        rows = read_products(file_path, parse_simple_rows)
+        products_loaded = store_products(rows, source)
         print(f"Загружено товаров: {products_loaded}")
         return products_loaded
     
@@ -1081,6 +1217,7 @@ def load_price_from_excel_auto(file_path, markup_amount=None, source='standard')
     Поддерживает два формата:
     1. Стандартный (много столбцов с заголовками)
     2. Простой (2 столбца: название с памятью/цветом/флагом, цена)
+    Файл - книга Excel или CSV/TSV (читается потоково модулем csv): путь или загруженный файл (file-like).
     """
     file_format = detect_file_format(file_path)
     
@@ -1092,100 +1229,13 @@ def load_price_from_excel_auto(file_path, markup_amount=None, source='standard')
         return load_price_from_excel(file_path, markup_amount, source)
 
 def load_preorder_price_from_excel(file_path, markup_amount=None):
-    """Загружает прайс предзаказа из Excel файла в таблицу preorder_products"""
+    """Загружает прайс предзаказа из Excel файла (все листы книги) или CSV/TSV в таблицу preorder_products"""
     if markup_amount is None:
         markup_amount = get_preorder_markup_amount()
     
     try:
-        df = pd.read_excel(file_path)
-        
-        current_category = None
-        current_product_name = None
-        products_loaded = 0
-        
-        with get_db() as conn:
-            cur = conn.cursor()
-            
-            # Очищаем старые данные предзаказа перед загрузкой нового
-            cur.execute("DELETE FROM preorder_products")
-            
-            for idx, row in df.iterrows():
-                # Проверяем количество колонок в строке
-                num_cols = len(row)
-                if num_cols == 0:
-                    continue
-                
-                # Первая колонка - название товара
-                col1 = row.iloc[0] if num_cols > 0 else None
-                
-                if pd.notna(col1):
-                    col1_str = str(col1)
-                    # Проверяем, является ли это заголовком товара (с эмодзи)
-                    if any(emoji in col1_str for emoji in ['📱', '⌚', '🔳', '💻', '🖥', '🎧', '⌨️', '🖊']):
-                        # Это новый товар
-                        current_product_name = col1_str
-                        current_category = extract_category(col1_str)
-                        continue
-                
-                # Если есть категория и название товара, обрабатываем строку с данными
-                if current_category and current_product_name:
-                    # Безопасно извлекаем данные из строки с проверкой индексов
-                    model_code = None
-                    country_flag = None
-                    stock = None
-                    price_str = None
-                    quantity = None
-                    
-                    if num_cols > 0:
-                        model_code = str(row.iloc[0]) if pd.notna(row.iloc[0]) else None
-                    if num_cols > 1:
-                        # Колонка B (индекс 1) - страна с флагом
-                        country_flag_raw = row.iloc[1]
-                        if pd.notna(country_flag_raw):
-                            country_flag = str(country_flag_raw).strip()
-                        else:
-                            country_flag = None
-                    if num_cols > 2:
-                        stock = str(row.iloc[2]) if pd.notna(row.iloc[2]) else None
-                    if num_cols > 3:
-                        # Колонка D (индекс 3) - цена
-                        price_str = row.iloc[3] if pd.notna(row.iloc[3]) else None
-                    if num_cols > 4:
-                        # Колонка E (индекс 4) - количество
-                        quantity = row.iloc[4] if pd.notna(row.iloc[4]) else None
-                    
-                    # Проверяем, что это не пустая строка и есть модель
-                    if not model_code or model_code == 'nan' or model_code == 'None':
-                        continue
-                    
-                    # Извлекаем данные
-                    memory = extract_memory(current_product_name)
-                    color = extract_color(current_product_name)
-                    country = parse_country(country_flag)
-                    price = parse_price(price_str)
-                    
-                    if price is None:
-                        continue
-                    
-                    # Сохраняем базовую цену БЕЗ наценки (наценка будет применяться при отображении)
-                    # Формируем полное название товара
-                    full_name = re.sub(r'[📱⌚🔳💻🖥🎧⌨️🖊]', '', current_product_name).strip()
-                    
-                    # Сохраняем в БД предзаказа
-                    try:
-                        cur.execute("""
-                            INSERT INTO preorder_products (category, name, memory, color, country, price)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        """, (current_category, full_name, memory, color, country, price))
-                        
-                        products_loaded += 1
-                    except Exception as e:
-                        # Пропускаем проблемные записи, но продолжаем обработку
-                        continue
-            
-            conn.commit()
-        
-        return products_loaded
+        rows = read_products(file_path, parse_standard_rows)
+        return store_preorder_products(rows)
     
     except Exception as e:
         # Упрощенное сообщение об ошибке
@@ -1194,113 +1244,74 @@ def load_preorder_price_from_excel(file_path, markup_amount=None):
             error_msg = "Ошибка: файл имеет неожиданную структуру. Проверьте, что файл содержит все необходимые колонки."
         raise Exception(f"Ошибка при загрузке прайса предзаказа: {error_msg}")
 
+def parse_preorder_simple_rows(rows):
+    """
+    Разбирает строки простого формата предзаказа: два столбца (название, цена).
+    В названии заложены: память, цвет и страна (флаг), категория определяется по названию.
+    Генерирует кортежи (parent_category, category, name, memory, color, country, price).
+    """
+    for values in rows:
+        # Проверяем количество колонок в строке
+        if len(values) < 2:
+            continue
+        
+        # Первая колонка - название товара (с памятью, цветом и флагом страны)
+        product_name = values[0] if pd.notna(values[0]) else None
+        
+        # Вторая колонка - цена
+        price_str = values[1] if pd.notna(values[1]) else None
+        
+        if not product_name:
+            continue
+        
+        product_name_str = str(product_name).strip()
+        
+        # Пропускаем пустые строки и строки с "None" или "nan"
+        if not product_name_str or product_name_str.lower() in ('nan', 'none'):
+            continue
+        
+        # Пропускаем заголовки категорий (все заглавные буквы, без цены)
+        price_is_none = price_str is None or str(price_str).strip().lower() in ('nan', 'none')
+        if product_name_str.upper() in BRAND_HEADERS and price_is_none:
+            continue
+        
+        # Парсим цену
+        price = parse_price(price_str)
+        if price is None:
+            continue
+        
+        # Сохраняем базовую цену БЕЗ наценки (наценка будет применяться при отображении)
+        # Название сохраняется без флага страны
+        yield (
+            None, extract_category(product_name_str), _clean_product_name(product_name_str),
+            extract_memory(product_name_str), extract_color(product_name_str),
+            extract_country_flag_from_name(product_name_str), price
+        )
+
 def load_preorder_price_from_excel_simple_format(file_path, markup_amount=None):
     """
-    Загружает прайс предзаказа из Excel файла с простым форматом: два столбца (название, цена).
+    Загружает прайс предзаказа из Excel или CSV/TSV файла с простым форматом: два столбца (название, цена).
     В названии заложены: память, цвет и страна (флаг).
     """
     if markup_amount is None:
         markup_amount = get_preorder_markup_amount()
     
     try:
-        df = pd.read_excel(file_path)
-        
-        products_loaded = 0
-        
-        # Список заголовков категорий, которые нужно пропускать
-        category_headers = ['YANDEX', 'META', 'NINTENDO', 'VALVE', 'SONY', 'GOOGLE', 
-                           'GOPRO', 'INSTA360', 'HONOR', 'HUAWEI', 'APPLE', 'SAMSUNG',
-                           'XIAOMI', 'VIVO', 'REALME', 'GARMIN']
-        
-        with get_db() as conn:
-            cur = conn.cursor()
-            
-            # Очищаем старые данные предзаказа перед загрузкой нового
-            cur.execute("DELETE FROM preorder_products")
-            
-            for idx, row in df.iterrows():
-                # Проверяем количество колонок в строке
-                num_cols = len(row)
-                if num_cols < 2:
-                    continue
-                
-                # Первая колонка - название товара (с памятью, цветом и флагом страны)
-                product_name = row.iloc[0] if pd.notna(row.iloc[0]) else None
-                
-                # Вторая колонка - цена
-                price_str = row.iloc[1] if pd.notna(row.iloc[1]) else None
-                
-                if not product_name or pd.isna(product_name):
-                    continue
-                
-                product_name_str = str(product_name).strip()
-                
-                # Пропускаем пустые строки и строки с "None" или "nan"
-                if not product_name_str or product_name_str.lower() in ('nan', 'none'):
-                    continue
-                
-                # Пропускаем заголовки категорий (все заглавные буквы, без цены)
-                price_is_none = pd.isna(price_str) if price_str is not None else True
-                if price_str is not None and str(price_str).strip().lower() in ('nan', 'none'):
-                    price_is_none = True
-                if product_name_str.upper() in category_headers and price_is_none:
-                    continue
-                
-                # Извлекаем данные из названия
-                memory = extract_memory(product_name_str)
-                color = extract_color(product_name_str)
-                country_flag = extract_country_flag_from_name(product_name_str)
-                
-                # Если флаг не найден, используем None
-                if not country_flag:
-                    country = None
-                else:
-                    country = country_flag
-                
-                # Определяем категорию
-                category = extract_category(product_name_str)
-                
-                # Парсим цену
-                price = parse_price(price_str)
-                
-                if price is None:
-                    continue
-                
-                # Сохраняем базовую цену БЕЗ наценки (наценка будет применяться при отображении)
-                # Убираем флаг и лишние пробелы из названия для сохранения
-                # Оставляем только название модели с памятью и цветом (без флага)
-                clean_name = product_name_str
-                # Убираем флаги
-                for flag in SUPPORTED_COUNTRY_FLAGS:
-                    clean_name = clean_name.replace(flag, '')
-                clean_name = re.sub(r'\s+', ' ', clean_name).strip()
-                
-                # Сохраняем в БД предзаказа
-                try:
-                    cur.execute("""
-                        INSERT INTO preorder_products (category, name, memory, color, country, price)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, (category, clean_name, memory, color, country, price))
-                    
-                    products_loaded += 1
-                except Exception as e:
-                    # Пропускаем проблемные записи, но продолжаем обработку
-                    continue
-            
-            conn.commit()
-        
-        return products_loaded
+        rows = read_products(file_path, parse_preorder_simple_rows)
+        return store_preorder_products(rows)
     
     except Exception as e:
         error_msg = str(e)
         raise Exception(f"Ошибка при загрузке прайса предзаказа: {error_msg}")
 
+
 def load_preorder_price_from_excel_auto(file_path, markup_amount=None):
     """
     Автоматически определяет формат файла и загружает прайс предзаказа.
     Поддерживает два формата:
     1. Стандартный (много столбцов с заголовками)
     2. Простой (2 столбца: название с памятью/цветом/флагом, цена)
+    Файл - книга Excel или CSV/TSV (читается потоково модулем csv): путь или загруженный файл (file-like).
     """
     file_format = detect_file_format(file_path)
     
@@ -0,0 +1,314 @@
+"""
+Бенчмарк горячих путей каталога: фильтры роутинга, маппинг категорий,
+вывод списка товаров, корзина и оформление заказа.
+
+Работает офлайн: временная SQLite база, заполненная синтетическим каталогом
+(по умолчанию 1k/10k/100k товаров), и бот с подменной сессией вместо Telegram API.
+
+Запуск:
+    python bench/catalog.py                                # все размеры, JSON в stdout
+    python bench/catalog.py --sizes 1000 10000 --out after.json
+    python bench/catalog.py --out after.json --compare before.json
+"""
+import argparse
+import asyncio
+import atexit
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Временная база и окружение задаются до импорта модулей проекта (config читает их при импорте)
+_db_dir = tempfile.mkdtemp(prefix='phonemarketbot-bench-')
+atexit.register(shutil.rmtree, _db_dir, ignore_errors=True)
+os.environ['DATABASE_PATH'] = os.path.join(_db_dir, 'bench.db')
+os.environ.setdefault('METRICS_ENABLED', '0')
+os.environ.setdefault('SQL_TRACE', '0')
+os.environ.setdefault('ADMIN_IDS', '')
+sys.path.insert(0, ROOT)
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Chat, Message, User
+
+from db.models import get_db, init_db
+from db.crud import add_to_cart, create_order, get_dynamic_parent_to_subcategories
+from services.history import make_product_key
+from services.ordering import sort_key_value
+from services.category import bump_catalog_version, rebuild_all_category_trees
+from bot.handlers import user as user_handlers
+
+BENCH_USER_ID = 100500
+BOT_ID = 42
+
+# Бренды каталога: (родительская категория, линейки моделей)
+BRANDS = [
+    ('Apple', ['iPhone', 'iPad', 'MacBook', 'AirPods', 'Apple Watch']),
+    ('Samsung', ['Samsung Galaxy S', 'Samsung Galaxy A', 'Samsung Galaxy Z']),
+    ('Google Pixel', ['Google Pixel']),
+    ('Xiaomi', ['Xiaomi']),
+    ('Redmi', ['Redmi Note']),
+    ('POCO', ['POCO X', 'POCO F']),
+    ('Honor', ['Honor']),
+    ('Huawei', ['Huawei Pura']),
+    ('Sony', ['Sony PlayStation']),
+    ('Dyson', ['Dyson']),
+]
+MEMORY = ['64GB', '128GB', '256GB', '512GB', '1TB', '2TB']
+COLORS = ['Black', 'White', 'Blue', 'Natural Titanium', 'Desert', 'Pink', 'Green']
+COUNTRIES = ['🇺🇸 eSim', '🇯🇵 Sim + eSIM', '🇭🇰 Sim + eSIM', '🇪🇺', '🇮🇳 Sim + eSIM']
+
+class FakeSession(BaseSession):
+    """Сессия бота без сети: отвечает на вызовы API и считает отправленные сообщения"""
+
+    def __init__(self):
+        super().__init__()
+        self.sent = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        if name == 'GetMe':
+            return User(id=BOT_ID, is_bot=True, first_name='bench', username='bench_bot')
+        if name == 'SendMessage':
+            self.sent += 1
+            return Message(
+                message_id=self.sent,
+                date=datetime.datetime.now(),
+                chat=Chat(id=method.chat_id, type='private'),
+                text=method.text
+            )
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+def _subcategory_names(count):
+    """Список (родительская категория, подкатегория) заданной длины"""
+    names = []
+    generation = 10
+    while len(names) < count:
+        for parent, lines in BRANDS:
+            for line in lines:
+                names.append((parent, f"{line} {generation}"))
+                if len(names) == count:
+                    return names
+        generation += 1
+    return names
+
+def seed_catalog(size, seed=0):
+    """
+    Заполняет базу синтетическим каталогом из size товаров.
+    Количество подкатегорий растет с размером каталога (~50-100 товаров в подкатегории),
+    каждая пятая подкатегория загружена из простого формата (source='simple').
+    Возвращает список подкатегорий в порядке заполнения.
+    """
+    rnd = random.Random(seed)
+    subcategories = _subcategory_names(max(20, size // 100))
+
+    rows = []
+    for i in range(size):
+        sub_index = i % len(subcategories)
+        parent, category = subcategories[sub_index]
+        source = 'simple' if sub_index % 5 == 4 else 'standard'
+        memory = rnd.choice(MEMORY)
+        color = rnd.choice(COLORS)
+        country = rnd.choice(COUNTRIES)
+        name = f"{category} {memory} {color} #{i}"
+        rows.append((
+            parent, category, name, memory, color, country,
+            rnd.randrange(5000, 250000, 100), source, make_product_key(category, name, memory, color, country),
+            sort_key_value(category)
+        ))
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        for table in ('order_items', 'orders', 'cart', 'preorder_cart', 'products', 'category_tree'):
+            cur.execute(f"DELETE FROM {table}")
+        cur.executemany("""
+            INSERT INTO products (parent_category, category, name, memory, color, country, price, source, product_key, sort_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        rebuild_all_category_trees(cur)
+        bump_catalog_version(cur)
+        conn.commit()
+    with get_db() as conn:
+        conn.execute("VACUUM")
+        conn.execute("ANALYZE")
+    return subcategories
+
+def fill_cart(items):
+    """Кладет в корзину пользователя items разных товаров"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM cart WHERE user_id = ?", (BENCH_USER_ID,))
+        cur.execute("SELECT id FROM products ORDER BY id LIMIT ?", (items,))
+        product_ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    for product_id in product_ids:
+        add_to_cart(BENCH_USER_ID, product_id, quantity=2)
+
+def make_message(bot, text):
+    """Входящее сообщение пользователя, привязанное к боту"""
+    return Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=BENCH_USER_ID, type='private'),
+        from_user=User(id=BENCH_USER_ID, is_bot=False, first_name='bench'),
+        text=text
+    ).as_(bot)
+
+def _summary(timings):
+    """Сводка по замерам в миллисекундах"""
+    ordered = sorted(timings)
+    return {
+        "iterations": len(ordered),
+        "min_ms": round(ordered[0] * 1000, 4),
+        "median_ms": round(statistics.median(ordered) * 1000, 4),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+    }
+
+async def measure(func, repeat, setup=None, warmup=1):
+    """Замеряет func (обычную или async) repeat раз; setup выполняется перед каждым замером вне времени"""
+    timings = []
+    for i in range(warmup + repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        result = func()
+        if asyncio.iscoroutine(result):
+            await result
+        elapsed = time.perf_counter() - started
+        if i >= warmup:
+            timings.append(elapsed)
+    return _summary(timings)
+
+async def run_size(size, repeat):
+    """Все замеры для каталога заданного размера"""
+    started = time.perf_counter()
+    subcategories = seed_catalog(size)
+    seed_seconds = time.perf_counter() - started
+
+    session = FakeSession()
+    bot = Bot(f'{BOT_ID}:BENCH', session=session)
+    state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=BOT_ID, chat_id=BENCH_USER_ID, user_id=BENCH_USER_ID))
+
+    # Текст, не являющийся категорией (например "Корзина"), проходит все фильтры каталога целиком
+    miss_text = "Корзина"
+    last_parent, last_subcategory = subcategories[-1]
+    # Самая большая подкатегория из основного прайса - худший случай вывода списка
+    listing_subcategory = subcategories[0][1]
+
+    results = {}
+    results['is_parent_category_miss'] = await measure(
+        lambda: user_handlers.is_parent_category(miss_text, {}), repeat)
+    results['is_parent_category_hit'] = await measure(
+        lambda: user_handlers.is_parent_category(last_parent, {}), repeat)
+    results['is_subcategory_miss'] = await measure(
+        lambda: user_handlers.is_subcategory(miss_text, {}), repeat)
+    results['is_subcategory_hit'] = await measure(
+        lambda: user_handlers.is_subcategory(last_subcategory, {}), repeat)
+    results['get_dynamic_parent_to_subcategories'] = await measure(
+        lambda: get_dynamic_parent_to_subcategories('standard'), repeat)
+
+    sent_before = session.sent
+    results['show_products_by_category'] = await measure(
+        lambda: user_handlers.show_products_by_category(make_message(bot, listing_subcategory)), repeat)
+    results['show_products_by_category']['messages_per_call'] = (session.sent - sent_before) // (repeat + 1)
+
+    fill_cart(50)
+    results['show_cart_50'] = await measure(
+        lambda: user_handlers.show_cart(make_message(bot, "Корзина"), state), repeat)
+
+    results['create_order_50'] = await measure(
+        lambda: create_order(BENCH_USER_ID, 'bench', 'Bench', 'User'), repeat,
+        setup=lambda: fill_cart(50))
+
+    await bot.session.close()
+    return {
+        "products": size,
+        "subcategories": len(subcategories),
+        "seed_seconds": round(seed_seconds, 3),
+        "results": results,
+    }
+
+def _git_revision():
+    """Текущий коммит репозитория (для сопоставления результатов)"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current, baseline):
+    """Печатает сравнение медиан с сохраненным прогоном (в stderr, чтобы не смешивать с JSON)"""
+    base_sizes = {run['products']: run['results'] for run in baseline['runs']}
+    print(f"{'products':>9} {'benchmark':<38} {'before ms':>11} {'after ms':>11} {'ratio':>7}", file=sys.stderr)
+    for run in current['runs']:
+        base = base_sizes.get(run['products'])
+        if not base:
+            continue
+        for name, stats in run['results'].items():
+            if name not in base:
+                continue
+            before = base[name]['median_ms']
+            after = stats['median_ms']
+            ratio = after / before if before else float('inf')
+            print(f"{run['products']:>9} {name:<38} {before:>11.3f} {after:>11.3f} {ratio:>6.2f}x", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк каталога, корзины и оформления заказа")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="размеры каталога (количество товаров)")
+    parser.add_argument('--repeat', type=int, default=20, help="количество замеров каждого сценария")
+    parser.add_argument('--out', help="файл для JSON с результатами (по умолчанию stdout)")
+    parser.add_argument('--compare', help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    init_db()
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "metrics_enabled": os.environ['METRICS_ENABLED'] == '1',
+        },
+        "runs": [],
+    }
+    for size in args.sizes:
+        print(f"Каталог {size} товаров...", file=sys.stderr)
+        report['runs'].append(asyncio.run(run_size(size, args.repeat)))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Генератор синтетических прайс-листов поставщика в обоих форматах загрузчика.
+
+standard - многоколоночный формат (как data/Price - List 08.11.25.xlsx):
+    строка-заголовок товара с эмодзи ("📱 iPhone 16 Pro 256Gb Desert"),
+    под ней строки предложений: артикул | страна | наличие | цена | количество,
+    группы разделены пустой строкой.
+
+simple - две колонки "Название | Цена" (как 01Все товары (2).xlsx):
+    бренд (APPLE, SAMSUNG...) между пустыми строками, необязательные подкатегории
+    ("Apple iPhone 16 Pro:") и товары с флагом страны в конце названия.
+
+Запуск:
+    python bench/generate_price_lists.py --rows 200000 --format both --out-dir /tmp/prices
+    python bench/generate_price_lists.py --rows 200000 --file-type csv
+"""
+import argparse
+import csv
+import itertools
+import os
+import random
+from openpyxl import Workbook
+
+# Товарные линейки стандартного формата: (эмодзи, модели, варианты памяти/конфигурации, цвета)
+STANDARD_FAMILIES = [
+    ('📱', ['iPhone 13', 'iPhone 14', 'iPhone 15', 'iPhone 15 Plus', 'iPhone 16', 'iPhone 16 Pro',
+           'iPhone 16 Pro Max', 'iPhone 17', 'iPhone 17 Pro', 'iPhone 17 Pro Max', 'iPhone Air'],
+     ['128Gb', '256Gb', '512Gb', '1Tb', '2Tb'],
+     ['Black', 'White', 'Blue', 'Desert', 'Natural', 'Silver', 'Orange', 'Sage', 'Light Gold']),
+    ('🔳', ['iPad 11 Wi-Fi', 'iPad mini 8.3 7th Gen. Wi-Fi', 'iPad Air 11 M3 Wi-Fi', 'iPad Air 13 M3 Wi-Fi + Cellular',
+           'iPad Pro 11 M5 Wi-Fi', 'iPad Pro 13 M5 LTE'],
+     ['128Gb', '256Gb', '512Gb', '1Tb'],
+     ['Silver', 'Space Black', 'Blue', 'Purple', 'Sp. Gray', 'Starlight']),
+    ('💻', ['MacBook Air M3 13 8+', 'MacBook Air M4 13 16+', 'MacBook Air M4 15 24+', 'MacBook Pro M4 14 16+',
+           'MacBook Pro M4 Max 14 128+'],
+     ['256Gb', '512Gb', '1Tb', '2Tb'],
+     ['Midnight', 'Silver', 'Sky Blue', 'Starlight', 'Space Black']),
+    ('⌚', ['Series 10 42mm', 'Series 10 46mm', 'Series 11 46mm', 'Series SE 3 40mm', 'Series Ultra 2 49mm'],
+     ['Sport B S/M', 'Sport B M/L', 'SB M/L CEL', 'Mil Lp M/L'],
+     ['Jet Black', 'Rose Gold', 'Silver', 'Starlight', 'Slate']),
+    ('🎧', ['AirPods 4', 'AirPods 4 ANC', 'AirPods Pro 3', 'AirPods Max USB-C'],
+     [''],
+     ['White', 'Blue', 'Midnight', 'Orange']),
+    ('🖥', ['iMac 24 M4 16+', 'Mac mini M4 16+'],
+     ['256Gb', '512Gb'],
+     ['Silver', 'Blue', 'Pink']),
+    ('⌨️', ['Magic Keyboard 11', 'Magic Keyboard 13'],
+     [''],
+     ['White', 'Black']),
+    ('🖊', ['Apple Pencil Pro', 'Apple Pencil USB-C'],
+     [''],
+     ['White']),
+]
+
+STANDARD_COUNTRIES = ['🇦🇪 AE', '🇮🇳 IN', '🇵🇾 PY', '🇨🇿 CZ', '🇸🇬 SG', '🇧🇷 BR', '🇩🇪 DE', '🇯🇵 JP',
+                      '🇻🇳 VN', '🇨🇦 CA', '🇨🇳 CN', '🇭🇰 HK', '🇬🇧 GB', '🇰🇷 KR', '🇺🇸 US']
+
+# Бренды простого формата: (заголовок бренда, подкатегории или None, модели, конфигурации, цвета)
+SIMPLE_BRANDS = [
+    ('APPLE', ['Apple iPhone 16', 'Apple iPhone 16 Pro', 'Apple iPhone 17', 'Apple iPhone 17 Pro',
+               'Apple iPhone 17 Pro Max'],
+     None, ['256GB', '512GB', '1TB'], ['Black', 'White', 'Desert', 'Silver', 'Orange']),
+    ('SAMSUNG', None,
+     ['Samsung Galaxy A06', 'Samsung Galaxy A17', 'Samsung Galaxy A56 5G', 'Samsung Galaxy S25',
+      'Samsung Galaxy S25+', 'Samsung Galaxy S25 Ultra', 'Samsung Galaxy Z Fold7'],
+     ['4/64', '4/128', '8/256', '12/256', '12/512'], ['Black', 'Navy', 'Mint', 'Silver Shadow', 'Icyblue']),
+    ('XIAOMI', None, ['Xiaomi 15', 'Xiaomi 15T Pro', 'Xiaomi Pad 7'],
+     ['8/256', '12/256', '12/512'], ['Black', 'Grey', 'Blue']),
+    ('REDMI', None, ['Redmi Note 14', 'Redmi Note 14 Pro', 'Redmi 15C'],
+     ['4/128', '8/256'], ['Black', 'Green', 'Purple']),
+    ('POCO', None, ['POCO X7 Pro', 'POCO F7', 'POCO M8 Pro 5G'],
+     ['8/256', '12/512'], ['Black', 'Silver', 'Green']),
+    ('GOOGLE', None, ['Google Pixel 9a 5G', 'Google Pixel 10', 'Google Pixel 10 Pro XL 5G'],
+     ['128', '256', '512'], ['Obsidian', 'Porcelain', 'Jade']),
+    ('HONOR', None, ['Honor X9d', 'Honor 400'], ['8/256', '12/256'], ['Black', 'Silver']),
+    ('SONY', None, ['Sony PlayStation 5 Slim Disk', 'Sony PlayStation 5 Pro'], ['1TB', '2TB'], ['White']),
+    ('NINTENDO', None, ['Nintendo Switch 2', 'Nintendo Switch OLED'], [''], ['Black', 'White']),
+    ('DYSON', None, ['Dyson Airwrap', 'Dyson Supersonic'], [''], ['Nickel/Copper', 'Blue/Blush']),
+]
+
+SIMPLE_FLAGS = ['🇯🇵', '🇪🇺', '🇰🇿', '🇦🇪', '🇮🇳', '🇭🇰', '🇬🇧', '🇺🇸', '🇨🇳', '🇲🇾']
+
+def _format_price(price):
+    """Цена в формате поставщика: "74 550" """
+    return f"{price:,}".replace(',', ' ')
+
+def _join(*parts):
+    """Склеивает непустые части названия через пробел"""
+    return ' '.join(part for part in parts if part)
+
+def _standard_headers(label=''):
+    """Бесконечный поток заголовков товаров; при повторе комбинаций добавляется номер ревизии"""
+    for revision in itertools.count(1):
+        suffix = _join(label, '' if revision == 1 else f"R{revision}")
+        for emoji, models, variants, colors in STANDARD_FAMILIES:
+            for model, variant, color in itertools.product(models, variants, colors):
+                yield emoji, _join(emoji, model, variant, color, suffix)
+
+def iter_standard_rows(rows, seed=0, label=''):
+    """
+    Строки стандартного формата (кортежи из 5 значений), всего примерно rows строк.
+    label добавляется к названиям товаров (разные листы одной книги - разные товары).
+    """
+    rnd = random.Random(seed)
+    yield ('Модель', 'Страна', 'Наличие', 'Цена', 'Кол-во')
+    written = 1
+    for emoji, header in _standard_headers(label):
+        if written >= rows:
+            return
+        yield (header, None, None, None, None)
+        written += 1
+        base_price = rnd.randrange(8000, 300000, 50)
+        for _ in range(rnd.randint(1, 4)):
+            model_code = f"M{rnd.randrange(10000):04X}{rnd.choice('ABCDEFGH')}3 {rnd.choice(['HN', 'AA', 'LZ', 'CH', 'ZP'])}/A"
+            # Наушники и стилусы в реальных прайсах идут с эмодзи вместо страны
+            country = emoji if emoji in ('🎧', '🖊') and rnd.random() < 0.5 else rnd.choice(STANDARD_COUNTRIES)
+            price = base_price + rnd.randrange(0, 6000, 50)
+            yield (model_code, country, 'Stock 1', _format_price(price), float(rnd.randint(1, 700)))
+            written += 1
+        yield (None, None, None, None, None)
+        written += 1
+
+def iter_simple_rows(rows, seed=0, label=''):
+    """Строки простого формата (название, цена), всего примерно rows строк (label - как в iter_standard_rows)"""
+    rnd = random.Random(seed)
+    yield ('Название', 'Цена')
+    written = 1
+    for revision in itertools.count(1):
+        suffix = _join(label, '' if revision == 1 else f"R{revision}")
+        for brand, subcategories, models, variants, colors in SIMPLE_BRANDS:
+            if written >= rows:
+                return
+            yield (None, None)
+            yield (brand, None)
+            yield (None, None)
+            written += 3
+            groups = [(f"{subcategory}:", subcategory) for subcategory in subcategories] if subcategories \
+                else [(None, model) for model in models]
+            for subcategory_row, model in groups:
+                if subcategory_row:
+                    yield (subcategory_row, None)
+                    written += 1
+                for variant, color in itertools.product(variants, colors):
+                    name = _join(model, variant, color, suffix) + rnd.choice(SIMPLE_FLAGS)
+                    yield (name, rnd.randrange(1000, 250000, 100))
+                    written += 1
+                if subcategory_row:
+                    yield (None, None)
+                    written += 1
+
+def write_workbook(path, sheets):
+    """Записывает листы [(название, строки)] в xlsx потоково (openpyxl write_only)"""
+    workbook = Workbook(write_only=True)
+    count = 0
+    for title, row_iter in sheets:
+        sheet = workbook.create_sheet(title)
+        for row in row_iter:
+            sheet.append(row)
+            count += 1
+    workbook.save(path)
+    return count
+
+def write_csv(path, row_iter):
+    """Записывает строки в CSV (или TSV по расширению файла) потоково"""
+    delimiter = '\t' if path.endswith('.tsv') else ','
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        for row in row_iter:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def generate(path, rows, price_format='standard', seed=0, sheets=1):
+    """
+    Создает прайс-лист формата price_format ('standard' | 'simple') из sheets листов
+    (строки делятся между листами поровну), возвращает количество строк.
+    Для путей .csv/.tsv создается текстовый файл (один лист).
+    """
+    iter_rows = iter_simple_rows if price_format == 'simple' else iter_standard_rows
+    if path.endswith(('.csv', '.tsv')):
+        return write_csv(path, iter_rows(rows, seed))
+    if sheets == 1:
+        return write_workbook(path, [('Прайс', iter_rows(rows, seed))])
+    return write_workbook(path, [
+        (f"Прайс {i + 1}", iter_rows(rows // sheets, seed + i, label=f"S{i + 1}"))
+        for i in range(sheets)
+    ])
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетических прайс-листов")
+    parser.add_argument('--rows', type=int, default=10000, help="примерное количество строк в файле")
+    parser.add_argument('--format', choices=['standard', 'simple', 'both'], default='both')
+    parser.add_argument('--out-dir', default='.', help="директория для файлов")
+    parser.add_argument('--sheets', type=int, default=1, help="количество листов в книге")
+    parser.add_argument('--file-type', choices=['xlsx', 'csv', 'tsv'], default='xlsx')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    formats = ['standard', 'simple'] if args.format == 'both' else [args.format]
+    for price_format in formats:
+        sheets_suffix = f"_{args.sheets}sheets" if args.sheets > 1 and args.file_type == 'xlsx' else ''
+        path = os.path.join(args.out_dir, f"price_{price_format}_{args.rows}{sheets_suffix}.{args.file_type}")
+        count = generate(path, args.rows, price_format, args.seed, args.sheets)
+        print(f"{path}: {count} строк")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Отчет о времени импорта при запуске бота (python -X importtime) и проверка регрессий.
+
+Запускает `import main` в отдельном процессе, печатает самые дорогие модули
+и завершается с кодом 1, если при запуске импортированы тяжелые библиотеки
+загрузчика прайсов (pandas, numpy, openpyxl) или превышен бюджет времени.
+
+Запуск:
+    python bench/importtime.py
+    python bench/importtime.py --top 30 --budget-ms 1500 --out importtime.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Библиотеки, которые должны загружаться только при загрузке прайса
+FORBIDDEN_AT_STARTUP = ('pandas', 'numpy', 'openpyxl')
+
+def measure_imports(module='main'):
+    """
+    Импортирует module в новом процессе с -X importtime.
+    Возвращает список (модуль, собственное время мкс, накопленное время мкс) в порядке импорта.
+    """
+    env = dict(os.environ)
+    env.setdefault('BOT_TOKEN', '42:IMPORTTIME')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # Формат строки: "import time:   self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        # Вложенность импорта обозначается отступом после первого пробела
+        imports.append((name[1:].rstrip(), int(self_us), int(cumulative_us)))
+    return imports
+
+def build_report(imports, top=20):
+    """Сводка: общее время, самые дорогие модули верхнего уровня и запрещенные импорты"""
+    # Верхний уровень вложенности (без отступа) - модули, импортированные напрямую
+    top_level = [(name, cumulative) for name, _, cumulative in imports if not name.startswith(' ')]
+    total_us = sum(cumulative for _, cumulative in top_level)
+    modules = {name.strip() for name, _, _ in imports}
+    forbidden = sorted(
+        name for name in modules
+        if name.split('.')[0] in FORBIDDEN_AT_STARTUP
+    )
+    heaviest = sorted(imports, key=lambda item: item[2], reverse=True)[:top]
+    return {
+        "total_ms": round(total_us / 1000, 1),
+        "modules_count": len(modules),
+        "heaviest": [
+            {"module": name.strip(), "cumulative_ms": round(cumulative / 1000, 1), "self_ms": round(self_us / 1000, 1)}
+            for name, self_us, cumulative in heaviest
+        ],
+        "forbidden_imported": forbidden,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Время импорта при запуске бота")
+    parser.add_argument('--module', default='main', help="модуль, импорт которого замеряется")
+    parser.add_argument('--top', type=int, default=20, help="сколько самых дорогих модулей показать")
+    parser.add_argument('--budget-ms', type=float, help="максимально допустимое общее время импорта")
+    parser.add_argument('--out', help="файл для JSON с отчетом")
+    args = parser.parse_args()
+
+    report = build_report(measure_imports(args.module), args.top)
+
+    print(f"Импорт {args.module}: {report['total_ms']} мс, модулей: {report['modules_count']}")
+    for item in report['heaviest']:
+        print(f"  {item['cumulative_ms']:>8.1f} мс  {item['module']}")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failed = False
+    if report['forbidden_imported']:
+        roots = sorted({name.split('.')[0] for name in report['forbidden_imported']})
+        print(f"ОШИБКА: при запуске импортированы {', '.join(roots)} - они должны загружаться только при загрузке прайса")
+        failed = True
+    if args.budget_ms is not None and report['total_ms'] > args.budget_ms:
+        print(f"ОШИБКА: время импорта {report['total_ms']} мс превышает бюджет {args.budget_ms} мс")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
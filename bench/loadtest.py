@@ -0,0 +1,375 @@
+"""
+Нагрузочный тест бота целиком: настоящий Dispatcher из main.py с обоими роутерами,
+сессия бота подменена на in-process заглушку, которая записывает исходящие вызовы API.
+
+Синтетические пользователи параллельно проходят сценарий покупки:
+/start -> Прайс -> категория -> подкатегория -> товар по deep link -> количество ->
+Корзина -> изменение количества -> оформление заказа.
+Администратор загружает прайс в начале и повторно посреди прогона.
+
+Отчет: p50/p95/p99 задержки обработки update (общие и по шагам сценария) и пропускная способность.
+
+Запуск:
+    python bench/loadtest.py --users 100 --sessions 3
+    python bench/loadtest.py --users 200 --api-latency-ms 50 --out load.json
+"""
+import argparse
+import asyncio
+import atexit
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_ID = 1
+BOT_ID = 42
+FIRST_USER_ID = 10000
+
+# Временная база и окружение задаются до импорта модулей проекта (config читает их при импорте)
+_work_dir = tempfile.mkdtemp(prefix='phonemarketbot-load-')
+atexit.register(shutil.rmtree, _work_dir, ignore_errors=True)
+os.environ['DATABASE_PATH'] = os.path.join(_work_dir, 'load.db')
+os.environ['ADMIN_IDS'] = str(ADMIN_ID)
+os.environ.setdefault('SQL_TRACE', '0')
+sys.path.insert(0, ROOT)
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Document, File, Message, Update, User
+
+import main as bot_main
+from db.utils import setup_db
+
+DEEP_LINK_RE = re.compile(r'start=add_(\d+)')
+# Кнопки навигации, которые не являются категориями
+NAVIGATION_BUTTONS = {"Назад", "Прайс", "Предзаказ", "Корзина", "📞 Связаться с администратором", "Админка"}
+
+class FakeSession(BaseSession):
+    """
+    Сессия бота без сети: отвечает на вызовы Bot API правдоподобными объектами
+    и складывает исходящие вызовы в outbox по chat_id.
+    Файлы для скачивания берутся из словаря files {file_path: bytes}.
+    """
+
+    def __init__(self, api_latency=0.0):
+        super().__init__()
+        self.api_latency = api_latency
+        self.outbox = defaultdict(list)
+        self.calls = Counter()
+        self.files = {}
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is not None:
+            self.outbox[chat_id].append(method)
+
+        if name == 'GetMe':
+            return User(id=BOT_ID, is_bot=True, first_name='load', username='load_bot')
+        if name == 'GetFile':
+            return File(file_id=method.file_id, file_unique_id=method.file_id, file_path=f"documents/{method.file_id}")
+        if name in ('SendMessage', 'EditMessageText'):
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.datetime.now(),
+                chat=Chat(id=chat_id or 0, type='private'),
+                text=method.text
+            )
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        for file_path, content in self.files.items():
+            if url.endswith(file_path):
+                for start in range(0, len(content), chunk_size):
+                    yield content[start:start + chunk_size]
+                return
+        raise FileNotFoundError(url)
+
+class LoadStats:
+    """Задержки обработки update по шагам сценария"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.processed = 0
+
+    def add(self, step, elapsed):
+        self.latencies[step].append(elapsed)
+        self.processed += 1
+
+def _percentiles(values):
+    """p50/p95/p99/max в миллисекундах"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+class Client:
+    """Пользователь Telegram: отправляет update в диспетчер и читает ответы бота из outbox"""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, dp, bot, session, stats, user_id):
+        self.dp = dp
+        self.bot = bot
+        self.session = session
+        self.stats = stats
+        self.user = User(id=user_id, is_bot=False, first_name=f"user{user_id}", username=f"user{user_id}")
+        self.chat = Chat(id=user_id, type='private')
+
+    async def _feed(self, step, update):
+        self.session.outbox.pop(self.chat.id, None)
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.stats.errors[f"{step}: {type(e).__name__}"] += 1
+        self.stats.add(step, time.perf_counter() - started)
+        return self.session.outbox.pop(self.chat.id, [])
+
+    def _message(self, **kwargs):
+        return Message(
+            message_id=next(self._update_ids),
+            date=datetime.datetime.now(),
+            chat=self.chat,
+            from_user=self.user,
+            **kwargs
+        )
+
+    async def send_text(self, step, text):
+        update = Update(update_id=next(self._update_ids), message=self._message(text=text))
+        return await self._feed(step, update)
+
+    async def send_document(self, step, file_id, file_name):
+        document = Document(file_id=file_id, file_unique_id=file_id, file_name=file_name)
+        update = Update(update_id=next(self._update_ids), message=self._message(document=document))
+        return await self._feed(step, update)
+
+    async def press(self, step, data):
+        callback = CallbackQuery(
+            id=str(next(self._update_ids)),
+            from_user=self.user,
+            chat_instance=str(self.chat.id),
+            data=data,
+            message=Message(
+                message_id=next(self._update_ids),
+                date=datetime.datetime.now(),
+                chat=self.chat,
+                text="🛒 Ваша корзина"
+            )
+        )
+        update = Update(update_id=next(self._update_ids), callback_query=callback)
+        return await self._feed(step, update)
+
+def _reply_buttons(methods):
+    """Тексты кнопок reply-клавиатуры из последнего ответа с клавиатурой"""
+    for method in reversed(methods):
+        keyboard = getattr(getattr(method, 'reply_markup', None), 'keyboard', None)
+        if keyboard:
+            return [button.text for row in keyboard for button in row if button.text not in NAVIGATION_BUTTONS]
+    return []
+
+def _inline_callbacks(methods, prefix):
+    """callback_data inline-кнопок, начинающиеся с prefix"""
+    result = []
+    for method in methods:
+        keyboard = getattr(getattr(method, 'reply_markup', None), 'inline_keyboard', None)
+        for row in keyboard or []:
+            for button in row:
+                if button.callback_data and button.callback_data.startswith(prefix):
+                    result.append(button.callback_data)
+    return result
+
+def _product_ids(methods):
+    """ID товаров из deep links в списке товаров"""
+    ids = []
+    for method in methods:
+        ids.extend(int(product_id) for product_id in DEEP_LINK_RE.findall(getattr(method, 'text', None) or ''))
+    return ids
+
+async def shopping_session(client, rnd, think_time):
+    """Один сценарий покупки пользователя"""
+
+    async def think():
+        if think_time:
+            await asyncio.sleep(rnd.uniform(0, think_time))
+
+    await client.send_text('start', '/start')
+    await think()
+    replies = await client.send_text('price', 'Прайс')
+    parents = _reply_buttons(replies)
+    if not parents:
+        return
+    await think()
+
+    replies = await client.send_text('parent_category', rnd.choice(parents))
+    product_ids = _product_ids(replies)
+    if not product_ids:
+        subcategories = _reply_buttons(replies)
+        if not subcategories:
+            return
+        await think()
+        replies = await client.send_text('subcategory', rnd.choice(subcategories))
+        product_ids = _product_ids(replies)
+    if not product_ids:
+        return
+
+    for product_id in rnd.sample(product_ids, min(len(product_ids), rnd.randint(1, 3))):
+        await think()
+        await client.send_text('add_to_cart', f'/start add_{product_id}')
+        await client.send_text('quantity', str(rnd.randint(1, 3)))
+
+    await think()
+    replies = await client.send_text('cart', 'Корзина')
+    change_callbacks = _inline_callbacks(replies, 'cart:change_qty:')
+    if change_callbacks:
+        await think()
+        await client.press('change_quantity', rnd.choice(change_callbacks))
+
+    if _inline_callbacks(replies, 'cart:checkout'):
+        await think()
+        await client.press('checkout', 'cart:checkout')
+
+async def admin_upload(client, price_file):
+    """Загрузка прайса администратором: кнопка меню и документ"""
+    await client.send_text('admin_upload_prompt', '📊 Загрузить прайс')
+    replies = await client.send_document('admin_upload', 'price', os.path.basename(price_file))
+    texts = [getattr(method, 'text', '') or '' for method in replies]
+    if not any('успешно загружен' in text for text in texts):
+        client.stats.errors['admin_upload: ' + (texts[-1][:80] if texts else 'нет ответа')] += 1
+
+async def run(args):
+    setup_db()
+    session = FakeSession(api_latency=args.api_latency_ms / 1000)
+    with open(args.price, 'rb') as f:
+        session.files['documents/price'] = f.read()
+    bot = Bot(f'{BOT_ID}:LOAD', session=session)
+    dp = bot_main.create_dispatcher()
+    stats = LoadStats()
+
+    admin = Client(dp, bot, session, stats, ADMIN_ID)
+    # Начальная загрузка прайса (в статистику прогона не входит)
+    await admin_upload(admin, args.price)
+    stats.latencies.clear()
+    stats.processed = 0
+    if stats.errors:
+        raise SystemExit(f"Не удалось загрузить прайс {args.price}: {dict(stats.errors)}")
+
+    rnd = random.Random(args.seed)
+    clients = [Client(dp, bot, session, stats, FIRST_USER_ID + i) for i in range(args.users)]
+    upload_done = asyncio.Event()
+
+    async def user_loop(client, client_rnd):
+        for _ in range(args.sessions):
+            await shopping_session(client, client_rnd, args.think_ms / 1000)
+
+    async def admin_loop():
+        # Повторная загрузка прайса, когда обработана примерно половина update
+        while stats.processed < args.upload_at and not all_users.done():
+            await asyncio.sleep(0.01)
+        if not all_users.done():
+            await admin_upload(admin, args.price)
+        upload_done.set()
+
+    started = time.perf_counter()
+    all_users = asyncio.gather(*(user_loop(client, random.Random(rnd.random())) for client in clients))
+    admin_task = asyncio.create_task(admin_loop())
+    await all_users
+    await admin_task
+    wall = time.perf_counter() - started
+    await bot.session.close()
+
+    all_latencies = [value for values in stats.latencies.values() for value in values]
+    return {
+        "config": {
+            "users": args.users,
+            "sessions": args.sessions,
+            "think_ms": args.think_ms,
+            "api_latency_ms": args.api_latency_ms,
+            "price": os.path.relpath(args.price, ROOT),
+            "seed": args.seed,
+        },
+        "wall_seconds": round(wall, 3),
+        "updates": stats.processed,
+        "throughput_updates_per_second": round(stats.processed / wall, 1) if wall else 0,
+        "latency": _percentiles(all_latencies),
+        "steps": {step: _percentiles(values) for step, values in sorted(stats.latencies.items())},
+        "admin_upload_during_run": bool(stats.latencies.get('admin_upload')),
+        "telegram_calls": dict(session.calls.most_common()),
+        "errors": dict(stats.errors),
+    }
+
+def print_report(report):
+    """Краткий отчет в stderr"""
+    latency = report['latency']
+    print(
+        f"updates: {report['updates']}, время: {report['wall_seconds']} с, "
+        f"пропускная способность: {report['throughput_updates_per_second']} update/с",
+        file=sys.stderr
+    )
+    print(f"задержка: p50 {latency['p50_ms']} мс, p95 {latency['p95_ms']} мс, p99 {latency['p99_ms']} мс, max {latency['max_ms']} мс", file=sys.stderr)
+    print(f"{'шаг':<22} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}", file=sys.stderr)
+    for step, values in report['steps'].items():
+        print(
+            f"{step:<22} {values['count']:>7} {values['p50_ms']:>9} {values['p95_ms']:>9} "
+            f"{values['p99_ms']:>9} {values['max_ms']:>9}",
+            file=sys.stderr
+        )
+    if report['errors']:
+        print(f"ошибки: {report['errors']}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест диспетчера бота с заглушкой Telegram API")
+    parser.add_argument('--users', type=int, default=100, help="количество одновременных пользователей")
+    parser.add_argument('--sessions', type=int, default=3, help="сценариев покупки на пользователя")
+    parser.add_argument('--think-ms', type=float, default=0, help="максимальная пауза пользователя между действиями")
+    parser.add_argument('--api-latency-ms', type=float, default=0, help="задержка ответа Telegram API")
+    parser.add_argument('--upload-at', type=int, default=1000,
+                        help="после скольких update администратор повторно загружает прайс")
+    parser.add_argument('--price', default=os.path.join(ROOT, 'data', 'Price - List 08.11.25.xlsx'),
+                        help="прайс-лист, который загружает администратор")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="файл для JSON с результатами (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    # Отладочный вывод обработчиков (print) не смешиваем с отчетом
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        report = asyncio.run(run(args))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    print_report(report)
+
+if __name__ == '__main__':
+    main()
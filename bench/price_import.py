@@ -0,0 +1,225 @@
+"""
+Бенчмарк загрузки прайса по этапам: чтение файла (Excel или CSV), классификация строк,
+извлечение полей товара и запись в базу (вместе с историей цен).
+Для сравнения замеряется и полная загрузка штатной функцией загрузчика
+(листы многолистовой книги она разбирает параллельно в пуле процессов,
+этапы здесь выполняются последовательно).
+
+Файлы генерируются bench/generate_price_lists.py (или передаются через --file).
+
+Запуск:
+    python bench/price_import.py --rows 10000 50000 200000
+    python bench/price_import.py --rows 100000 --sheets 8
+    python bench/price_import.py --rows 200000 --file-type xlsx csv
+    python bench/price_import.py --file "data/Price - List 08.11.25.xlsx" --out import.json
+"""
+import argparse
+import atexit
+import datetime
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_work_dir = tempfile.mkdtemp(prefix='phonemarketbot-import-')
+atexit.register(shutil.rmtree, _work_dir, ignore_errors=True)
+os.environ['DATABASE_PATH'] = os.path.join(_work_dir, 'import.db')
+os.environ.setdefault('METRICS_ENABLED', '0')
+os.environ.setdefault('SQL_TRACE', '0')
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+
+from admin import price_loader
+from db.models import get_db, init_db
+from services.history import make_product_key, record_price_changes
+from services.ordering import sort_key_value
+from services.category import rebuild_category_tree
+from generate_price_lists import generate
+
+HEADER_EMOJIS = ['📱', '⌚', '🔳', '💻', '🖥', '🎧', '⌨️', '🖊']
+
+class StageTimer:
+    """Замеры этапов загрузки в секундах"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        self.stages[name] = round(time.perf_counter() - started, 4)
+        return result
+
+def _insert(rows, source):
+    """Этап записи: очистка прайса, вставка товаров, история цен и дерево категорий в одной транзакции"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM products WHERE source = ?", (source,))
+        cur.executemany("""
+            INSERT INTO products (parent_category, category, name, memory, color, country, price, source, product_key, sort_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        record_price_changes(cur, source)
+        rebuild_category_tree(cur, source)
+        conn.commit()
+    return len(rows)
+
+def _read(path):
+    """Этап чтения: строки всех листов книги Excel (или одного CSV) как кортежи значений"""
+    if price_loader.is_csv_file(path):
+        return [list(price_loader.iter_csv_rows(path))]
+    return [list(price_loader.iter_sheet_rows(df)) for df in pd.read_excel(path, None).values()]
+
+def _classify_standard(sheets):
+    """Этап классификации стандартного формата: заголовки товаров (с эмодзи) и строки предложений"""
+    offers = []
+    current_header = None
+    for row in (row for rows in sheets for row in rows):
+        if not row:
+            continue
+        col1 = row[0]
+        if pd.notna(col1):
+            col1_str = str(col1)
+            if any(emoji in col1_str for emoji in HEADER_EMOJIS):
+                current_header = col1_str
+                continue
+        if current_header and pd.notna(col1) and str(col1) not in ('nan', 'None'):
+            offers.append((current_header, row))
+    return offers
+
+def _extract_standard(offers):
+    """Этап извлечения полей стандартного формата (теми же функциями, что и загрузчик)"""
+    rows = []
+    for header, row in offers:
+        price = price_loader.parse_price(row[3] if len(row) > 3 else None)
+        if price is None:
+            continue
+        category = price_loader.extract_category(header)
+        name = re.sub(r'[📱⌚🔳💻🖥🎧⌨️🖊]', '', header).strip()
+        country = price_loader.parse_country(row[1] if len(row) > 1 else None)
+        memory = price_loader.extract_memory(header)
+        color = price_loader.extract_color(header)
+        rows.append((
+            None, category, name, memory, color, country, price, 'standard',
+            make_product_key(category, name, memory, color, country), sort_key_value(category)
+        ))
+    return rows
+
+def _classify_simple(sheets):
+    """Этап классификации простого формата: iter_simple_structure для каждого листа"""
+    return [dict(price_loader.iter_simple_structure(rows)) for rows in sheets]
+
+def _extract_simple(structures):
+    """Этап извлечения полей простого формата (категории не переходят между листами)"""
+    rows = []
+    for structure in structures:
+        current_parent = None
+        current_subcategory = None
+        for idx in sorted(structure):
+            item = structure[idx]
+            if item['type'] == 'parent':
+                current_parent = item['name']
+                current_subcategory = None
+            elif item['type'] == 'subcategory':
+                current_subcategory = item['name']
+            else:
+                price = price_loader.parse_price(item['price'])
+                if price is None:
+                    continue
+                name = item['name']
+                category = current_subcategory or current_parent or price_loader.extract_category(name)
+                country = price_loader.extract_country_flag_from_name(name)
+                clean_name = price_loader._clean_product_name(name)
+                memory = price_loader.extract_memory(name)
+                color = price_loader.extract_color(name)
+                rows.append((
+                    current_parent, category, clean_name, memory, color, country, price, 'simple',
+                    make_product_key(category, clean_name, memory, color, country), sort_key_value(category)
+                ))
+    return rows
+
+def bench_file(path):
+    """Замеры всех этапов для одного файла"""
+    price_format = price_loader.detect_file_format(path)
+    timer = StageTimer()
+    sheets = timer.run('read', _read, path)
+    if price_format == 'simple':
+        structures = timer.run('classify', _classify_simple, sheets)
+        rows = timer.run('extract', _extract_simple, structures)
+        loader = price_loader.load_price_from_excel_simple_format
+    else:
+        offers = timer.run('classify', _classify_standard, sheets)
+        rows = timer.run('extract', _extract_standard, offers)
+        loader = price_loader.load_price_from_excel
+    timer.run('insert', _insert, rows, price_format)
+
+    # Полная загрузка штатной функцией (отладочный вывод загрузчика подавляется)
+    with open(os.devnull, 'w') as devnull, mock.patch('sys.stdout', devnull):
+        products = timer.run('loader_total', loader, path)
+
+    return {
+        "file": os.path.basename(path),
+        "format": price_format,
+        "sheets": len(sheets),
+        "rows": sum(len(rows) + 1 for rows in sheets),
+        "products": products,
+        "stage_products": len(rows),
+        "stages_seconds": timer.stages,
+        "stages_total_seconds": round(sum(v for k, v in timer.stages.items() if k != 'loader_total'), 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов загрузки прайса")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 50000],
+                        help="размеры генерируемых прайсов (строк)")
+    parser.add_argument('--format', choices=['standard', 'simple', 'both'], default='both')
+    parser.add_argument('--sheets', type=int, default=1, help="количество листов в генерируемых книгах")
+    parser.add_argument('--file-type', nargs='+', choices=['xlsx', 'csv'], default=['xlsx'],
+                        help="типы генерируемых файлов (CSV всегда из одного листа)")
+    parser.add_argument('--file', nargs='+', help="готовые прайс-листы вместо генерации")
+    parser.add_argument('--out', help="файл для JSON с результатами (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    init_db()
+    files = args.file or []
+    if not files:
+        formats = ['standard', 'simple'] if args.format == 'both' else [args.format]
+        for rows in args.rows:
+            for price_format in formats:
+                for file_type in args.file_type:
+                    path = os.path.join(_work_dir, f"price_{price_format}_{rows}_{args.sheets}.{file_type}")
+                    print(f"Генерация {path}...", file=sys.stderr)
+                    generate(path, rows, price_format, sheets=args.sheets)
+                    files.append(path)
+
+    results = []
+    for path in files:
+        print(f"Загрузка {os.path.basename(path)}...", file=sys.stderr)
+        result = bench_file(path)
+        results.append(result)
+        stages = ', '.join(f"{name} {seconds:.2f} с" for name, seconds in result['stages_seconds'].items())
+        print(f"  {result['products']} товаров: {stages}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            "pandas": pd.__version__,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
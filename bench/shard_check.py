@@ -0,0 +1,257 @@
+"""
+Проверка webhook с несколькими процессами-обработчиками (bot/webhook.py) на локальном
+источнике update: настоящий супервизор и процессы с Dispatcher из main.py, сессия бота
+подменена заглушкой без сети, update отправляются HTTP-запросами на endpoint webhook.
+
+Каждый пользователь отправляет сценарий /start -> Прайс -> (/start add_<id> -> количество) x N,
+не дожидаясь обработки (как Telegram при webhook). Проверяется, что:
+- все update одного пользователя обработаны одним процессом и строго по порядку;
+- состояние FSM (ввод количества) не потерялось: корзина каждого пользователя совпадает с ожидаемой;
+- update распределены по всем процессам.
+
+Запуск:
+    python bench/shard_check.py --workers 1 4 --users 200
+    python bench/shard_check.py --workers 4 --users 500 --api-latency-ms 20 --out shard.json
+"""
+import argparse
+import asyncio
+import atexit
+import datetime
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_ID = 42
+FIRST_USER_ID = 10000
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_SECRET = 'shard-check'
+
+_work_dir = tempfile.mkdtemp(prefix='phonemarketbot-shard-')
+atexit.register(shutil.rmtree, _work_dir, ignore_errors=True)
+os.environ['DATABASE_PATH'] = os.path.join(_work_dir, 'shard.db')
+os.environ.setdefault('METRICS_ENABLED', '0')
+os.environ.setdefault('SQL_TRACE', '0')
+sys.path.insert(0, ROOT)
+
+import aiohttp
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, User
+
+import main as bot_main
+from admin.price_loader import store_products
+from bot import webhook
+from db.models import get_db
+from db.utils import setup_db
+
+class FakeSession(BaseSession):
+    """Сессия бота без сети: правдоподобные ответы на вызовы Bot API"""
+
+    def __init__(self, api_latency=0.0):
+        super().__init__()
+        self.api_latency = api_latency
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        name = type(method).__name__
+        if name == 'GetMe':
+            return User(id=BOT_ID, is_bot=True, first_name='shard', username='shard_bot')
+        if name == 'SendMessage':
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.datetime.now(),
+                chat=Chat(id=method.chat_id, type='private'),
+                text=method.text
+            )
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise FileNotFoundError(url)
+        yield b''
+
+def make_factories(journal, api_latency):
+    """Фабрики бота и диспетчера для процессов-обработчиков; диспетчер пишет журнал обработки update"""
+
+    def bot_factory():
+        return Bot(token=f"{BOT_ID}:SHARD", session=FakeSession(api_latency))
+
+    def dispatcher_factory():
+        dp = bot_main.create_dispatcher()
+
+        async def record(handler, event, data):
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                user = event.event.from_user if event.event else None
+                journal.put((user.id if user else None, event.update_id, os.getpid(),
+                             started, time.perf_counter()))
+
+        dp.update.outer_middleware(record)
+        return dp
+
+    return bot_factory, dispatcher_factory
+
+def seed_products(count=50):
+    """Товары для добавления в корзину (обычная загрузка прайса)"""
+    store_products([
+        ('Apple', f'iPhone {16 + i % 2}', f'iPhone {16 + i % 2} {i}', '256 Gb', 'Black', '🇺🇸', 50000 + i)
+        for i in range(count)
+    ], 'standard')
+    with get_db() as conn:
+        return [row[0] for row in conn.execute("SELECT id FROM products ORDER BY id")]
+
+def user_scenario(user_id, product_ids, rnd, items):
+    """Тексты сообщений пользователя и ожидаемая корзина {product_id: количество}"""
+    texts = ['/start', 'Прайс']
+    expected = Counter()
+    for product_id in rnd.sample(product_ids, items):
+        quantity = rnd.randint(1, 5)
+        texts += [f'/start add_{product_id}', str(quantity)]
+        expected[product_id] += quantity
+    return texts, dict(expected)
+
+def make_update(update_id, user_id, text):
+    """update с сообщением пользователя в формате Bot API"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        }
+    }
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+async def send_updates(url, scenarios):
+    """Источник update: пользователи параллельно, update пользователя - по очереди (ответ webhook не ждет обработки)"""
+    update_ids = itertools.count(1)
+    sent = defaultdict(list)
+
+    async with aiohttp.ClientSession(headers={'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET}) as session:
+
+        async def send_user(user_id, texts):
+            for text in texts:
+                update_id = next(update_ids)
+                sent[user_id].append(update_id)
+                async with session.post(url, json=make_update(update_id, user_id, text)) as response:
+                    response.raise_for_status()
+
+        await asyncio.gather(*(send_user(user_id, texts) for user_id, (texts, _) in scenarios.items()))
+    return sent
+
+def check_run(workers, users, items, api_latency, seed):
+    """Один прогон с workers процессами: время обработки и результаты проверок"""
+    with get_db() as conn:
+        conn.execute("DELETE FROM cart")
+    rnd = random.Random(seed)
+    product_ids = seed_products()
+    scenarios = {
+        user_id: user_scenario(user_id, product_ids, rnd, items)
+        for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users)
+    }
+    total = sum(len(texts) for texts, _ in scenarios.values())
+
+    journal = webhook._mp.Queue()
+    bot_factory, dispatcher_factory = make_factories(journal, api_latency)
+    supervisor = webhook.Supervisor(workers, bot_factory, dispatcher_factory)
+    supervisor.start()
+    port = _free_port()
+
+    async def run():
+        runner = aiohttp.web.AppRunner(supervisor.make_app(WEBHOOK_PATH, WEBHOOK_SECRET))
+        await runner.setup()
+        await aiohttp.web.TCPSite(runner, '127.0.0.1', port).start()
+        try:
+            return await send_updates(f"http://127.0.0.1:{port}{WEBHOOK_PATH}", scenarios)
+        finally:
+            await runner.cleanup()
+
+    started = time.perf_counter()
+    sent = asyncio.run(run())
+    entries = [journal.get(timeout=120) for _ in range(total)]
+    elapsed = time.perf_counter() - started
+    supervisor.stop()
+
+    # Порядок и процесс обработки update каждого пользователя
+    by_user = defaultdict(list)
+    for user_id, update_id, pid, begin, end in entries:
+        by_user[user_id].append((begin, end, update_id, pid))
+    pids = Counter()
+    order_errors = []
+    for user_id, handled in by_user.items():
+        handled.sort()
+        user_pids = {pid for _, _, _, pid in handled}
+        pids.update(user_pids)
+        overlapped = any(handled[i][1] > handled[i + 1][0] for i in range(len(handled) - 1))
+        if [update_id for _, _, update_id, _ in handled] != sent[user_id] or len(user_pids) != 1 or overlapped:
+            order_errors.append(user_id)
+
+    # Корзины: ввод количества попадает в тот же процесс, что и /start add_<id>
+    with get_db() as conn:
+        carts = defaultdict(dict)
+        for user_id, product_id, quantity in conn.execute("SELECT user_id, product_id, SUM(quantity) FROM cart GROUP BY 1, 2"):
+            carts[user_id][product_id] = quantity
+    cart_errors = [user_id for user_id, (_, expected) in scenarios.items() if carts.get(user_id, {}) != expected]
+
+    return {
+        "workers": workers,
+        "users": users,
+        "updates": total,
+        "elapsed_seconds": round(elapsed, 3),
+        "updates_per_second": round(total / elapsed, 1),
+        "processes_used": len(pids),
+        "users_per_process": sorted(pids.values()),
+        "order_errors": len(order_errors),
+        "cart_errors": len(cart_errors),
+        "ok": not order_errors and not cart_errors and len(pids) == min(workers, users),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка webhook с процессами-обработчиками")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help="количество процессов-обработчиков")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--items', type=int, default=3, help="товаров в корзине каждого пользователя")
+    parser.add_argument('--api-latency-ms', type=float, default=0.0, help="задержка ответа Bot API")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="файл для JSON с результатами (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    setup_db()
+    results = []
+    for workers in args.workers:
+        result = check_run(workers, args.users, args.items, args.api_latency_ms / 1000, args.seed)
+        results.append(result)
+        print(f"{workers} процессов: {result['updates']} update за {result['elapsed_seconds']} с "
+              f"({result['updates_per_second']}/с), ошибок порядка {result['order_errors']}, "
+              f"ошибок корзины {result['cart_errors']} - {'OK' if result['ok'] else 'FAIL'}", file=sys.stderr)
+
+    output = json.dumps({"results": results}, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    sys.exit(0 if all(result['ok'] for result in results) else 1)
+
+if __name__ == '__main__':
+    main()
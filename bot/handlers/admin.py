@@ -1,21 +1,32 @@
+import asyncio
+import datetime
 import os
+import tempfile
+import time
 from aiogram import Router, types
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.types import FSInputFile
 from aiogram.fsm.context import FSMContext
-from config import ADMIN_IDS, PRICE_UPLOAD_DIR
+from config import ADMIN_IDS, PRICE_UPLOAD_MEMORY_MB
 from bot.handlers.user import AddToCartStates
 from admin.markup import get_admin_keyboard
-from admin.price_loader import load_price_from_excel_auto, load_preorder_price_from_excel_auto
 from admin.discount import (
     get_markup_amount, set_markup_amount,
     get_preorder_markup_amount, set_preorder_markup_amount,
     get_user_markup_amount, set_user_markup_amount,
-    delete_user_markup, get_all_user_markups
+    delete_user_markup, get_all_user_markups,
+    get_pricing_rules, add_pricing_rule, delete_pricing_rule,
+    get_customer_groups, set_customer_group, delete_customer_group,
+    get_user_group, set_user_group, remove_user_group
 )
 from bot.keyboards.category import get_main_keyboard
 from db.models import get_db
 from db.crud import get_all_orders, get_order, clear_all_products
+from services.stats import (
+    CATALOG_SCOPE, PREORDER_SCOPE, get_catalog_stats, get_sales_summary, get_top_categories, get_top_sellers
+)
+from services import metrics
+from services.history import find_products, get_last_upload, get_price_at, get_price_history, get_top_movers
 
 router = Router()
 
@@ -54,7 +65,7 @@ async def upload_price_prompt(message: types.Message):
     
     await message.answer(
         "📤 <b>Загрузка прайса</b>\n\n"
-        "Отправьте Excel файл с прайсом.\n"
+        "Отправьте файл с прайсом (Excel или CSV).\n"
         "Файл будет обработан и товары загружены в базу данных.",
         parse_mode='HTML'
     )
@@ -69,12 +80,35 @@ async def upload_preorder_price_prompt(message: types.Message):
     
     await message.answer(
         "📤 <b>Загрузка прайса предзаказа</b>\n\n"
-        "Отправьте Excel файл с прайсом предзаказа.\n"
+        "Отправьте файл с прайсом предзаказа (Excel или CSV).\n"
         "Файл будет обработан и товары загружены в базу данных.",
         parse_mode='HTML'
     )
 
-@router.message(lambda m: m.document and m.document.file_name and m.document.file_name.endswith(('.xlsx', '.xls')))
+# Форматы прайс-листов: книги Excel и текстовые CSV/TSV (загружаются потоково)
+PRICE_FILE_EXTENSIONS = ('.xlsx', '.xls', '.csv', '.tsv')
+
+def import_price_upload(upload, file_name, price_type):
+    """Загружает скачанный прайс (обычный или предзаказа), возвращает (количество товаров, source прайса)"""
+    # Загрузчик тянет pandas/openpyxl - импортируем только при реальной загрузке прайса,
+    # чтобы не замедлять запуск бота и не держать их в памяти
+    from admin.price_loader import (
+        CSV_EXTENSIONS, detect_file_format, is_csv_file,
+        load_price_from_excel_auto, load_preorder_price_from_excel_auto
+    )
+    
+    # Формат загруженного файла определяется по содержимому - проверяем, что он совпадает с расширением
+    if is_csv_file(upload) != file_name.lower().endswith(CSV_EXTENSIONS):
+        raise ValueError("Содержимое файла не соответствует его расширению (книга Excel или CSV/TSV)")
+    
+    if price_type == 'preorder':
+        # Загружаем прайс предзаказа в отдельную таблицу
+        return load_preorder_price_from_excel_auto(upload), 'preorder'
+    # Загружаем обычный прайс
+    source = 'simple' if detect_file_format(upload) == 'simple' else 'standard'
+    return load_price_from_excel_auto(upload, source=source), source
+
+@router.message(lambda m: m.document and m.document.file_name and m.document.file_name.lower().endswith(PRICE_FILE_EXTENSIONS))
 async def handle_price_file(message: types.Message):
     if not is_admin(message.from_user.id):
         return
@@ -83,33 +117,25 @@ async def handle_price_file(message: types.Message):
     # Определяем тип прайса из состояния (по умолчанию 'standard')
     price_type = price_upload_states.get(user_id, 'standard')
     
+    # Файл скачивается в память (большие файлы - во временный файл ОС) и разбирается оттуда:
+    # нет общего каталога загрузок, где совпадающие имена файлов двух админов перезаписывали бы друг друга
+    upload = tempfile.SpooledTemporaryFile(max_size=PRICE_UPLOAD_MEMORY_MB * 1024 * 1024)
     try:
-        # Создаем директорию, если её нет
-        os.makedirs(PRICE_UPLOAD_DIR, exist_ok=True)
-        
         # Скачиваем файл
         file_info = await message.bot.get_file(message.document.file_id)
-        file_path = os.path.join(PRICE_UPLOAD_DIR, message.document.file_name)
-        
-        await message.bot.download_file(file_info.file_path, file_path)
+        await message.bot.download_file(file_info.file_path, upload)
         
         # Загружаем прайс
         await message.answer("⏳ Обработка файла...")
         
-        if price_type == 'preorder':
-            # Загружаем прайс предзаказа в отдельную таблицу
-            products_count = load_preorder_price_from_excel_auto(file_path)
-            price_type_text = "предзаказа"
-        else:
-            # Загружаем обычный прайс
-            from admin.price_loader import detect_file_format
-            file_format = detect_file_format(file_path)
-            if file_format == 'simple':
-                final_source = 'simple'
-            else:
-                final_source = 'standard'
-            products_count = load_price_from_excel_auto(file_path, source=final_source)
-            price_type_text = "обычного"
+        # Разбор и запись в базу - в отдельном потоке: бот продолжает отвечать остальным пользователям
+        import_started = time.perf_counter()
+        products_count, source = await asyncio.to_thread(
+            import_price_upload, upload, message.document.file_name, price_type
+        )
+        price_type_text = "предзаказа" if price_type == 'preorder' else "обычного"
+        metrics.observe('price_import_seconds', time.perf_counter() - import_started, {"type": price_type})
+        metrics.inc('price_import_products_total', {"type": price_type}, products_count)
         
         # Показываем текущую наценку (она будет применяться при отображении товаров)
         if price_type == 'preorder':
@@ -117,9 +143,12 @@ async def handle_price_file(message: types.Message):
         else:
             current_markup = get_markup_amount()
         
+        last_upload = get_last_upload(source)
+        
         await message.answer(
             f"✅ <b>Прайс {price_type_text} успешно загружен!</b>\n\n"
             f"Загружено товаров: <b>{products_count}</b>\n"
+            f"Изменений цен: <b>{last_upload['changes_count'] if last_upload else 0}</b> (подробнее - /prices)\n"
             f"Текущая наценка: <b>{current_markup}₽</b> (применяется при отображении товаров)",
             parse_mode='HTML',
             reply_markup=get_admin_keyboard()
@@ -128,12 +157,6 @@ async def handle_price_file(message: types.Message):
         # Очищаем состояние загрузки
         if user_id in price_upload_states:
             del price_upload_states[user_id]
-        
-        # Удаляем временный файл
-        try:
-            os.remove(file_path)
-        except:
-            pass
             
     except Exception as e:
         await message.answer(
@@ -144,6 +167,8 @@ async def handle_price_file(message: types.Message):
         # Очищаем состояние загрузки при ошибке
         if user_id in price_upload_states:
             del price_upload_states[user_id]
+    finally:
+        upload.close()
 
 @router.message(lambda m: m.text == "⚙️ Настройка наценки")
 async def set_markup_prompt(message: types.Message):
@@ -240,22 +265,14 @@ async def show_current_markup(message: types.Message):
     
     markup = get_markup_amount()
     preorder_markup = get_preorder_markup_amount()
-    
-    # Получаем статистику товаров
-    with get_db() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM products")
-        products_count = cur.fetchone()[0]
-        
-        cur.execute("SELECT COUNT(DISTINCT category) FROM products")
-        categories_count = cur.fetchone()[0]
+    catalog = get_catalog_stats()[CATALOG_SCOPE]
     
     await message.answer(
         f"📈 <b>Статистика</b>\n\n"
         f"Наценка основного прайса: <b>{markup}₽</b>\n"
         f"Наценка предзаказа: <b>{preorder_markup}₽</b>\n"
-        f"Товаров в базе: <b>{products_count}</b>\n"
-        f"Категорий: <b>{categories_count}</b>",
+        f"Товаров в базе: <b>{catalog['products']}</b>\n"
+        f"Категорий: <b>{catalog['categories']}</b>",
         parse_mode='HTML',
         reply_markup=get_admin_keyboard()
     )
@@ -265,33 +282,25 @@ async def show_statistics(message: types.Message):
     if not is_admin(message.from_user.id):
         return
     
-    with get_db() as conn:
-        cur = conn.cursor()
-        
-        # Общая статистика
-        cur.execute("SELECT COUNT(*) FROM products")
-        total_products = cur.fetchone()[0]
-        
-        cur.execute("SELECT COUNT(DISTINCT category) FROM products")
-        total_categories = cur.fetchone()[0]
-        
-        # Топ категорий
-        cur.execute("""
-            SELECT category, COUNT(*) as count 
-            FROM products 
-            GROUP BY category 
-            ORDER BY count DESC 
-            LIMIT 5
-        """)
-        top_categories = cur.fetchall()
+    # Сводные таблицы: пересчитываются при загрузке прайса и оформлении заказа
+    catalog_stats = get_catalog_stats()
+    top_categories = get_top_categories(5)
+    sales = [
+        ("Сегодня", get_sales_summary(1)),
+        ("7 дней", get_sales_summary(7)),
+        ("30 дней", get_sales_summary(30)),
+        ("Всего", get_sales_summary()),
+    ]
+    top_sellers = get_top_sellers(days=30, limit=5)
     
     markup = get_markup_amount()
     preorder_markup = get_preorder_markup_amount()
     
     stats_text = (
         f"📋 <b>Статистика базы данных</b>\n\n"
-        f"Всего товаров: <b>{total_products}</b>\n"
-        f"Категорий: <b>{total_categories}</b>\n"
+        f"Всего товаров: <b>{catalog_stats[CATALOG_SCOPE]['products']}</b>\n"
+        f"Категорий: <b>{catalog_stats[CATALOG_SCOPE]['categories']}</b>\n"
+        f"Товаров предзаказа: <b>{catalog_stats[PREORDER_SCOPE]['products']}</b>\n"
         f"Наценка основного прайса: <b>{markup}₽</b>\n"
         f"Наценка предзаказа: <b>{preorder_markup}₽</b>\n\n"
         f"<b>Топ-5 категорий:</b>\n"
@@ -300,8 +309,232 @@ async def show_statistics(message: types.Message):
     for i, (category, count) in enumerate(top_categories, 1):
         stats_text += f"{i}. {category}: <b>{count}</b> товаров\n"
     
+    stats_text += "\n<b>Продажи:</b>\n"
+    for period, summary in sales:
+        stats_text += f"{period}: <b>{summary['orders']}</b> заказов, <b>{summary['revenue']}₽</b>\n"
+    
+    stats_text += "\n<b>Топ-5 товаров за 30 дней:</b>\n"
+    for i, seller in enumerate(top_sellers, 1):
+        stats_text += f"{i}. {seller['product_name']}: <b>{seller['quantity']}</b> шт., {seller['revenue']}₽\n"
+    if not top_sellers:
+        stats_text += "продаж нет\n"
+    
     await message.answer(stats_text, parse_mode='HTML', reply_markup=get_admin_keyboard())
 
+@router.message(Command("metrics"))
+async def show_metrics(message: types.Message):
+    """Краткая сводка метрик производительности для админа"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    from config import METRICS_ENABLED, WEBHOOK_WORKERS
+    if not METRICS_ENABLED:
+        await message.answer(
+            "ℹ️ Метрики выключены. Включите их переменной окружения <code>METRICS_ENABLED=1</code>.",
+            parse_mode='HTML',
+            reply_markup=get_admin_keyboard()
+        )
+        return
+    
+    text = "⏱ <b>Метрики производительности</b>\n\n"
+    if WEBHOOK_WORKERS:
+        # Метрики в памяти процесса: остальные процессы-обработчики считают свои
+        text += f"<i>Только этот процесс-обработчик из {WEBHOOK_WORKERS}; сумма по всем - в Prometheus</i>\n\n"
+    
+    handlers = metrics.get_histogram_summary('bot_handler_seconds', top=10)
+    text += "<b>Обработчики (по суммарному времени):</b>\n"
+    if handlers:
+        for item in handlers:
+            text += (
+                f"• <code>{item['labels'].get('handler')}</code>: {item['count']} вызовов, "
+                f"сред. {item['avg'] * 1000:.1f} мс, p95 ≤ {item['p95'] * 1000:.0f} мс\n"
+            )
+    else:
+        text += "нет данных\n"
+    
+    statements = metrics.get_histogram_summary('db_statement_seconds', top=5)
+    text += "\n<b>SQL-запросы (по суммарному времени):</b>\n"
+    if statements:
+        for item in statements:
+            text += (
+                f"• {item['labels'].get('operation')} {item['labels'].get('table')}: {item['count']} запросов, "
+                f"сред. {item['avg'] * 1000:.2f} мс\n"
+            )
+    else:
+        text += "нет данных\n"
+    
+    api_calls = metrics.get_counter_values('telegram_api_requests_total')
+    text += f"\n<b>Вызовов Telegram API:</b> {sum(api_calls.values())}\n"
+    
+    imports = metrics.get_histogram_summary('price_import_seconds')
+    for item in imports:
+        text += f"<b>Загрузка прайса ({item['labels'].get('type')}):</b> {item['count']} раз, сред. {item['avg']:.1f} с\n"
+    
+    await message.answer(text, parse_mode='HTML', reply_markup=get_admin_keyboard())
+
+@router.message(Command("sqltrace"))
+async def show_sql_trace(message: types.Message):
+    """Самые затратные SQL-запросы (при включенной трассировке SQL_TRACE=1)"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    from config import SQL_TRACE
+    if not SQL_TRACE:
+        await message.answer(
+            "ℹ️ Трассировка SQL выключена. Включите её переменной окружения <code>SQL_TRACE=1</code>.",
+            parse_mode='HTML',
+            reply_markup=get_admin_keyboard()
+        )
+        return
+    
+    from html import escape
+    from db.tracing import get_report
+    report = get_report(top=10)
+    
+    text = "🔍 <b>SQL-запросы (по суммарному времени)</b>\n\n"
+    if not report:
+        text += "нет данных"
+    for item in report:
+        text += (
+            f"<b>{item['count']}×</b>, всего {item['total'] * 1000:.1f} мс, макс. {item['max'] * 1000:.1f} мс\n"
+            f"<code>{escape(item['call_site'])}</code>\n"
+            f"<code>{escape(item['sql'][:200])}</code>\n\n"
+        )
+    
+    await message.answer(text, parse_mode='HTML', reply_markup=get_admin_keyboard())
+
+@router.message(Command("maintenance"))
+async def show_maintenance(message: types.Message, command: CommandObject):
+    """
+    Состояние фонового обслуживания базы: последние запуски задач, размер и свободные страницы.
+    /maintenance vacuum - перевод базы в режим auto_vacuum = INCREMENTAL
+    """
+    if not is_admin(message.from_user.id):
+        return
+    
+    if command.args and command.args.strip() == 'vacuum':
+        await convert_database_vacuum(message)
+        return
+    
+    from config import BACKUP_DIR, BACKUP_INTERVAL_HOURS, BACKUP_KEEP, MAINTENANCE_INTERVAL_MINUTES, VACUUM_HOURS
+    from html import escape
+    from services.maintenance import AUTO_VACUUM_INCREMENTAL, TASK_TITLES, describe_result, get_database_info, get_last_runs
+    
+    info = get_database_info()
+    last_runs = get_last_runs()
+    
+    text = "🛠 <b>Обслуживание базы</b>\n\n"
+    if MAINTENANCE_INTERVAL_MINUTES <= 0:
+        text += "ℹ️ Выключено (<code>MAINTENANCE_INTERVAL_MINUTES=0</code>)\n\n"
+    text += (
+        f"Размер: <b>{info['size'] / 1024 / 1024:.1f} МБ</b>, "
+        f"свободных страниц: <b>{info['freelist_count']}</b> из {info['page_count']}\n"
+        f"auto_vacuum: {'INCREMENTAL' if info['auto_vacuum'] == AUTO_VACUUM_INCREMENTAL else 'нет (включить - /maintenance vacuum)'}\n"
+        f"Очистка корзин: каждые {MAINTENANCE_INTERVAL_MINUTES} мин.\n"
+        f"Копии: {f'каждые {BACKUP_INTERVAL_HOURS} ч.' if BACKUP_INTERVAL_HOURS > 0 else 'выключены'}, "
+        f"<code>{BACKUP_DIR}</code>, хранится {BACKUP_KEEP}\n"
+        f"Тихие часы vacuum: {VACUUM_HOURS or 'не заданы'}\n\n"
+        f"<b>Последние запуски (UTC):</b>\n"
+    )
+    for task, title in TASK_TITLES.items():
+        run = last_runs.get(task)
+        if not run:
+            text += f"• {title}: не запускалась\n"
+        elif run['error']:
+            text += f"• {title}: {run['started_at']} ❌ {escape(run['error'][:200])}\n"
+        else:
+            text += f"• {title}: {run['started_at']}, {run['duration']:.2f} с - {describe_result(task, run['result'])}\n"
+    
+    await message.answer(text, parse_mode='HTML', reply_markup=get_admin_keyboard())
+
+async def convert_database_vacuum(message: types.Message):
+    """Один раз переводит базу в режим auto_vacuum = INCREMENTAL полным VACUUM"""
+    from services.maintenance import convert_to_incremental_vacuum
+    
+    await message.answer(
+        "⏳ Перевод базы в режим auto_vacuum = INCREMENTAL (полный VACUUM). "
+        "Пока он идет, заказы и загрузка прайса ждут...",
+        reply_markup=get_admin_keyboard()
+    )
+    started = time.perf_counter()
+    try:
+        # VACUUM - в отдельном потоке: бот продолжает отвечать на запросы, которым не нужна запись
+        converted = await asyncio.to_thread(convert_to_incremental_vacuum)
+    except Exception as e:
+        from html import escape
+        await message.answer(
+            f"❌ <b>Ошибка VACUUM:</b>\n\n{escape(str(e))}",
+            parse_mode='HTML',
+            reply_markup=get_admin_keyboard()
+        )
+        return
+    
+    if converted:
+        text = f"✅ База переведена в режим auto_vacuum = INCREMENTAL за {time.perf_counter() - started:.1f} с"
+    else:
+        text = "ℹ️ База уже в режиме auto_vacuum = INCREMENTAL"
+    await message.answer(text, reply_markup=get_admin_keyboard())
+
+# Названия прайсов в истории цен
+PRICE_SOURCE_TITLES = {'standard': "Основной", 'simple': "Простой", 'preorder': "Предзаказ"}
+
+def _price_text(price):
+    return f"{price}₽" if price is not None else "нет в прайсе"
+
+def _product_key_text(product_key):
+    # Ключ: категория|название|память|цвет|страна - категорию не показываем, название ее уже содержит
+    return ' '.join(part for part in product_key.split('|')[1:] if part)
+
+@router.message(Command("prices"))
+async def show_price_history(message: types.Message, command: CommandObject):
+    """
+    История цен: /prices - последние загрузки прайсов и самые большие изменения цен в них,
+    /prices <название> - изменения цены найденных товаров и цена 30 дней назад
+    """
+    if not is_admin(message.from_user.id):
+        return
+    
+    from html import escape
+    
+    if not command.args:
+        text = "📈 <b>Изменения цен в последних загрузках (UTC)</b>\n"
+        for source, title in PRICE_SOURCE_TITLES.items():
+            upload = get_last_upload(source)
+            if not upload:
+                continue
+            text += (
+                f"\n<b>{title}</b>: {upload['uploaded_at'][:16]}, товаров {upload['products_count']}, "
+                f"изменений {upload['changes_count']}\n"
+            )
+            for mover in get_top_movers(source, limit=5):
+                text += (
+                    f"• {escape(_product_key_text(mover['product_key']))}: "
+                    f"{mover['prev_price']}₽ → {mover['price']}₽ ({mover['delta']:+d}₽)\n"
+                )
+        text += "\nИстория цен товара: <code>/prices название</code>"
+        await message.answer(text, parse_mode='HTML', reply_markup=get_admin_keyboard())
+        return
+    
+    products = find_products(command.args.strip())
+    if not products:
+        await message.answer("Товары не найдены.", reply_markup=get_admin_keyboard())
+        return
+    
+    month_ago = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+    text = "📈 <b>История цен (UTC)</b>\n"
+    for product in products:
+        details = ', '.join(part for part in (product['memory'], product['color'], product['country']) if part)
+        text += (
+            f"\n<b>{escape(product['name'])}</b>{f' ({escape(details)})' if details else ''}, "
+            f"{PRICE_SOURCE_TITLES.get(product['source'], product['source'])}\n"
+            f"Сейчас: {product['price']}₽, 30 дней назад: "
+            f"{_price_text(get_price_at(product['product_key'], month_ago, product['source']))}\n"
+        )
+        for change in get_price_history(product['product_key'], product['source'], limit=5):
+            text += f"• {change['effective_from'][:16]}: {_price_text(change['prev_price'])} → {_price_text(change['price'])}\n"
+    
+    await message.answer(text, parse_mode='HTML', reply_markup=get_admin_keyboard())
+
 @router.message(lambda m: m.text == "🔙 Назад")
 async def admin_back(message: types.Message):
     if not is_admin(message.from_user.id):
@@ -384,6 +617,98 @@ async def show_orders(message: types.Message):
                 parse_mode='HTML'
             )
 
+EXPORT_COMMAND_FORMAT = (
+    "<code>export [с] [по] [xlsx|csv]</code>\n"
+    "Даты в формате ГГГГ-ММ-ДД или ДД.ММ.ГГГГ (включительно), без дат - все заказы, по умолчанию xlsx"
+)
+
+def parse_export_command(text):
+    """Период и формат из команды export: (date_from, date_to, file_format)"""
+    from admin.export import EXPORT_FORMATS, parse_export_date
+    
+    args = text.split()[1:]
+    file_format = 'xlsx'
+    if args and args[-1].lower() in EXPORT_FORMATS:
+        file_format = args.pop().lower()
+    if len(args) > 2:
+        raise ValueError(text)
+    dates = [parse_export_date(arg) for arg in args]
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else None
+    if date_from and date_to and date_from > date_to:
+        raise ValueError(text)
+    return date_from, date_to, file_format
+
+@router.message(lambda m: m.text == "📤 Выгрузка заказов")
+async def export_orders_prompt(message: types.Message):
+    """Подсказка по выгрузке заказов в файл"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    await message.answer(
+        "📤 <b>Выгрузка заказов</b>\n\n"
+        "Заказы со всеми позициями выгружаются в Excel или CSV файл и присылаются документом.\n\n"
+        f"• {EXPORT_COMMAND_FORMAT}\n\n"
+        "Примеры:\n"
+        "<code>export</code> - все заказы в Excel\n"
+        "<code>export 2025-01-01 2025-12-31</code> - заказы за 2025 год\n"
+        "<code>export 01.11.2025 csv</code> - заказы с 1 ноября 2025 в CSV",
+        parse_mode='HTML',
+        reply_markup=get_admin_keyboard()
+    )
+
+@router.message(lambda m: m.text and m.text.lower().split()[:1] == ["export"] and is_admin(m.from_user.id))
+async def export_orders_command(message: types.Message):
+    """Выгрузка заказов за период в файл"""
+    try:
+        date_from, date_to, file_format = parse_export_command(message.text)
+    except ValueError:
+        await message.answer(
+            f"❌ Неверный формат. Используйте:\n{EXPORT_COMMAND_FORMAT}",
+            parse_mode='HTML'
+        )
+        return
+    
+    await message.answer("⏳ Выгрузка заказов...")
+    
+    from admin.export import export_orders
+    
+    fd, file_path = tempfile.mkstemp(suffix=f".{file_format}", prefix="orders-")
+    os.close(fd)
+    try:
+        # Файл пишется в отдельном потоке: бот продолжает отвечать остальным пользователям
+        export_started = time.perf_counter()
+        orders_count, items_count = await asyncio.to_thread(
+            export_orders, file_path, date_from, date_to, file_format
+        )
+        metrics.observe('orders_export_seconds', time.perf_counter() - export_started, {"format": file_format})
+        metrics.inc('orders_export_items_total', {"format": file_format}, items_count)
+        
+        if not orders_count:
+            await message.answer(
+                "📤 Заказов за выбранный период нет.",
+                reply_markup=get_admin_keyboard()
+            )
+            return
+        
+        file_name = "_".join(["orders"] + [date.isoformat() for date in (date_from, date_to) if date])
+        await message.answer_document(
+            FSInputFile(file_path, filename=f"{file_name}.{file_format}"),
+            caption=f"📤 Заказов: {orders_count}, позиций: {items_count}",
+            reply_markup=get_admin_keyboard()
+        )
+    except Exception as e:
+        await message.answer(
+            f"❌ <b>Ошибка при выгрузке заказов:</b>\n\n{str(e)}",
+            parse_mode='HTML',
+            reply_markup=get_admin_keyboard()
+        )
+    finally:
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
 # Обработчики для персональных процентов
 @router.message(lambda m: m.text == "👤 Персональные проценты")
 async def user_markups_menu(message: types.Message):
@@ -536,6 +861,14 @@ async def check_user_markup(message: types.Message):
                 parse_mode='HTML',
                 reply_markup=get_admin_keyboard()
             )
+        elif group := get_user_group(user_id):
+            await message.answer(
+                f"👤 <b>Пользователь:</b> <code>{user_id}</code>\n"
+                f"📊 <b>Персональная наценка:</b> не установлена\n\n"
+                f"👥 Группа <b>{group['name']}</b>, наценка группы: <b>{group['markup_amount']}₽</b>",
+                parse_mode='HTML',
+                reply_markup=get_admin_keyboard()
+            )
         else:
             await message.answer(
                 f"👤 <b>Пользователь:</b> <code>{user_id}</code>\n"
@@ -553,6 +886,316 @@ async def check_user_markup(message: types.Message):
     except Exception as e:
         await message.answer(f"❌ Ошибка: {str(e)}", parse_mode='HTML')
 
+# Обработчики для групп покупателей
+@router.message(lambda m: m.text == "👥 Группы покупателей")
+async def customer_groups_menu(message: types.Message):
+    """Список групп покупателей и команды управления ими"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    text = "👥 <b>Группы покупателей</b>\n\n"
+    groups = get_customer_groups()
+    if not groups:
+        text += "Групп нет.\n"
+    for group in groups:
+        text += f"• <b>{group['name']}</b>: наценка <b>{group['markup_amount']}₽</b>, "
+        text += f"покупателей: {group['member_count']}\n"
+    
+    await message.answer(
+        text + "\n"
+        "Наценка группы применяется ко всем товарам вместо правил и стандартной наценки. "
+        "Персональная наценка пользователя важнее наценки группы.\n\n"
+        "• <code>+group [название] [сумма]</code> - создать группу или изменить ее наценку\n"
+        "• <code>-group [название]</code> - удалить группу\n"
+        "• <code>+member [ID] [название группы]</code> - добавить пользователя в группу\n"
+        "• <code>-member [ID]</code> - исключить пользователя из группы\n\n"
+        "Примеры:\n"
+        "<code>+group Дилеры 300</code> - группа «Дилеры» с наценкой 300₽\n"
+        "<code>+member 123456789 Дилеры</code> - пользователь 123456789 в группе «Дилеры»",
+        parse_mode='HTML',
+        reply_markup=get_admin_keyboard()
+    )
+
+@router.message(lambda m: m.text and m.text.startswith("+group") and is_admin(m.from_user.id))
+async def add_customer_group(message: types.Message):
+    """Создать группу покупателей или изменить ее наценку"""
+    try:
+        parts = message.text.split()
+        if len(parts) < 3:
+            await message.answer(
+                "❌ Неверный формат. Используйте: <code>+group [название] [сумма]</code>\n"
+                "Пример: <code>+group Дилеры 300</code>",
+                parse_mode='HTML'
+            )
+            return
+        
+        name = " ".join(parts[1:-1])
+        amount = float(parts[-1])
+        
+        if amount < 0:
+            await message.answer("❌ Сумма наценки должна быть неотрицательной.")
+            return
+        
+        set_customer_group(name, amount)
+        
+        await message.answer(
+            f"✅ Группа покупателей <b>{name}</b>: наценка <b>{amount}₽</b>",
+            parse_mode='HTML',
+            reply_markup=get_admin_keyboard()
+        )
+    except ValueError:
+        await message.answer(
+            "❌ Неверный формат. Используйте: <code>+group [название] [сумма]</code>\n"
+            "Пример: <code>+group Дилеры 300</code>",
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {str(e)}", parse_mode='HTML')
+
+@router.message(lambda m: m.text and m.text.startswith("-group") and is_admin(m.from_user.id))
+async def remove_customer_group(message: types.Message):
+    """Удалить группу покупателей"""
+    name = message.text[len("-group"):].strip()
+    if not name:
+        await message.answer(
+            "❌ Неверный формат. Используйте: <code>-group [название]</code>\n"
+            "Пример: <code>-group Дилеры</code>",
+            parse_mode='HTML'
+        )
+        return
+    
+    try:
+        if delete_customer_group(name):
+            await message.answer(
+                f"✅ Группа покупателей <b>{name}</b> удалена, ее покупатели переведены на стандартную наценку",
+                parse_mode='HTML',
+                reply_markup=get_admin_keyboard()
+            )
+        else:
+            await message.answer(
+                f"❌ Группа покупателей <b>{name}</b> не найдена",
+                parse_mode='HTML',
+                reply_markup=get_admin_keyboard()
+            )
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {str(e)}", parse_mode='HTML')
+
+@router.message(lambda m: m.text and m.text.startswith("+member") and is_admin(m.from_user.id))
+async def add_group_member(message: types.Message):
+    """Добавить пользователя в группу покупателей"""
+    try:
+        parts = message.text.split()
+        if len(parts) < 3:
+            await message.answer(
+                "❌ Неверный формат. Используйте: <code>+member [ID] [название группы]</code>\n"
+                "Пример: <code>+member 123456789 Дилеры</code>",
+                parse_mode='HTML'
+            )
+            return
+        
+        user_id = int(parts[1])
+        name = " ".join(parts[2:])
+        
+        if set_user_group(user_id, name):
+            await message.answer(
+                f"✅ Пользователь <code>{user_id}</code> добавлен в группу <b>{name}</b>",
+                parse_mode='HTML',
+                reply_markup=get_admin_keyboard()
+            )
+        else:
+            await message.answer(
+                f"❌ Группа покупателей <b>{name}</b> не найдена. Создайте ее командой "
+                f"<code>+group {name} [сумма]</code>",
+                parse_mode='HTML',
+                reply_markup=get_admin_keyboard()
+            )
+    except ValueError:
+        await message.answer(
+            "❌ Неверный формат. Используйте: <code>+member [ID] [название группы]</code>\n"
+            "Пример: <code>+member 123456789 Дилеры</code>",
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {str(e)}", parse_mode='HTML')
+
+@router.message(lambda m: m.text and m.text.startswith("-member") and is_admin(m.from_user.id))
+async def remove_group_member(message: types.Message):
+    """Исключить пользователя из группы покупателей"""
+    try:
+        parts = message.text.split()
+        if len(parts) != 2:
+            await message.answer(
+                "❌ Неверный формат. Используйте: <code>-member [ID]</code>\n"
+                "Пример: <code>-member 123456789</code>",
+                parse_mode='HTML'
+            )
+            return
+        
+        user_id = int(parts[1])
+        
+        if remove_user_group(user_id):
+            await message.answer(
+                f"✅ Пользователь <code>{user_id}</code> исключен из группы покупателей",
+                parse_mode='HTML',
+                reply_markup=get_admin_keyboard()
+            )
+        else:
+            await message.answer(
+                f"❌ Пользователь <code>{user_id}</code> не состоит в группе покупателей",
+                parse_mode='HTML',
+                reply_markup=get_admin_keyboard()
+            )
+    except ValueError:
+        await message.answer(
+            "❌ Неверный формат. Используйте: <code>-member [ID]</code>\n"
+            "Пример: <code>-member 123456789</code>",
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {str(e)}", parse_mode='HTML')
+
+# Обработчики для правил наценки по категориям и диапазонам цены
+PRICING_RULE_FORMAT = (
+    "<code>+rule [родительская] | [подкатегория] | [от-до] | [сумма]</code>\n"
+    "(<code>*</code> - любая категория или цена, для предзаказа в конце добавьте <code>| предзаказ</code>)"
+)
+
+def format_price_band(min_price, max_price):
+    """Диапазон цены правила для отображения"""
+    if min_price is None and max_price is None:
+        return "любая"
+    if max_price is None:
+        return f"от {min_price}₽"
+    if min_price is None:
+        return f"до {max_price}₽"
+    return f"{min_price}₽ - {max_price}₽"
+
+def parse_price_band(text):
+    """Диапазон цены из '50000-100000', '50000-', '-30000' или '*': (min_price, max_price)"""
+    text = text.replace(' ', '')
+    if text in ('', '*'):
+        return None, None
+    low, sep, high = text.partition('-')
+    if not sep:
+        raise ValueError(text)
+    min_price = int(low) if low else None
+    max_price = int(high) if high else None
+    if min_price is not None and max_price is not None and min_price >= max_price:
+        raise ValueError(text)
+    return min_price, max_price
+
+def parse_pricing_rule(text):
+    """Правило наценки из команды +rule: словарь аргументов add_pricing_rule"""
+    parts = [part.strip() for part in text[len("+rule"):].split('|')]
+    is_preorder = len(parts) == 5 and parts[4].lower() == 'предзаказ'
+    if len(parts) != 4 and not is_preorder:
+        raise ValueError(text)
+    
+    parent_category, category, band, amount = parts[:4]
+    min_price, max_price = parse_price_band(band)
+    return {
+        "parent_category": None if parent_category in ('', '*') else parent_category,
+        "category": None if category in ('', '*') else category,
+        "min_price": min_price,
+        "max_price": max_price,
+        "markup_amount": float(amount),
+        "is_preorder": is_preorder,
+    }
+
+@router.message(lambda m: m.text == "💲 Правила наценки")
+async def pricing_rules_menu(message: types.Message):
+    """Список правил наценки и команды управления ими"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    text = "💲 <b>Правила наценки</b>\n\n"
+    rules = get_pricing_rules()
+    if not rules:
+        text += "Правил нет, ко всем товарам применяется стандартная наценка.\n"
+    for rule in rules:
+        text += f"#{rule['id']}{' [ПРЕДЗАКАЗ]' if rule['is_preorder'] else ''} "
+        text += f"{rule['parent_category'] or '*'} / {rule['category'] or '*'}, "
+        text += f"цена: {format_price_band(rule['min_price'], rule['max_price'])} - "
+        text += f"<b>{rule['markup_amount']}₽</b>\n"
+    
+    await message.answer(
+        text + "\n"
+        "Подкатегория важнее родительской категории, правило с диапазоном цены важнее правила без него, "
+        "при равенстве действует более новое. Персональная наценка пользователя важнее всех правил.\n\n"
+        f"• Добавить правило:\n{PRICING_RULE_FORMAT}\n"
+        "• <code>-rule [ID]</code> - удалить правило\n\n"
+        "Примеры:\n"
+        "<code>+rule Apple | * | 100000- | 1500</code> - наценка 1500₽ на товары Apple от 100000₽\n"
+        "<code>+rule * | iPhone 16 | * | 800</code> - наценка 800₽ на все iPhone 16",
+        parse_mode='HTML',
+        reply_markup=get_admin_keyboard()
+    )
+
+@router.message(lambda m: m.text and m.text.startswith("+rule") and is_admin(m.from_user.id))
+async def add_pricing_rule_command(message: types.Message):
+    """Добавить правило наценки"""
+    try:
+        rule = parse_pricing_rule(message.text)
+    except ValueError:
+        await message.answer(
+            f"❌ Неверный формат. Используйте:\n{PRICING_RULE_FORMAT}",
+            parse_mode='HTML'
+        )
+        return
+    
+    if rule['markup_amount'] < 0:
+        await message.answer("❌ Сумма наценки должна быть неотрицательной.")
+        return
+    
+    try:
+        rule_id = add_pricing_rule(**rule)
+        preorder_text = "📦 Предзаказ\n" if rule['is_preorder'] else ""
+        await message.answer(
+            f"✅ Правило наценки #{rule_id} добавлено:\n\n"
+            f"{preorder_text}"
+            f"Категория: {rule['parent_category'] or '*'} / {rule['category'] or '*'}\n"
+            f"Цена: {format_price_band(rule['min_price'], rule['max_price'])}\n"
+            f"📊 Сумма: <b>{rule['markup_amount']}₽</b>",
+            parse_mode='HTML',
+            reply_markup=get_admin_keyboard()
+        )
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {str(e)}", parse_mode='HTML')
+
+@router.message(lambda m: m.text and m.text.startswith("-rule") and is_admin(m.from_user.id))
+async def remove_pricing_rule_command(message: types.Message):
+    """Удалить правило наценки"""
+    try:
+        parts = message.text.split()
+        if len(parts) != 2:
+            await message.answer(
+                "❌ Неверный формат. Используйте: <code>-rule [ID]</code>\n"
+                "Пример: <code>-rule 3</code>",
+                parse_mode='HTML'
+            )
+            return
+        
+        rule_id = int(parts[1].lstrip('#'))
+        
+        if delete_pricing_rule(rule_id):
+            await message.answer(
+                f"✅ Правило наценки #{rule_id} удалено",
+                reply_markup=get_admin_keyboard()
+            )
+        else:
+            await message.answer(
+                f"❌ Правило наценки #{rule_id} не найдено",
+                reply_markup=get_admin_keyboard()
+            )
+    except ValueError:
+        await message.answer(
+            "❌ Неверный формат. Используйте: <code>-rule [ID]</code>\n"
+            "Пример: <code>-rule 3</code>",
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {str(e)}", parse_mode='HTML')
+
 @router.message(lambda m: m.text == "🗑️ Очистить базу от товаров")
 async def clear_products_confirm(message: types.Message):
     """Запрашивает подтверждение на очистку базы данных от товаров"""
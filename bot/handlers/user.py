@@ -1,25 +1,31 @@
 from aiogram import Router, types
 from aiogram.filters import Command, StateFilter
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from typing import Optional
+import asyncio
+import datetime
+import os
 import re
 from collections import OrderedDict
 from bot.keyboards.category import (
     get_main_keyboard, get_categories_keyboard, get_subcategories_keyboard,
-    get_category_with_icon, get_preorder_categories_keyboard
+    get_category_with_icon, get_preorder_categories_keyboard, get_back_keyboard
 )
 from db.crud import (
-    get_products_by_category, get_available_subcategories, add_to_cart,
-    get_cart, remove_from_cart, clear_cart, create_order, get_product_by_id, get_order,
+    add_to_cart, get_cart, remove_from_cart, clear_cart, create_order, get_product_by_id, get_order,
     update_cart_quantity, get_dynamic_subcategories_for_parent,
     get_preorder_products_by_category, get_preorder_available_subcategories,
     get_preorder_categories, get_preorder_product_by_id, add_to_preorder_cart,
     get_preorder_cart, remove_from_preorder_cart, update_preorder_cart_quantity
 )
-from admin.discount import calculate_price_with_markup
+from admin.discount import calculate_product_price, price_group_key, price_listing
+from db.models import SETTINGS_VERSION, get_version
+from services.cache import VersionedCache
+from services.category import catalog_version
+from services.product import get_products_by_category
 
 router = Router()
 
@@ -33,6 +39,10 @@ class CartCallback(CallbackData, prefix="cart"):
     cart_id: Optional[int] = None
     quantity: Optional[int] = None
 
+# Callback data класс для выбора формата файла прайса
+class PriceFileCallback(CallbackData, prefix="pricefile"):
+    file_format: str
+
 # FSM состояния для добавления товара в корзину
 class AddToCartStates(StatesGroup):
     waiting_for_quantity = State()
@@ -187,6 +197,134 @@ def extract_sim_type(country):
     
     return None
 
+# Максимальная длина текста одного сообщения со списком товаров (с запасом до лимита Telegram)
+PRICE_PAGE_MAX_LEN = 3500
+
+# Готовые страницы списков товаров до изменения каталога или наценок. В ключе - набор цен
+# покупателя (price_group_key), поэтому пользователи без персональной наценки и участники
+# одной группы покупателей получают одни и те же страницы. Страницы пользователей
+# с персональной наценкой не кешируются, число страниц ограничено PRICE_PAGES_CACHE_SIZE
+PRICE_PAGES_CACHE_SIZE = 512
+_price_pages = VersionedCache(
+    lambda: (catalog_version(), get_version(SETTINGS_VERSION)),
+    max_size=PRICE_PAGES_CACHE_SIZE
+)
+
+def get_memory_sort_key(memory):
+    """Ключ сортировки групп памяти (чтобы 256GB, 512GB, 1TB, 2TB шли в правильном порядке)"""
+    if not memory or memory == 'Без памяти':
+        return (999, '')
+    # Извлекаем число и единицу
+    match = re.search(r'(\d+)(GB|TB)', memory, re.IGNORECASE)
+    if match:
+        value = int(match.group(1))
+        unit = match.group(2).upper()
+        # TB имеет больший вес (умножаем на 1000)
+        multiplier = 1000 if unit == 'TB' else 1
+        return (0, value * multiplier)
+    return (999, memory)
+
+def render_price_pages(products, final_prices, header, bot_username, start_prefix):
+    """
+    Тексты сообщений со списком товаров: группы по памяти, каждая строка товара -
+    ссылка /start <start_prefix><id> для добавления в корзину
+    """
+    # Группируем по памяти
+    memory_groups = OrderedDict()
+    for prod in products:
+        memory = extract_memory_from_name(prod['name'])
+        if not memory:
+            memory = 'Без памяти'  # Если память не найдена
+        memory_groups.setdefault(memory, []).append(prod)
+    
+    # Сортируем товары внутри группы памяти по цвету, типу SIM и цене
+    def sort_key(prod):
+        color = extract_color(prod['name']) or ''
+        sim_type = extract_sim_type(prod['country']) or ''
+        return (color, sim_type, prod['price'])
+    
+    pages = []
+    current_text = header
+    current_len = len(header)
+    
+    for memory in sorted(memory_groups.keys(), key=get_memory_sort_key):
+        memory_products = memory_groups[memory]
+        
+        # Заголовок для группы памяти - базовая модель первого товара и память
+        base_model = extract_base_model(memory_products[0]['name'])
+        memory_header = f"<b>📱 {base_model} {memory}</b>\n"
+        
+        # Не помещается - начинаем новое сообщение без заголовка категории
+        if current_len + len(memory_header) > PRICE_PAGE_MAX_LEN:
+            pages.append(current_text)
+            current_text = ""
+            current_len = 0
+        
+        current_text += memory_header
+        current_len += len(memory_header)
+        
+        for prod in sorted(memory_products, key=sort_key):
+            # Формируем текст товара в формате: название — тип SIM, цена
+            sim_type = extract_sim_type(prod['country'])
+            final_price = final_prices[prod['id']]
+            if sim_type:
+                product_text = f"{prod['name']} — {sim_type}, {final_price}₽"
+            else:
+                product_text = f"{prod['name']}, {final_price}₽"
+            
+            # Товар как кликабельная ссылка (deep link) в тексте
+            deep_link = f"https://t.me/{bot_username}?start={start_prefix}{prod['id']}"
+            product_line = f"<a href=\"{deep_link}\">{product_text}</a>\n"
+            
+            if current_len + len(product_line) > PRICE_PAGE_MAX_LEN:
+                pages.append(current_text)
+                current_text = ""
+                current_len = 0
+            
+            current_text += product_line
+            current_len += len(product_line)
+        
+        current_text += "\n"
+        current_len += 1
+    
+    # Последнее сообщение
+    if current_len > len(header):
+        pages.append(current_text)
+    return pages
+
+def _build_price_pages(category, user_id, is_preorder, bot_username):
+    if is_preorder:
+        products = get_preorder_products_by_category(category)
+        hint = "Нажмите на строку товара, чтобы добавить в корзину предзаказа:\n\n"
+        start_prefix = "preorder_"
+    else:
+        # Товары из обоих source ('standard' и 'simple') одним запросом
+        products = get_products_by_category(category)
+        hint = "Нажмите на строку товара, чтобы добавить в корзину:\n\n"
+        start_prefix = "add_"
+    if not products:
+        return ()
+    
+    # Цены всех товаров категории (с наценкой) одним проходом
+    final_prices = dict(zip([prod['id'] for prod in products], price_listing(products, user_id, is_preorder)))
+    header = f"<b>{get_category_with_icon(category)}</b>\n\n" + hint
+    return tuple(render_price_pages(products, final_prices, header, bot_username, start_prefix))
+
+async def get_price_pages(bot, category, user_id, is_preorder=False):
+    """Тексты сообщений со списком товаров категории для пользователя (пустой кортеж - товаров нет)"""
+    bot_username = (await bot.me()).username
+    group_key = price_group_key(user_id)
+    if group_key and group_key[0] == 'user':
+        # Персональная наценка: страницы нужны одному пользователю
+        return _build_price_pages(category, user_id, is_preorder, bot_username)
+    key = ('preorder' if is_preorder else 'products', category, group_key, bot_username)
+    return _price_pages.get(key, lambda: _build_price_pages(category, user_id, is_preorder, bot_username))
+
+async def send_price_pages(message, pages):
+    """Отправляет страницы списка товаров"""
+    for page in pages:
+        await message.answer(page, parse_mode='HTML', disable_web_page_preview=True)
+
 @router.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     """Обработчик команды /start с поддержкой deep links для добавления товара"""
@@ -210,7 +348,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
                 
                 # Показываем товар и запрашиваем количество
                 country_with_flag = get_country_with_flag(product['country'])
-                final_price = calculate_price_with_markup(product['price'], user_id, is_preorder=True)
+                final_price = calculate_product_price(product, user_id, is_preorder=True)
                 
                 await message.answer(
                     f"📦 <b>Товар предзаказа:</b>\n\n"
@@ -245,7 +383,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
                 
                 # Показываем товар и запрашиваем количество
                 country_with_flag = get_country_with_flag(product['country'])
-                final_price = calculate_price_with_markup(product['price'], user_id)
+                final_price = calculate_product_price(product, user_id)
                 
                 await message.answer(
                     f"📦 <b>Товар:</b>\n\n"
@@ -337,16 +475,10 @@ async def show_categories(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     user_states[user_id] = {'screen': 'categories', 'source': 'standard'}
     
-    # Получаем категории из БД (проверяем оба source: 'standard' и 'simple')
-    from db.crud import get_available_parent_categories
+    # Проверяем, есть ли категории в БД (оба source: 'standard' и 'simple')
+    from services.category import get_parent_categories
     
-    # Проверяем категории для обоих source
-    available_standard = get_available_parent_categories(None, 'standard')
-    available_simple = get_available_parent_categories(None, 'simple')
-    # Объединяем и убираем дубликаты
-    available_categories = list(set(available_standard + available_simple))
-    
-    if not available_categories:
+    if not get_parent_categories():
         await message.answer(
             "❌ В прайсе пока нет товаров.\n\n"
             "Администратор должен загрузить прайс через админку.",
@@ -406,7 +538,7 @@ async def show_preorder_info(message: types.Message, state: FSMContext):
     await message.answer(
         preorder_text,
         parse_mode='HTML',
-        reply_markup=get_preorder_categories_keyboard(preorder_categories)
+        reply_markup=get_preorder_categories_keyboard()
     )
 
 @router.message(lambda m: m.text == "Назад")
@@ -423,11 +555,10 @@ async def go_back(message: types.Message, state: FSMContext):
         # Логика для предзаказа
         if user_state.get('screen') == 'preorder_products':
             # Возвращаемся к категориям предзаказа
-            preorder_categories = get_preorder_categories()
             user_states[user_id] = {'screen': 'preorder_categories', 'is_preorder': True}
             await message.answer(
                 "Выберите категорию:",
-                reply_markup=get_preorder_categories_keyboard(preorder_categories)
+                reply_markup=get_preorder_categories_keyboard()
             )
         else:
             # Возвращаемся в главное меню
@@ -442,14 +573,6 @@ async def go_back(message: types.Message, state: FSMContext):
         
         if user_state.get('screen') == 'subcategories':
             # Возвращаемся к списку категорий
-            from db.crud import get_available_parent_categories
-            
-            # Проверяем категории для обоих source
-            available_standard = get_available_parent_categories(None, 'standard')
-            available_simple = get_available_parent_categories(None, 'simple')
-            # Объединяем и убираем дубликаты
-            available_categories = list(set(available_standard + available_simple))
-            
             user_states[user_id] = {'screen': 'categories', 'source': source}
             await message.answer(
                 "Выберите категорию:",
@@ -459,21 +582,15 @@ async def go_back(message: types.Message, state: FSMContext):
             # Возвращаемся к списку подкатегорий той же родительской категории
             parent_cat = user_state.get('parent_category')
             if parent_cat:
-                # Получаем подкатегории для этой родительской категории (проверяем оба source)
-                available_subcats_standard = get_available_subcategories(parent_cat, None, 'standard')
-                available_subcats_simple = get_available_subcategories(parent_cat, None, 'simple')
-                # Объединяем и убираем дубликаты
-                available_subcats = list(set(available_subcats_standard + available_subcats_simple))
-                
-                # Применяем сортировку после объединения
-                from db.crud import sort_categories_smart
-                available_subcats = sort_categories_smart(available_subcats)
+                # Получаем подкатегории для этой родительской категории (оба source, уже отсортированы)
+                from services.category import get_subcategories
+                available_subcats = get_subcategories(parent_cat)
                 
                 if available_subcats:
                     user_states[user_id] = {'screen': 'subcategories', 'parent_category': parent_cat, 'source': source}
                     await message.answer(
                         f"Выберите подкатегорию:",
-                        reply_markup=get_subcategories_keyboard(parent_cat, available_subcats)
+                        reply_markup=get_subcategories_keyboard(parent_cat)
                     )
                 else:
                     # Если нет подкатегорий, возвращаемся к главному меню
@@ -533,15 +650,11 @@ def is_parent_category(text, user_state=None):
     if user_state and user_state.get('is_preorder'):
         return False, None
     
-    # Получаем родительские категории из БД
-    from db.crud import get_available_parent_categories
+    # Ищем родительскую категорию в дереве категорий обоих source (кнопки выводятся без иконок)
+    from services.category import has_parent_category
     
-    # Проверяем оба source: 'standard' и 'simple'
-    for source in ['standard', 'simple']:
-        available_parents = get_available_parent_categories(None, source)
-        for parent_cat in available_parents:
-            if text == get_category_with_icon(parent_cat) or text == parent_cat:
-                return True, parent_cat
+    if has_parent_category(text):
+        return True, text
     
     return False, None
 
@@ -554,18 +667,11 @@ def is_subcategory(text, user_state=None):
     if user_state and user_state.get('is_preorder'):
         return False, None
     
-    # Получаем динамический маппинг категорий из БД
-    from db.crud import get_dynamic_parent_to_subcategories
+    # Ищем подкатегорию в дереве категорий обоих source (кнопки выводятся без иконок)
+    from services.category import get_parent_for_subcategory
     
-    # Проверяем оба source: 'standard' и 'simple'
-    for source in ['standard', 'simple']:
-        dynamic_mapping = get_dynamic_parent_to_subcategories(source)
-        
-        # Проверяем все подкатегории из всех родительских категорий
-        for parent_cat, subcats in dynamic_mapping.items():
-            for subcat in subcats:
-                if text == get_category_with_icon(subcat) or text == subcat:
-                    return True, subcat
+    if get_parent_for_subcategory(text):
+        return True, text
     
     return False, None
 
@@ -582,24 +688,15 @@ async def show_subcategories(message: types.Message):
     # Сохраняем состояние
     user_states[user_id] = {'screen': 'subcategories', 'parent_category': parent_cat, 'source': source}
     
-    # Получаем подкатегории, которые есть в БД (проверяем оба source: 'standard' и 'simple')
-    available_subcats_standard = get_available_subcategories(parent_cat, None, 'standard')
-    available_subcats_simple = get_available_subcategories(parent_cat, None, 'simple')
-    # Объединяем и убираем дубликаты
-    available_subcats = list(set(available_subcats_standard + available_subcats_simple))
-    
-    # Применяем сортировку после объединения
-    from db.crud import sort_categories_smart
-    available_subcats = sort_categories_smart(available_subcats)
+    # Получаем подкатегории, которые есть в БД (оба source: 'standard' и 'simple', без повторов и уже отсортированы)
+    from services.category import get_subcategories
+    available_subcats = get_subcategories(parent_cat)
     
     # Если подкатегорий нет, проверяем, есть ли товары напрямую в родительской категории
     if not available_subcats:
-        from db.crud import get_products_by_category
-        products_standard = get_products_by_category(parent_cat, 'standard')
-        products_simple = get_products_by_category(parent_cat, 'simple')
-        products = products_standard + products_simple
+        pages = await get_price_pages(message.bot, parent_cat, user_id)
         
-        if not products:
+        if not pages:
             await message.answer("В этой категории пока нет товаров.")
             return
         
@@ -619,126 +716,15 @@ async def show_subcategories(message: types.Message):
             'source': source
         }
         
-        # Получаем товары напрямую
-        from db.crud import get_products_by_category
-        products_standard = get_products_by_category(parent_cat, 'standard')
-        products_simple = get_products_by_category(parent_cat, 'simple')
-        products = products_standard + products_simple
-        
-        if not products:
-            await message.answer("В этой категории пока нет товаров.")
-            return
-        
-        # Показываем товары (используем ту же логику, что и в show_products_by_category)
-        # Импортируем необходимые функции
-        from bot.handlers.user import extract_memory_from_name, extract_base_model, extract_color, extract_sim_type
-        from admin.discount import calculate_price_with_markup
-        from collections import OrderedDict
-        import re
-        
-        category_header = get_category_with_icon(parent_cat)
-        
-        # Группируем по памяти
-        memory_groups = OrderedDict()
-        for prod in products:
-            memory = extract_memory_from_name(prod['name'])
-            if not memory:
-                memory = 'Без памяти'
-            if memory not in memory_groups:
-                memory_groups[memory] = []
-            memory_groups[memory].append(prod)
-        
-        # Формируем сообщения
-        header = f"<b>{category_header}</b>\n\n"
-        header += "Нажмите на строку товара, чтобы добавить в корзину:\n\n"
-        
-        bot_info = await message.bot.get_me()
-        bot_username = bot_info.username
-        
-        current_text = header
-        current_len = len(header)
-        max_text_len = 3500
-        is_first_message = True
-        
-        # Функция для сортировки памяти
-        def get_memory_sort_key(memory):
-            if not memory or memory == 'Без памяти':
-                return (999, '')
-            match = re.search(r'(\d+)(GB|TB)', memory, re.IGNORECASE)
-            if match:
-                value = int(match.group(1))
-                unit = match.group(2).upper()
-                multiplier = 1000 if unit == 'TB' else 1
-                return (0, value * multiplier)
-            return (999, memory)
-        
-        sorted_memories = sorted(memory_groups.keys(), key=get_memory_sort_key)
-        
-        for memory in sorted_memories:
-            memory_products = memory_groups[memory]
-            
-            if memory_products:
-                first_prod = memory_products[0]
-                base_model = extract_base_model(first_prod['name'])
-                memory_header = f"<b>📱 {base_model} {memory}</b>\n"
-            else:
-                memory_header = f"<b>📱 {memory}</b>\n"
-            
-            if current_len + len(memory_header) > max_text_len:
-                await message.answer(current_text, parse_mode='HTML', disable_web_page_preview=True)
-                current_text = ""
-                current_len = 0
-                is_first_message = False
-            
-            current_text += memory_header
-            current_len += len(memory_header)
-            
-            def sort_key(prod):
-                color = extract_color(prod['name']) or ''
-                sim_type = extract_sim_type(prod['country']) or ''
-                return (color, sim_type, prod['price'])
-            
-            memory_products_sorted = sorted(memory_products, key=sort_key)
-            
-            for prod in memory_products_sorted:
-                sim_type = extract_sim_type(prod['country'])
-                final_price = calculate_price_with_markup(prod['price'], user_id)
-                
-                if sim_type:
-                    product_text = f"{prod['name']} — {sim_type}, {final_price}₽"
-                else:
-                    product_text = f"{prod['name']}, {final_price}₽"
-                
-                deep_link = f"https://t.me/{bot_username}?start=add_{prod['id']}"
-                product_line = f"<a href=\"{deep_link}\">{product_text}</a>\n"
-                
-                if current_len + len(product_line) > max_text_len:
-                    await message.answer(current_text, parse_mode='HTML', disable_web_page_preview=True)
-                    current_text = ""
-                    current_len = 0
-                    is_first_message = False
-                
-                current_text += product_line
-                current_len += len(product_line)
-            
-            current_text += "\n"
-            current_len += 1
-        
-        if current_len > len(header):
-            await message.answer(current_text, parse_mode='HTML', disable_web_page_preview=True)
-        
-        from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-        back_keyboard = ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="Назад")]],
-            resize_keyboard=True
-        )
-        await message.answer("Нажмите на строку товара для добавления в корзину", reply_markup=back_keyboard)
+        # Страницы списка товаров родительской категории уже получены выше
+        await send_price_pages(message, pages)
+        await message.answer("Нажмите на строку товара для добавления в корзину", reply_markup=get_back_keyboard())
         return
     
     # Есть настоящие подкатегории, показываем их
     await message.answer(
         f"Выберите подкатегорию:",
-        reply_markup=get_subcategories_keyboard(parent_cat, available_subcats)
+        reply_markup=get_subcategories_keyboard(parent_cat)
     )
 
     return True
@@ -754,18 +740,9 @@ async def show_products_by_category(message: types.Message):
     source = user_state.get('source', 'standard')
     
     # Определяем родительскую категорию для этой подкатегории
-    parent_cat = None
-    from db.crud import get_dynamic_parent_to_subcategories
-    
-    # Проверяем оба source: 'standard' и 'simple'
-    for check_source in ['standard', 'simple']:
-        dynamic_mapping = get_dynamic_parent_to_subcategories(check_source)
-        for parent, subcats in dynamic_mapping.items():
-            if subcat in subcats:
-                parent_cat = parent
-                break
-        if parent_cat:
-            break
+    # (одним запросом к дереву категорий обоих source: 'standard' и 'simple')
+    from services.category import get_parent_for_subcategory
+    parent_cat = get_parent_for_subcategory(subcat)
     
     # Сохраняем состояние
     user_states[user_id] = {
@@ -775,136 +752,17 @@ async def show_products_by_category(message: types.Message):
         'source': source
     }
     
-    # Получаем товары из обоих source ('standard' и 'simple')
-    products_standard = get_products_by_category(subcat, 'standard')
-    products_simple = get_products_by_category(subcat, 'simple')
-    # Объединяем товары
-    products = products_standard + products_simple
+    # Список товаров из обоих source ('standard' и 'simple'), готовый для набора цен пользователя
+    pages = await get_price_pages(message.bot, subcat, user_id)
     
-    if not products:
+    if not pages:
         await message.answer("В этой категории пока нет товаров.")
         return
     
-    # Группируем товары только по памяти
-    category_header = get_category_with_icon(subcat)
-    
-    # Группируем по памяти
-    memory_groups = OrderedDict()
-    for prod in products:
-        memory = extract_memory_from_name(prod['name'])
-        if not memory:
-            memory = 'Без памяти'  # Если память не найдена
-        if memory not in memory_groups:
-            memory_groups[memory] = []
-        memory_groups[memory].append(prod)
-    
-    # Формируем сообщения с кликабельными ссылками для каждой строки товара
-    header = f"<b>{category_header}</b>\n\n"
-    header += "Нажмите на строку товара, чтобы добавить в корзину:\n\n"
-    
-    # Получаем username бота для deep links
-    bot_info = await message.bot.get_me()
-    bot_username = bot_info.username
-    
-    current_text = header
-    current_len = len(header)
-    max_text_len = 3500  # Оставляем запас для текста
-    is_first_message = True  # Флаг для первого сообщения
-    
-    # Функция для сортировки памяти (чтобы 256GB, 512GB, 1TB, 2TB шли в правильном порядке)
-    def get_memory_sort_key(memory):
-        if not memory or memory == 'Без памяти':
-            return (999, '')
-        # Извлекаем число и единицу
-        match = re.search(r'(\d+)(GB|TB)', memory, re.IGNORECASE)
-        if match:
-            value = int(match.group(1))
-            unit = match.group(2).upper()
-            # TB имеет больший вес (умножаем на 1000)
-            multiplier = 1000 if unit == 'TB' else 1
-            return (0, value * multiplier)
-        return (999, memory)
-    
-    # Сортируем группы памяти
-    sorted_memories = sorted(memory_groups.keys(), key=get_memory_sort_key)
-    
-    for memory in sorted_memories:
-        memory_products = memory_groups[memory]
-        
-        # Заголовок для группы памяти - берем первый товар и извлекаем модель с памятью
-        if memory_products:
-            first_prod = memory_products[0]
-            # Извлекаем базовую модель и добавляем память
-            base_model = extract_base_model(first_prod['name'])
-            memory_header = f"<b>📱 {base_model} {memory}</b>\n"
-        else:
-            memory_header = f"<b>📱 {memory}</b>\n"
-        
-        # Проверяем, поместится ли заголовок памяти
-        if current_len + len(memory_header) > max_text_len:
-            # Отправляем текущее сообщение
-            await message.answer(current_text, parse_mode='HTML', disable_web_page_preview=True)
-            # Начинаем новое сообщение без заголовка категории
-            current_text = ""
-            current_len = 0
-            is_first_message = False
-        
-        current_text += memory_header
-        current_len += len(memory_header)
-        
-        # Сортируем товары внутри группы памяти по цвету, типу SIM и цене
-        def sort_key(prod):
-            # Извлекаем цвет для сортировки
-            color = extract_color(prod['name']) or ''
-            # Извлекаем тип SIM
-            sim_type = extract_sim_type(prod['country']) or ''
-            # Сортируем: цвет, тип SIM, цена
-            return (color, sim_type, prod['price'])
-        
-        memory_products_sorted = sorted(memory_products, key=sort_key)
-        
-        for prod in memory_products_sorted:
-            # Извлекаем тип SIM из country
-            sim_type = extract_sim_type(prod['country'])
-            final_price = calculate_price_with_markup(prod['price'], user_id)
-            
-            # Формируем текст товара в формате: название — тип SIM, цена
-            if sim_type:
-                product_text = f"{prod['name']} — {sim_type}, {final_price}₽"
-            else:
-                product_text = f"{prod['name']}, {final_price}₽"
-            
-            # Формируем deep link для товара
-            deep_link = f"https://t.me/{bot_username}?start=add_{prod['id']}"
-            
-            # Добавляем товар как кликабельную ссылку в тексте
-            product_line = f"<a href=\"{deep_link}\">{product_text}</a>\n"
-            
-            if current_len + len(product_line) > max_text_len:
-                # Отправляем текущее сообщение
-                await message.answer(current_text, parse_mode='HTML', disable_web_page_preview=True)
-                # Начинаем новое сообщение без заголовка категории
-                current_text = ""
-                current_len = 0
-                is_first_message = False
-            
-            current_text += product_line
-            current_len += len(product_line)
-        
-        current_text += "\n"
-        current_len += 1
-    
-    # Отправляем последнее сообщение
-    if current_len > len(header):
-        await message.answer(current_text, parse_mode='HTML', disable_web_page_preview=True)
+    await send_price_pages(message, pages)
     
     # Отправляем кнопку "Назад"
-    from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-    back_keyboard = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="Назад")]],
-        resize_keyboard=True
-    )
-    await message.answer("Нажмите на строку товара для добавления в корзину", reply_markup=back_keyboard)
+    await message.answer("Нажмите на строку товара для добавления в корзину", reply_markup=get_back_keyboard())
 
 # Обработчик ввода количества товара
 @router.message(StateFilter(AddToCartStates.waiting_for_quantity))
@@ -964,7 +822,7 @@ async def process_quantity(message: types.Message, state: FSMContext):
         
         country_with_flag = get_country_with_flag(product['country'])
         # Применяем правильную наценку в зависимости от типа товара
-        final_price = calculate_price_with_markup(product['price'], user_id, is_preorder=is_preorder)
+        final_price = calculate_product_price(product, user_id, is_preorder=is_preorder)
         
         # Очищаем состояние
         await state.clear()
@@ -987,6 +845,66 @@ async def process_quantity(message: types.Message, state: FSMContext):
 
 
 # Обработчик просмотра корзины
+# Файлы прайса, которые уже создаются в этом процессе, и file_id отправленных файлов в Telegram
+# (повторная отправка того же файла - без загрузки). Формат: {путь к файлу: ...}
+_price_file_locks = {}
+_price_file_ids = {}
+
+async def get_price_file(user_id, file_format):
+    """Путь к файлу прайса с ценами пользователя; файл создается в отдельном потоке, если его еще нет"""
+    from services.price_list import build_price_file, price_file_path
+    
+    path = price_file_path(user_id, file_format)
+    lock = _price_file_locks.setdefault(path, asyncio.Lock())
+    async with lock:
+        # Один пользователь с этим набором цен ждет создания файла, остальные получают готовый
+        return await asyncio.to_thread(build_price_file, user_id, file_format)
+
+def _forget_stale_price_files():
+    for path in [path for path in _price_file_ids if not os.path.exists(path)]:
+        del _price_file_ids[path]
+    for path in [path for path, lock in _price_file_locks.items() if not lock.locked() and not os.path.exists(path)]:
+        del _price_file_locks[path]
+
+@router.message(lambda m: m.text == "📥 Скачать прайс")
+async def download_price_prompt(message: types.Message):
+    """Предлагает выбрать формат файла прайса"""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="📊 Excel (.xlsx)", callback_data=PriceFileCallback(file_format="xlsx").pack()),
+        InlineKeyboardButton(text="📄 Текст (.txt)", callback_data=PriceFileCallback(file_format="txt").pack()),
+    ]])
+    await message.answer(
+        "📥 <b>Прайс</b>\n\n"
+        "Весь актуальный прайс с вашими ценами одним файлом. Выберите формат:",
+        parse_mode='HTML',
+        reply_markup=keyboard
+    )
+
+@router.callback_query(PriceFileCallback.filter())
+async def send_price_file(callback: types.CallbackQuery, callback_data: PriceFileCallback):
+    """Отправляет файл прайса с ценами пользователя"""
+    from services.price_list import PRICE_FILE_FORMATS
+    
+    user_id = callback.from_user.id
+    file_format = callback_data.file_format
+    if file_format not in PRICE_FILE_FORMATS:
+        await callback.answer("❌ Неизвестный формат", show_alert=True)
+        return
+    
+    await callback.answer("⏳ Готовим прайс...")
+    try:
+        path = await get_price_file(user_id, file_format)
+    except Exception as e:
+        await callback.message.answer(f"❌ Не удалось подготовить прайс: {str(e)}")
+        return
+    
+    _forget_stale_price_files()
+    file_id = _price_file_ids.get(path)
+    document = file_id or FSInputFile(path, filename=f"Прайс {datetime.date.today():%d.%m.%Y}.{file_format}")
+    sent = await callback.message.answer_document(document, caption="📥 Актуальный прайс с вашими ценами")
+    if not file_id and getattr(sent, 'document', None):
+        _price_file_ids[path] = sent.document.file_id
+
 @router.message(lambda m: m.text == "Корзина")
 async def show_cart(message: types.Message, state: FSMContext):
     """Показывает корзину пользователя (обычную и предзаказа)"""
@@ -1015,9 +933,8 @@ async def show_cart(message: types.Message, state: FSMContext):
     # Обычные товары
     if cart_items:
         text += "<b>Обычные товары:</b>\n"
-        for item in cart_items:
+        for item, final_price in zip(cart_items, price_listing(cart_items, user_id)):
             country_with_flag = get_country_with_flag(item['country'])
-            final_price = calculate_price_with_markup(item['price'], user_id)
             item_price = final_price * item['quantity']
             total_price += item_price
             text += f"{item['name']}, {country_with_flag}\n"
@@ -1039,9 +956,8 @@ async def show_cart(message: types.Message, state: FSMContext):
     # Товары предзаказа
     if preorder_cart_items:
         text += "<b>Товары предзаказа:</b>\n"
-        for item in preorder_cart_items:
+        for item, final_price in zip(preorder_cart_items, price_listing(preorder_cart_items, user_id, is_preorder=True)):
             country_with_flag = get_country_with_flag(item['country'])
-            final_price = calculate_price_with_markup(item['price'], user_id, is_preorder=True)
             item_price = final_price * item['quantity']
             total_price += item_price
             text += f"{item['name']}, {country_with_flag}\n"
@@ -1137,9 +1053,8 @@ async def handle_cart_callback(callback: types.CallbackQuery):
             
             if cart_items:
                 text += "<b>Обычные товары:</b>\n"
-                for item in cart_items:
+                for item, final_price in zip(cart_items, price_listing(cart_items, user_id)):
                     country_with_flag = get_country_with_flag(item['country'])
-                    final_price = calculate_price_with_markup(item['price'], user_id)
                     item_price = final_price * item['quantity']
                     total_price += item_price
                     text += f"{item['name']}, {country_with_flag}\n"
@@ -1158,9 +1073,8 @@ async def handle_cart_callback(callback: types.CallbackQuery):
             
             if preorder_cart_items:
                 text += "<b>Товары предзаказа:</b>\n"
-                for item in preorder_cart_items:
+                for item, final_price in zip(preorder_cart_items, price_listing(preorder_cart_items, user_id, is_preorder=True)):
                     country_with_flag = get_country_with_flag(item['country'])
-                    final_price = calculate_price_with_markup(item['price'], user_id, is_preorder=True)
                     item_price = final_price * item['quantity']
                     total_price += item_price
                     text += f"{item['name']}, {country_with_flag}\n"
@@ -1225,9 +1139,8 @@ async def handle_cart_callback(callback: types.CallbackQuery):
                 
                 if cart_items:
                     text += "<b>Обычные товары:</b>\n"
-                    for item in cart_items:
+                    for item, final_price in zip(cart_items, price_listing(cart_items, user_id)):
                         country_with_flag = get_country_with_flag(item['country'])
-                        final_price = calculate_price_with_markup(item['price'], user_id)
                         item_price = final_price * item['quantity']
                         total_price += item_price
                         text += f"{item['name']}, {country_with_flag}\n"
@@ -1246,9 +1159,8 @@ async def handle_cart_callback(callback: types.CallbackQuery):
                 
                 if preorder_cart_items:
                     text += "<b>Товары предзаказа:</b>\n"
-                    for item in preorder_cart_items:
+                    for item, final_price in zip(preorder_cart_items, price_listing(preorder_cart_items, user_id, is_preorder=True)):
                         country_with_flag = get_country_with_flag(item['country'])
-                        final_price = calculate_price_with_markup(item['price'], user_id, is_preorder=True)
                         item_price = final_price * item['quantity']
                         total_price += item_price
                         text += f"{item['name']}, {country_with_flag}\n"
@@ -1324,9 +1236,8 @@ async def handle_cart_callback(callback: types.CallbackQuery):
             total_price = 0
             keyboard_buttons = []
             
-            for item in cart_items:
+            for item, final_price in zip(cart_items, price_listing(cart_items, user_id)):
                 country_with_flag = get_country_with_flag(item['country'])
-                final_price = calculate_price_with_markup(item['price'], user_id)
                 item_price = final_price * item['quantity']
                 total_price += item_price
                 text += f"{item['name']}, {country_with_flag}\n"
@@ -1392,9 +1303,8 @@ async def handle_cart_callback(callback: types.CallbackQuery):
                 total_price = 0
                 keyboard_buttons = []
                 
-                for item in cart_items:
+                for item, final_price in zip(cart_items, price_listing(cart_items, user_id)):
                     country_with_flag = get_country_with_flag(item['country'])
-                    final_price = calculate_price_with_markup(item['price'], user_id)
                     item_price = final_price * item['quantity']
                     total_price += item_price
                     text += f"{item['name']}, {country_with_flag}\n"
@@ -1514,9 +1424,10 @@ def is_preorder_category_selection(message: types.Message) -> bool:
     
     # Исключаем системные кнопки
     system_buttons = ["Прайс", "Предзаказ", "Корзина", "Админка", "📞 Связаться с администратором", "Назад", 
-                      "📊 Загрузить прайс", "📦 Прайс предзаказа", "⚙️ Настройка наценки",
+                      "📥 Скачать прайс", "📊 Загрузить прайс", "📦 Прайс предзаказа", "⚙️ Настройка наценки",
                       "📈 Текущая наценка", "📋 Статистика", "🔙 Назад", "📦 Заказы",
-                      "👤 Персональные проценты"]
+                      "👤 Персональные проценты", "💲 Правила наценки", "👥 Группы покупателей",
+                      "📤 Выгрузка заказов"]
     if message.text in system_buttons:
         return False
     
@@ -1561,9 +1472,9 @@ async def handle_preorder_category(message: types.Message, state: FSMContext):
     # Текст уже без иконок
     category_clean = category_text.strip()
     
-    # Получаем товары предзаказа по категории (проверка категории уже была в фильтре)
-    products = get_preorder_products_by_category(category_clean)
-    if not products:
+    # Список товаров предзаказа категории (проверка категории уже была в фильтре)
+    pages = await get_price_pages(message.bot, category_clean, user_id, is_preorder=True)
+    if not pages:
         await message.answer("В этой категории предзаказа пока нет товаров.")
         return
     
@@ -1574,123 +1485,7 @@ async def handle_preorder_category(message: types.Message, state: FSMContext):
         'is_preorder': True
     }
     
-    # Группируем товары только по памяти
-    category_header = get_category_with_icon(category_clean)
-    
-    # Группируем по памяти
-    memory_groups = OrderedDict()
-    for prod in products:
-        memory = extract_memory_from_name(prod['name'])
-        if not memory:
-            memory = 'Без памяти'  # Если память не найдена
-        if memory not in memory_groups:
-            memory_groups[memory] = []
-        memory_groups[memory].append(prod)
-    
-    # Формируем сообщения с кликабельными ссылками для каждой строки товара
-    header = f"<b>{category_header}</b>\n\n"
-    header += "Нажмите на строку товара, чтобы добавить в корзину предзаказа:\n\n"
-    
-    # Получаем username бота для deep links
-    bot_info = await message.bot.get_me()
-    bot_username = bot_info.username
-    
-    current_text = header
-    current_len = len(header)
-    max_text_len = 3500  # Оставляем запас для текста
-    is_first_message = True  # Флаг для первого сообщения
-    
-    # Функция для сортировки памяти (чтобы 256GB, 512GB, 1TB, 2TB шли в правильном порядке)
-    def get_memory_sort_key(memory):
-        if not memory or memory == 'Без памяти':
-            return (999, '')
-        # Извлекаем число и единицу
-        match = re.search(r'(\d+)(GB|TB)', memory, re.IGNORECASE)
-        if match:
-            value = int(match.group(1))
-            unit = match.group(2).upper()
-            # TB имеет больший вес (умножаем на 1000)
-            multiplier = 1000 if unit == 'TB' else 1
-            return (0, value * multiplier)
-        return (999, memory)
-    
-    # Сортируем группы памяти
-    sorted_memories = sorted(memory_groups.keys(), key=get_memory_sort_key)
-    
-    for memory in sorted_memories:
-        memory_products = memory_groups[memory]
-        
-        # Заголовок для группы памяти - берем первый товар и извлекаем модель с памятью
-        if memory_products:
-            first_prod = memory_products[0]
-            # Извлекаем базовую модель и добавляем память
-            base_model = extract_base_model(first_prod['name'])
-            memory_header = f"<b>📱 {base_model} {memory}</b>\n"
-        else:
-            memory_header = f"<b>📱 {memory}</b>\n"
-        
-        # Проверяем, поместится ли заголовок памяти
-        if current_len + len(memory_header) > max_text_len:
-            # Отправляем текущее сообщение
-            await message.answer(current_text, parse_mode='HTML', disable_web_page_preview=True)
-            # Начинаем новое сообщение без заголовка категории
-            current_text = ""
-            current_len = 0
-            is_first_message = False
-        
-        current_text += memory_header
-        current_len += len(memory_header)
-        
-        # Сортируем товары внутри группы памяти по цвету, типу SIM и цене
-        def sort_key(prod):
-            # Извлекаем цвет для сортировки
-            color = extract_color(prod['name']) or ''
-            # Извлекаем тип SIM
-            sim_type = extract_sim_type(prod['country']) or ''
-            # Сортируем: цвет, тип SIM, цена
-            return (color, sim_type, prod['price'])
-        
-        memory_products_sorted = sorted(memory_products, key=sort_key)
-        
-        for prod in memory_products_sorted:
-            # Извлекаем тип SIM из country
-            sim_type = extract_sim_type(prod['country'])
-            final_price = calculate_price_with_markup(prod['price'], user_id, is_preorder=True)
-            
-            # Формируем текст товара в формате: название — тип SIM, цена
-            if sim_type:
-                product_text = f"{prod['name']} — {sim_type}, {final_price}₽"
-            else:
-                product_text = f"{prod['name']}, {final_price}₽"
-            
-            # Формируем deep link для товара предзаказа
-            deep_link = f"https://t.me/{bot_username}?start=preorder_{prod['id']}"
-            
-            # Добавляем товар как кликабельную ссылку в тексте
-            product_line = f"<a href=\"{deep_link}\">{product_text}</a>\n"
-            
-            if current_len + len(product_line) > max_text_len:
-                # Отправляем текущее сообщение
-                await message.answer(current_text, parse_mode='HTML', disable_web_page_preview=True)
-                # Начинаем новое сообщение без заголовка категории
-                current_text = ""
-                current_len = 0
-                is_first_message = False
-            
-            current_text += product_line
-            current_len += len(product_line)
-        
-        current_text += "\n"
-        current_len += 1
-    
-    # Отправляем последнее сообщение
-    if current_len > len(header):
-        await message.answer(current_text, parse_mode='HTML', disable_web_page_preview=True)
+    await send_price_pages(message, pages)
     
     # Отправляем кнопку "Назад"
-    from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-    back_keyboard = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="Назад")]],
-        resize_keyboard=True
-    )
-    await message.answer("Нажмите на строку товара для добавления в корзину предзаказа", reply_markup=back_keyboard)
+    await message.answer("Нажмите на строку товара для добавления в корзину предзаказа", reply_markup=get_back_keyboard())
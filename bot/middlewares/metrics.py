@@ -0,0 +1,67 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+from services.metrics import inc, observe
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на уровне update: замеряет полное время обработки update,
+    включая фильтры (поиск категорий в БД и т.д.) и сам обработчик.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            observe('bot_update_seconds', time.perf_counter() - started, {"type": event.event_type})
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Inner-middleware роутера: замеряет время работы обработчика.
+    Метка handler - имя функции-обработчика (show_cart, handle_price_file и т.д.).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        handler_name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        labels = {"handler": handler_name}
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            inc('bot_handler_errors_total', labels)
+            raise
+        finally:
+            observe('bot_handler_seconds', time.perf_counter() - started, labels)
+
+class TelegramRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: считает вызовы Telegram Bot API и их длительность"""
+
+    async def __call__(self, make_request, bot, method):
+        labels = {"method": type(method).__name__}
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            inc('telegram_api_requests_total', labels)
+            observe('telegram_api_seconds', time.perf_counter() - started, labels)
+
+def setup_metrics_middlewares(dp, routers):
+    """Подключает middleware метрик к диспетчеру и роутерам"""
+    dp.update.outer_middleware(UpdateTimingMiddleware())
+    for router in routers:
+        router.message.middleware(HandlerTimingMiddleware())
+        router.callback_query.middleware(HandlerTimingMiddleware())
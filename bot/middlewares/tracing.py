@@ -0,0 +1,28 @@
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from db import tracing
+
+def _update_label(update):
+    """Краткое описание update для лога: тип события и текст/данные callback"""
+    event = update.event
+    text = getattr(event, 'text', None) or getattr(event, 'data', None) or ''
+    return f"{update.event_type}: {text[:40]}"
+
+class SqlTraceMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на уровне update: считает SQL-запросы, выполненные при обработке
+    одного update (включая фильтры), и пишет в лог update с подозрением на N+1.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        token = tracing.begin_request(_update_label(event))
+        try:
+            return await handler(event, data)
+        finally:
+            tracing.end_request(token)
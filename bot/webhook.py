@@ -0,0 +1,229 @@
+"""
+Webhook с несколькими процессами-обработчиками.
+
+Супервизор принимает update от Telegram (HTTP-сервер aiohttp) и раскладывает их
+по процессам-обработчикам по хешу ID пользователя: все update одного пользователя
+попадают в один процесс, поэтому состояние навигации (user_states), FSM
+(AddToCartStates в MemoryStorage) и операции с корзиной пользователя остаются
+согласованными, а разные пользователи обслуживаются параллельно на разных ядрах.
+Внутри процесса update одного пользователя обрабатываются строго по порядку,
+update разных пользователей - конкурентно.
+Супервизор раз в WATCH_SECONDS проверяет процессы: упавший процесс перезапускается
+с новой очередью (update, которые оставались в старой очереди, теряются), админы получают сообщение.
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+import zlib
+from aiohttp import web
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Процессы-обработчики создаются через fork (фабрики бота и диспетчера не нужно сериализовать)
+_mp = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# Интервал проверки процессов-обработчиков в секундах
+WATCH_SECONDS = 5
+
+def update_user_id(update):
+    """ID пользователя-отправителя update (dict в формате Bot API) или None"""
+    for value in update.values():
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('user')
+            if isinstance(sender, dict) and 'id' in sender:
+                return sender['id']
+    return None
+
+def shard_for_user(user_id, workers):
+    """Номер процесса-обработчика для пользователя (update без пользователя - в процесс 0)"""
+    if user_id is None:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % workers
+
+class UserOrderedExecutor:
+    """Выполняет update одного пользователя строго по очереди, разных пользователей - конкурентно"""
+
+    def __init__(self, handle):
+        self._handle = handle
+        self._tails = {}
+        self._tasks = set()
+
+    def submit(self, user_id, update):
+        """Ставит update в очередь пользователя (обработка начнется после предыдущих update пользователя)"""
+        previous = self._tails.get(user_id)
+        task = asyncio.create_task(self._run(previous, update))
+        self._tails[user_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._finish(user_id, done))
+
+    def _finish(self, user_id, task):
+        self._tasks.discard(task)
+        if self._tails.get(user_id) is task:
+            del self._tails[user_id]
+
+    async def _run(self, previous, update):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self._handle(update)
+        except Exception:
+            logger.exception("Ошибка обработки update %s", update.get('update_id'))
+
+    async def join(self):
+        """Ждет завершения всех поставленных update"""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+async def _worker_main(index, queue, bot_factory, dispatcher_factory):
+    bot = bot_factory()
+    dp = dispatcher_factory()
+    executor = UserOrderedExecutor(lambda update: dp.feed_raw_update(bot, update))
+
+    from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+    if METRICS_ENABLED and METRICS_PORT:
+        # Каждый процесс отдает свои метрики на отдельном порту: METRICS_PORT + 1 + номер процесса
+        from services.metrics import start_metrics_server
+        await start_metrics_server(METRICS_HOST, METRICS_PORT + 1 + index)
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            update = await loop.run_in_executor(None, queue.get)
+            if update is None:
+                break
+            executor.submit(update_user_id(update), update)
+        await executor.join()
+    finally:
+        await bot.session.close()
+
+def run_worker(index, queue, bot_factory, dispatcher_factory):
+    """Точка входа процесса-обработчика: update из очереди до получения None"""
+    # Остановкой управляет супервизор (None в очереди), Ctrl+C обрабатывает только он
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_main(index, queue, bot_factory, dispatcher_factory))
+
+class Supervisor:
+    """Процессы-обработчики и распределение update между ними"""
+
+    def __init__(self, workers, bot_factory, dispatcher_factory):
+        self.workers = workers
+        self.bot_factory = bot_factory
+        self.dispatcher_factory = dispatcher_factory
+        self.queues = [_mp.Queue() for _ in range(workers)]
+        self.processes = [self._make_process(index) for index in range(workers)]
+        self.restarts = [0] * workers
+
+    def _make_process(self, index):
+        # Не daemon: обработчик сам запускает процессы (пул разбора листов прайса),
+        # а daemon-процессам это запрещено; процессы останавливает stop()
+        return _mp.Process(
+            target=run_worker, args=(index, self.queues[index], self.bot_factory, self.dispatcher_factory),
+            name=f"bot-worker-{index}"
+        )
+
+    def start(self):
+        """Запускает процессы (до создания event loop супервизора)"""
+        for process in self.processes:
+            process.start()
+
+    def restart_dead(self):
+        """Перезапускает завершившиеся процессы-обработчики, возвращает [(номер процесса, exitcode)]"""
+        restarted = []
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            # Процесс мог завершиться, удерживая блокировку чтения очереди, - новому процессу новая очередь;
+            # старую не дожидаемся при выходе (ее уже никто не читает)
+            self.queues[index].cancel_join_thread()
+            self.queues[index].close()
+            self.queues[index] = _mp.Queue()
+            self.processes[index] = self._make_process(index)
+            self.processes[index].start()
+            self.restarts[index] += 1
+            metrics.inc('webhook_worker_restarts_total', {'worker': index})
+            restarted.append((index, process.exitcode))
+        return restarted
+
+    async def watch(self, bot, interval=WATCH_SECONDS):
+        """Проверяет процессы-обработчики до отмены задачи: упавшие перезапускает и сообщает админам"""
+        from services.maintenance import notify_admins
+
+        while True:
+            await asyncio.sleep(interval)
+            for index, exitcode in self.restart_dead():
+                logger.error("Процесс-обработчик %s завершился (код %s), перезапущен", index, exitcode)
+                await notify_admins(
+                    bot,
+                    f"⚠️ Процесс-обработчик webhook {index} завершился (код {exitcode}) и перезапущен. "
+                    f"Update его пользователей, не обработанные до падения, потеряны."
+                )
+
+    def dispatch(self, update):
+        """Передает update процессу пользователя, возвращает номер процесса"""
+        shard = shard_for_user(update_user_id(update), self.workers)
+        self.queues[shard].put(update)
+        return shard
+
+    def stop(self, timeout=30):
+        """Останавливает процессы после обработки уже переданных update"""
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def make_app(self, path, secret=''):
+        """aiohttp-приложение webhook: update передается процессу сразу, ответ Telegram - без ожидания обработки"""
+
+        async def handle_update(request):
+            if secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+                return web.Response(status=401)
+            self.dispatch(await request.json())
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(path, handle_update)
+        return app
+
+    async def serve(self, host, port, path, secret='', url=''):
+        """
+        HTTP-сервер webhook (и регистрация url в Telegram, если задан), проверка процессов-обработчиков
+        и фоновое обслуживание базы до остановки процесса
+        """
+        runner = web.AppRunner(self.make_app(path, secret))
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Webhook %s:%s%s, процессов-обработчиков: %s", host, port, path, self.workers)
+
+        bot = self.bot_factory()
+        if url:
+            await bot.set_webhook(url, secret_token=secret or None)
+
+        # Фоновое обслуживание базы - в супервизоре, один раз на все процессы-обработчики
+        from services.maintenance import run_maintenance
+        maintenance = asyncio.create_task(run_maintenance(bot))
+        watcher = asyncio.create_task(self.watch(bot))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            watcher.cancel()
+            maintenance.cancel()
+            await bot.session.close()
+            await runner.cleanup()
+
+def run_supervisor(workers, bot_factory, dispatcher_factory):
+    """Запускает процессы-обработчики и HTTP-сервер webhook (настройки WEBHOOK_* из config)"""
+    from config import WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL
+
+    supervisor = Supervisor(workers, bot_factory, dispatcher_factory)
+    supervisor.start()
+    try:
+        asyncio.run(supervisor.serve(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
@@ -24,8 +24,58 @@ DEFAULT_MARKUP_AMOUNT = int(os.getenv("DEFAULT_MARKUP_AMOUNT", "0"))
 # Стандартная наценка для предзаказа (сумма в рублях)
 DEFAULT_PREORDER_MARKUP_AMOUNT = int(os.getenv("DEFAULT_PREORDER_MARKUP_AMOUNT", "0"))
 
-# Директория для загруженных прайс-листов
-PRICE_UPLOAD_DIR = os.getenv("PRICE_UPLOAD_DIR", "data/samples")
+# Размер загружаемого прайса в МБ, до которого он обрабатывается в памяти (больше - во временном файле ОС)
+PRICE_UPLOAD_MEMORY_MB = int(os.getenv("PRICE_UPLOAD_MEMORY_MB", "32"))
+
+# Директория готовых файлов прайса для покупателей (кнопка "Скачать прайс")
+PRICE_EXPORT_DIR = os.getenv("PRICE_EXPORT_DIR", "data/price_exports")
 
 # ID администратора для ответов пользователям (кнопка "Связаться с администратором")
 ADMIN_HELP = int(os.getenv("ADMIN_HELP", "0")) if os.getenv("ADMIN_HELP") else None
+
+# Фоновое обслуживание базы (services/maintenance.py): интервал очистки корзин в минутах, 0 - обслуживание выключено
+MAINTENANCE_INTERVAL_MINUTES = int(os.getenv("MAINTENANCE_INTERVAL_MINUTES", "60"))
+
+# Срок хранения позиций корзины и корзины предзаказа в днях (от последнего изменения позиции), 0 - не удалять по сроку
+CART_TTL_DAYS = int(os.getenv("CART_TTL_DAYS", "30"))
+
+# Резервные копии базы: директория, интервал в часах (0 - не создавать), сколько последних копий хранить
+BACKUP_DIR = os.getenv("BACKUP_DIR", "data/backups")
+BACKUP_INTERVAL_HOURS = int(os.getenv("BACKUP_INTERVAL_HOURS", "24"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+
+# Тихие часы для incremental vacuum по времени сервера ("3-5" - с 3:00 до 5:00), пусто - не выполнять
+VACUUM_HOURS = os.getenv("VACUUM_HOURS", "3-5")
+
+# Сбор метрик производительности (обработчики, SQL-запросы, Telegram API): "1" - включен.
+# Метрики хранятся в памяти процесса: в режиме webhook у каждого процесса-обработчика свои
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+
+# Локальный HTTP endpoint метрик в формате Prometheus (порт 0 - endpoint выключен)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Трассировка SQL-запросов (время, место вызова, EXPLAIN QUERY PLAN медленных запросов): "1" - включена
+SQL_TRACE = os.getenv("SQL_TRACE", "0") == "1"
+
+# Порог медленного SQL-запроса в миллисекундах (пишется в лог вместе с планом запроса)
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "50"))
+
+# Количество SQL-запросов в одном update, после которого в лог пишется предупреждение (поиск N+1)
+SQL_REQUEST_QUERY_LIMIT = int(os.getenv("SQL_REQUEST_QUERY_LIMIT", "30"))
+
+# JSON файл с таблицей правил сортировки моделей (см. services/ordering.py), пусто - встроенные правила
+CATEGORY_ORDER_RULES_FILE = os.getenv("CATEGORY_ORDER_RULES_FILE", "")
+
+# Режим webhook с несколькими процессами-обработчиками (bot/webhook.py): количество процессов,
+# 0 - polling в одном процессе. Обновления распределяются по процессам по ID пользователя
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "0"))
+
+# Адрес и путь HTTP-сервера webhook, секрет (заголовок X-Telegram-Bot-Api-Secret-Token)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Публичный URL webhook, регистрируется в Telegram при запуске (пусто - не регистрировать)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
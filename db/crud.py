@@ -1,5 +1,9 @@
 from db.models import get_db
-from admin.discount import calculate_price_with_markup
+from admin.discount import price_listing
+from services.ordering import sort_categories
+from services import category as services_category
+from services import product as services_product
+from services.stats import record_order_sales, refresh_catalog_stats
 
 def get_country_with_flag(country):
     """Возвращает страну с флагом (всегда возвращает как есть, так как в БД уже сохранен флаг)"""
@@ -11,26 +15,8 @@ def get_country_with_flag(country):
     return country_str
 
 def get_products_by_category(category, source='standard'):
-    """Получает товары по категории с фильтрацией по source"""
-    with get_db() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT id, name, memory, color, country, price
-            FROM products
-            WHERE category=? AND source=?
-            ORDER BY price
-        """, (category, source))
-        rows = cur.fetchall()
-        return [
-            {
-                "id": row[0],
-                "name": row[1],
-                "memory": row[2],
-                "color": row[3],
-                "country": row[4],
-                "price": row[5],
-            } for row in rows
-        ]
+    """Получает товары по категории с фильтрацией по source (для нескольких прайсов - services/product.py)"""
+    return services_product.get_products_by_category(category, (source,))
 
 def get_available_parent_categories(possible_parent_cats=None, source='standard'):
     """Получает список родительских категорий, в которых есть товары с указанным source"""
@@ -53,94 +39,9 @@ def sort_categories_smart(categories):
     """
     Умная сортировка категорий с учетом номеров моделей и вариантов.
     Например: iPhone 15, iPhone 15 Pro, iPhone 16, iPhone 16 Pro, iPhone 17, iPhone 17 Air, iPhone 17 Pro
+    Правила сортировки - таблица в services/ordering.py (ключи кешируются по категории).
     """
-    import re
-    
-    def get_sort_key(category):
-        # Извлекаем бренд, номер модели и вариант
-        # Примеры: "iPhone 15 Pro", "Samsung Galaxy S24 Ultra", "Xiaomi 14 Pro"
-        
-        # Для iPhone
-        iphone_match = re.search(r'iPhone\s+(\d+)\s*(.*)', category)
-        if iphone_match:
-            model_num = int(iphone_match.group(1))
-            variant = iphone_match.group(2).strip()
-            
-            # Определяем приоритет варианта (базовая модель идет первой)
-            variant_priority = 0
-            if not variant:  # Базовая модель (iPhone 15)
-                variant_priority = 0
-            elif 'Air' in variant:
-                variant_priority = 1
-            elif 'Pro Max' in variant:
-                variant_priority = 3
-            elif 'Pro' in variant:
-                variant_priority = 2
-            elif 'Ultra' in variant:
-                variant_priority = 4
-            else:
-                variant_priority = 5
-                
-            return (0, model_num, variant_priority, variant)
-        
-        # Для Samsung Galaxy
-        samsung_match = re.search(r'Samsung Galaxy S(\d+)\s*(.*)', category)
-        if samsung_match:
-            model_num = int(samsung_match.group(1))
-            variant = samsung_match.group(2).strip()
-            
-            variant_priority = 0
-            if not variant:
-                variant_priority = 0
-            elif 'Ultra' in variant:
-                variant_priority = 2
-            elif '+' in variant:
-                variant_priority = 1
-            else:
-                variant_priority = 3
-                
-            return (1, model_num, variant_priority, variant)
-        
-        # Для Xiaomi
-        xiaomi_match = re.search(r'Xiaomi\s+(\d+)\s*(.*)', category)
-        if xiaomi_match:
-            model_num = int(xiaomi_match.group(1))
-            variant = xiaomi_match.group(2).strip()
-            
-            variant_priority = 0
-            if not variant:
-                variant_priority = 0
-            elif 'Pro' in variant:
-                variant_priority = 1
-            elif 'Ultra' in variant:
-                variant_priority = 2
-            else:
-                variant_priority = 3
-                
-            return (2, model_num, variant_priority, variant)
-        
-        # Для Google Pixel
-        pixel_match = re.search(r'Google Pixel\s+(\d+)\s*(.*)', category)
-        if pixel_match:
-            model_num = int(pixel_match.group(1))
-            variant = pixel_match.group(2).strip()
-            
-            variant_priority = 0
-            if not variant:
-                variant_priority = 0
-            elif 'Pro XL' in variant:
-                variant_priority = 2
-            elif 'Pro' in variant:
-                variant_priority = 1
-            else:
-                variant_priority = 3
-                
-            return (3, model_num, variant_priority, variant)
-        
-        # Для остальных категорий - сортируем по алфавиту
-        return (999, 0, 0, category)
-    
-    return sorted(categories, key=get_sort_key)
+    return sort_categories(categories)
 
 def get_available_subcategories(parent_category, possible_subcats=None, source='standard'):
     """Получает список подкатегорий, которые есть в БД для родительской категории с фильтрацией по source"""
@@ -153,29 +54,27 @@ def get_available_subcategories(parent_category, possible_subcats=None, source='
     if not db_subcats:
         return []
     
+    # Если список не передан, используем только категории из БД (уже в порядке умной сортировки)
+    if possible_subcats is None:
+        return db_subcats
+    
     # Если передан список возможных подкатегорий, объединяем его с категориями из БД
     # Это позволяет показывать как статические подкатегории, так и новые из БД
-    if possible_subcats is not None:
-        # Объединяем статический список и динамические категории из БД
-        all_possible = list(set(possible_subcats + db_subcats))
-    else:
-        # Если список не передан, используем только категории из БД
-        all_possible = db_subcats
+    all_possible = list(set(possible_subcats + db_subcats))
     
     with get_db() as conn:
         cur = conn.cursor()
-        # Получаем уникальные категории из БД, которые есть в списке подкатегорий
+        # Получаем категории из дерева категорий, которые есть в списке подкатегорий
+        # (умная сортировка - по сохраненному при загрузке ключу sort_key)
         placeholders = ','.join(['?'] * len(all_possible))
         cur.execute(f"""
-            SELECT DISTINCT category
-            FROM products
-            WHERE category IN ({placeholders}) AND source=?
+            SELECT DISTINCT subcategory, sort_key
+            FROM category_tree
+            WHERE subcategory IN ({placeholders}) AND source=?
+            ORDER BY sort_key, subcategory
         """, all_possible + [source])
         rows = cur.fetchall()
-        categories = [row[0] for row in rows]
-        
-        # Применяем умную сортировку
-        return sort_categories_smart(categories)
+        return [row[0] for row in rows]
 
 def get_dynamic_subcategories_for_parent(parent_category, source='standard'):
     """Получает подкатегории для родительской категории из динамического маппинга"""
@@ -187,156 +86,41 @@ def get_all_categories_from_db(source='standard'):
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("""
-            SELECT DISTINCT category
-            FROM products
+            SELECT DISTINCT subcategory
+            FROM category_tree
             WHERE source=?
-            ORDER BY category
+            ORDER BY subcategory
         """, (source,))
         rows = cur.fetchall()
         return [row[0] for row in rows]
 
-def detect_parent_category_from_name(category_name):
-    """
-    Автоматически определяет родительскую категорию на основе названия категории.
-    Поддерживает известные бренды и автоматически создает новые родительские категории для неизвестных.
-    """
-    if not category_name:
-        return 'Аксессуары'
-    
-    category_upper = category_name.upper()
-    
-    # Маппинг известных брендов (проверяем от более специфичных к общим)
-    brand_patterns = [
-        # Apple (проверяем первым, так как может содержать другие слова)
-        (['IPHONE', 'IPAD', 'MACBOOK', 'APPLE', 'AIRPODS', 'MAC MINI', 'IMAC', 'WATCH'], 'Apple'),
-        # Samsung
-        (['SAMSUNG'], 'Samsung'),
-        # Google Pixel
-        (['GOOGLE', 'PIXEL'], 'Google Pixel'),
-        # Xiaomi
-        (['XIAOMI'], 'Xiaomi'),
-        # Redmi
-        (['REDMI'], 'Redmi'),
-        # POCO
-        (['POCO'], 'POCO'),
-        # Honor
-        (['HONOR'], 'Honor'),
-        # Huawei
-        (['HUAWEI'], 'Huawei'),
-        # Vivo
-        (['VIVO'], 'Vivo'),
-        # Realme
-        (['REALME'], 'Realme'),
-        # Yandex
-        (['YANDEX'], 'Yandex'),
-        # Meta Quest
-        (['META', 'QUEST'], 'Meta Quest'),
-        # Nintendo
-        (['NINTENDO'], 'Nintendo'),
-        # Valve
-        (['VALVE'], 'Valve'),
-        # Sony
-        (['SONY'], 'Sony'),
-        # GoPro
-        (['GOPRO'], 'GoPro'),
-        # Insta360
-        (['INSTA360'], 'Insta360'),
-        # Garmin
-        (['GARMIN'], 'Garmin'),
-        # Dyson
-        (['DYSON'], 'Dyson'),
-    ]
-    
-    # Проверяем известные бренды
-    for patterns, parent in brand_patterns:
-        if any(pattern in category_upper for pattern in patterns):
-            return parent
-    
-    # Если категория не распознана, пытаемся определить родительскую категорию автоматически
-    # Извлекаем первое слово из категории (обычно это бренд)
-    words = category_name.split()
-    if words:
-        first_word = words[0].strip()
-        # Если первое слово выглядит как бренд (заглавные буквы или смешанный регистр)
-        if first_word and (first_word[0].isupper() or first_word.isupper()):
-            # Используем первое слово как родительскую категорию
-            return first_word
-    
-    # По умолчанию - Аксессуары
-    return 'Аксессуары'
-
 def get_dynamic_parent_to_subcategories(source='standard'):
     """
     Создает динамический маппинг родительских категорий к подкатегориям
     на основе данных из базы данных.
     
-    Теперь использует поле parent_category из БД, если оно заполнено.
-    Fallback на старую логику определения родителя по названию.
+    Читает дерево категорий (category_tree): оно пересчитывается при каждой
+    загрузке прайса (родительские категории - из заголовков прайса или по бренду
+    в названии категории), поэтому классификация и DISTINCT по товарам при запросе не нужны.
     """
     with get_db() as conn:
         cur = conn.cursor()
         
-        # Получаем уникальные пары (parent_category, category) из БД
+        # Пары (родительская категория, подкатегория) в порядке умной сортировки подкатегорий
         cur.execute("""
-            SELECT DISTINCT parent_category, category
-            FROM products
+            SELECT parent, subcategory
+            FROM category_tree
             WHERE source=?
-            ORDER BY parent_category, category
+            ORDER BY parent, sort_key, subcategory
         """, (source,))
         rows = cur.fetchall()
         
         parent_mapping = {}
         
         for row in rows:
-            parent_from_db = row[0]
+            parent = row[0]
             category = row[1]
             
-            # Если parent_category заполнен, используем его
-            if parent_from_db:
-                parent = parent_from_db
-            else:
-                # Fallback: определяем родительскую категорию по названию (старая логика)
-                if 'iPhone' in category or 'iPad' in category or 'MacBook' in category or 'Apple' in category or 'AirPods' in category:
-                    parent = 'Apple'
-                elif 'Samsung' in category:
-                    parent = 'Samsung'
-                elif 'Google' in category or 'Pixel' in category:
-                    parent = 'Google Pixel'
-                elif 'Xiaomi' in category:
-                    parent = 'Xiaomi'
-                elif 'Redmi' in category:
-                    parent = 'Redmi'
-                elif 'POCO' in category:
-                    parent = 'POCO'
-                elif 'Honor' in category:
-                    parent = 'Honor'
-                elif 'Huawei' in category:
-                    parent = 'Huawei'
-                elif 'Vivo' in category:
-                    parent = 'Vivo'
-                elif 'Realme' in category:
-                    parent = 'Realme'
-                elif 'Yandex' in category:
-                    parent = 'Yandex'
-                elif 'Meta' in category:
-                    parent = 'Meta Quest'
-                elif 'Nintendo' in category:
-                    parent = 'Nintendo'
-                elif 'Valve' in category:
-                    parent = 'Valve'
-                elif 'Sony' in category:
-                    parent = 'Sony'
-                elif 'GoPro' in category:
-                    parent = 'GoPro'
-                elif 'Insta360' in category:
-                    parent = 'Insta360'
-                elif 'Garmin' in category:
-                    parent = 'Garmin'
-                elif 'Dyson' in category:
-                    parent = 'Dyson'
-                else:
-                    parent = 'Аксессуары'
-            
             if parent not in parent_mapping:
                 parent_mapping[parent] = []
             
@@ -350,10 +134,6 @@ def get_dynamic_parent_to_subcategories(source='standard'):
                 if category not in parent_mapping[parent]:
                     parent_mapping[parent].append(category)
         
-        # Сортируем подкатегории в каждой родительской категории
-        for parent in parent_mapping:
-            parent_mapping[parent] = sort_categories_smart(parent_mapping[parent])
-        
         return parent_mapping
 
 def get_product_by_id(product_id):
@@ -361,7 +141,7 @@ def get_product_by_id(product_id):
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("""
-            SELECT id, name, memory, color, country, price, category
+            SELECT id, name, memory, color, country, price, category, parent_category
             FROM products
             WHERE id=?
         """, (product_id,))
@@ -375,6 +155,7 @@ def get_product_by_id(product_id):
                 "country": row[4],
                 "price": row[5],
                 "category": row[6],
+                "parent_category": row[7],
             }
         return None
 
@@ -393,15 +174,15 @@ def add_to_cart(user_id, product_id, quantity=1):
             # Увеличиваем количество
             new_quantity = existing[1] + quantity
             cur.execute("""
-                UPDATE cart SET quantity=?
+                UPDATE cart SET quantity=?, updated_at=CURRENT_TIMESTAMP
                 WHERE id=?
             """, (new_quantity, existing[0]))
         else:
             # Добавляем новый товар
             cur.execute("""
-                INSERT INTO cart (user_id, product_id, quantity)
-                VALUES (?, ?, ?)
-            """, (user_id, product_id, quantity))
+                INSERT INTO cart (user_id, product_id, quantity, product_key, updated_at)
+                VALUES (?, ?, ?, (SELECT product_key FROM products WHERE id = ?), CURRENT_TIMESTAMP)
+            """, (user_id, product_id, quantity, product_id))
         conn.commit()
         return True
 
@@ -410,7 +191,7 @@ def get_cart(user_id):
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("""
-            SELECT c.id, c.product_id, c.quantity, p.name, p.memory, p.color, p.country, p.price
+            SELECT c.id, c.product_id, c.quantity, p.name, p.memory, p.color, p.country, p.price, p.parent_category, p.category
             FROM cart c
             JOIN products p ON c.product_id = p.id
             WHERE c.user_id=?
@@ -427,6 +208,8 @@ def get_cart(user_id):
                 "color": row[5],
                 "country": row[6],
                 "price": row[7],
+                "parent_category": row[8],
+                "category": row[9],
             } for row in rows
         ]
 
@@ -438,7 +221,7 @@ def update_cart_quantity(user_id, cart_id, quantity):
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("""
-            UPDATE cart SET quantity=?
+            UPDATE cart SET quantity=?, updated_at=CURRENT_TIMESTAMP
             WHERE id=? AND user_id=?
         """, (quantity, cart_id, user_id))
         conn.commit()
@@ -474,7 +257,7 @@ def create_order(user_id, user_username, user_first_name, user_last_name):
         
         # Получаем товары из обычной корзины
         cur.execute("""
-            SELECT c.id, c.product_id, c.quantity, p.name, p.memory, p.color, p.country, p.price
+            SELECT c.id, c.product_id, c.quantity, p.name, p.memory, p.color, p.country, p.price, p.parent_category, p.category
             FROM cart c
             JOIN products p ON c.product_id = p.id
             WHERE c.user_id=?
@@ -492,12 +275,14 @@ def create_order(user_id, user_username, user_first_name, user_last_name):
                 "color": row[5],
                 "country": row[6],
                 "price": row[7],
+                "parent_category": row[8],
+                "category": row[9],
                 "is_preorder": False
             })
         
         # Получаем товары из корзины предзаказа
         cur.execute("""
-            SELECT c.id, c.product_id, c.quantity, p.name, p.memory, p.color, p.country, p.price
+            SELECT c.id, c.product_id, c.quantity, p.name, p.memory, p.color, p.country, p.price, p.parent_category, p.category
             FROM preorder_cart c
             JOIN preorder_products p ON c.product_id = p.id
             WHERE c.user_id=?
@@ -515,16 +300,24 @@ def create_order(user_id, user_username, user_first_name, user_last_name):
                 "color": row[5],
                 "country": row[6],
                 "price": row[7],
+                "parent_category": row[8],
+                "category": row[9],
                 "is_preorder": True
             })
         
         if not all_items:
             return None
         
+        # Цены позиций с учетом наценки покупателя (обычные товары и предзаказ - по одному проходу)
+        prices = {
+            is_preorder: iter(price_listing([item for item in all_items if item['is_preorder'] == is_preorder], user_id, is_preorder))
+            for is_preorder in (False, True)
+        }
+        final_prices = [next(prices[item['is_preorder']]) for item in all_items]
+        
         # Вычисляем общую стоимость с учетом персонального процента пользователя
         total_price = 0
-        for item in all_items:
-            final_price = calculate_price_with_markup(item['price'], user_id, is_preorder=item['is_preorder'])
+        for item, final_price in zip(all_items, final_prices):
             total_price += final_price * item['quantity']
         
         # Создаем заказ
@@ -535,8 +328,8 @@ def create_order(user_id, user_username, user_first_name, user_last_name):
         order_id = cur.lastrowid
         
         # Добавляем позиции заказа с учетом персонального процента
-        for item in all_items:
-            final_price = calculate_price_with_markup(item['price'], user_id, is_preorder=item['is_preorder'])
+        order_items = []
+        for item, final_price in zip(all_items, final_prices):
             # Формируем название товара с флагом страны (как в корзине)
             country_with_flag = get_country_with_flag(item['country'])
             product_name = f"{item['name']}, {country_with_flag}"
@@ -547,6 +340,10 @@ def create_order(user_id, user_username, user_first_name, user_last_name):
                 INSERT INTO order_items (order_id, product_id, product_name, quantity, price)
                 VALUES (?, ?, ?, ?, ?)
             """, (order_id, item['product_id'], product_name, item['quantity'], final_price))
+            order_items.append((product_name, item['category'], item['quantity'], final_price))
+        
+        # Продажи по дням для статистики админа (в той же транзакции)
+        record_order_sales(cur, order_id, total_price, order_items)
         
         # Очищаем обе корзины в том же соединении
         cur.execute("""
@@ -634,7 +431,7 @@ def get_preorder_products_by_category(category):
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("""
-            SELECT id, name, memory, color, country, price
+            SELECT id, name, memory, color, country, price, parent_category, category
             FROM preorder_products
             WHERE category=?
             ORDER BY price
@@ -648,6 +445,8 @@ def get_preorder_products_by_category(category):
                 "color": row[3],
                 "country": row[4],
                 "price": row[5],
+                "parent_category": row[6],
+                "category": row[7],
             } for row in rows
         ]
 
@@ -659,33 +458,26 @@ def get_preorder_available_subcategories(parent_category, possible_subcats):
     with get_db() as conn:
         cur = conn.cursor()
         # Получаем уникальные категории из БД предзаказа, которые есть в списке возможных подкатегорий
+        where, params = services_category.sources_clause((services_category.PREORDER_SOURCE,))
         placeholders = ','.join(['?'] * len(possible_subcats))
         cur.execute(f"""
-            SELECT DISTINCT category
-            FROM preorder_products
-            WHERE category IN ({placeholders})
-        """, possible_subcats)
+            SELECT DISTINCT subcategory
+            FROM category_tree
+            WHERE {where} AND subcategory IN ({placeholders})
+        """, params + tuple(possible_subcats))
         rows = cur.fetchall()
         return [row[0] for row in rows]
 
 def get_preorder_categories():
     """Получает список всех уникальных категорий из предзаказа"""
-    with get_db() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT DISTINCT category
-            FROM preorder_products
-            ORDER BY category
-        """)
-        rows = cur.fetchall()
-        return [row[0] for row in rows]
+    return services_category.get_preorder_categories()
 
 def get_preorder_product_by_id(product_id):
     """Получает товар предзаказа по ID"""
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("""
-            SELECT id, name, memory, color, country, price, category
+            SELECT id, name, memory, color, country, price, category, parent_category
             FROM preorder_products
             WHERE id=?
         """, (product_id,))
@@ -699,6 +491,7 @@ def get_preorder_product_by_id(product_id):
                 "country": row[4],
                 "price": row[5],
                 "category": row[6],
+                "parent_category": row[7],
             }
         return None
 
@@ -717,15 +510,15 @@ def add_to_preorder_cart(user_id, product_id, quantity=1):
             # Увеличиваем количество
             new_quantity = existing[1] + quantity
             cur.execute("""
-                UPDATE preorder_cart SET quantity=?
+                UPDATE preorder_cart SET quantity=?, updated_at=CURRENT_TIMESTAMP
                 WHERE id=?
             """, (new_quantity, existing[0]))
         else:
             # Добавляем новый товар
             cur.execute("""
-                INSERT INTO preorder_cart (user_id, product_id, quantity)
-                VALUES (?, ?, ?)
-            """, (user_id, product_id, quantity))
+                INSERT INTO preorder_cart (user_id, product_id, quantity, product_key, updated_at)
+                VALUES (?, ?, ?, (SELECT product_key FROM preorder_products WHERE id = ?), CURRENT_TIMESTAMP)
+            """, (user_id, product_id, quantity, product_id))
         conn.commit()
         return True
 
@@ -734,7 +527,7 @@ def get_preorder_cart(user_id):
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("""
-            SELECT c.id, c.product_id, c.quantity, p.name, p.memory, p.color, p.country, p.price
+            SELECT c.id, c.product_id, c.quantity, p.name, p.memory, p.color, p.country, p.price, p.parent_category, p.category
             FROM preorder_cart c
             JOIN preorder_products p ON c.product_id = p.id
             WHERE c.user_id=?
@@ -751,6 +544,8 @@ def get_preorder_cart(user_id):
                 "color": row[5],
                 "country": row[6],
                 "price": row[7],
+                "parent_category": row[8],
+                "category": row[9],
             } for row in rows
         ]
 
@@ -762,7 +557,7 @@ def update_preorder_cart_quantity(user_id, cart_id, quantity):
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("""
-            UPDATE preorder_cart SET quantity=?
+            UPDATE preorder_cart SET quantity=?, updated_at=CURRENT_TIMESTAMP
             WHERE id=? AND user_id=?
         """, (quantity, cart_id, user_id))
         conn.commit()
@@ -805,14 +600,19 @@ def clear_all_products():
         # Удаляем все товары
         cur.execute("DELETE FROM products")
         cur.execute("DELETE FROM preorder_products")
+        cur.execute("DELETE FROM category_tree")
+        refresh_catalog_stats(cur)
         
         # Также очищаем корзины, так как товары больше не существуют
         cur.execute("DELETE FROM cart")
         cur.execute("DELETE FROM preorder_cart")
         
-        conn.commit()
+        # Сбрасываем кеши навигации и клавиатур во всех процессах
+        services_category.bump_catalog_version(cur)
         
-        return {
-            "products_deleted": products_count,
-            "preorder_products_deleted": preorder_products_count
-        }
+        conn.commit()
+    
+    return {
+        "products_deleted": products_count,
+        "preorder_products_deleted": preorder_products_count
+    }
@@ -1,17 +1,130 @@
+import os
+import re
 import sqlite3
-from config import DATABASE_PATH
+import threading
+import time
+from functools import lru_cache
+from config import DATABASE_PATH, METRICS_ENABLED, SQL_TRACE
 
 CATEGORIES = [
     "iPhone 13", "iPhone 14", "iPhone 15", "iPhone 16", "iPhone 17",
     "Samsung", "Xiaomi", "Аксессуары"
 ]
 
+# Поиск основной таблицы запроса для меток метрик
+_STATEMENT_TABLE_RE = re.compile(
+    r'\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+NOT\s+EXISTS)?|ON)\s+["\[]?(\w+)',
+    re.IGNORECASE
+)
+
+@lru_cache(maxsize=1024)
+def _statement_labels(sql):
+    """Метки для SQL-запроса: тип операции и основная таблица"""
+    words = sql.split(None, 1)
+    operation = words[0].upper() if words else ""
+    match = _STATEMENT_TABLE_RE.search(sql)
+    return {"operation": operation, "table": match.group(1) if match else ""}
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий время выполнения каждого запроса"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_statement(self.connection, sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_statement(self.connection, sql, None, time.perf_counter() - started)
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, создающее курсоры с замером времени запросов"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute создает курсор в C и не вызывает cursor(): без этих
+    # методов запросы через conn.execute (ANALYZE, VACUUM, обслуживание базы) не замерялись
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def _record_statement(connection, sql, parameters, elapsed):
+    """Записывает время выполнения запроса в метрики и трассировку"""
+    if METRICS_ENABLED:
+        from services.metrics import observe
+        observe('db_statement_seconds', elapsed, _statement_labels(sql))
+    if SQL_TRACE:
+        from db import tracing
+        tracing.record(connection, sql, parameters, elapsed)
+
 def get_db():
+    if SQL_TRACE:
+        from db import tracing
+        conn = sqlite3.connect(DATABASE_PATH, factory=TimedConnection)
+        conn.set_trace_callback(tracing.on_statement)
+        return conn
+    if METRICS_ENABLED:
+        return sqlite3.connect(DATABASE_PATH, factory=TimedConnection)
     return sqlite3.connect(DATABASE_PATH)
 
+# Версии данных в таблице meta: увеличиваются в транзакции, изменяющей данные,
+# и видны всем процессам бота, работающим с той же базой (для сброса кешей)
+CATALOG_VERSION = 'catalog_version'
+SETTINGS_VERSION = 'settings_version'
+
+_version_lock = threading.Lock()
+_version_conn = None
+_data_version = None
+_versions = {}
+
+def bump_version(cur, key):
+    """Увеличивает версию данных key; вызывается в транзакции изменения данных (до commit)"""
+    cur.execute("""
+        INSERT INTO meta (key, value) VALUES (?, 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1
+    """, (key,))
+
+def get_version(key):
+    """
+    Текущая версия данных key (0, если данные не менялись).
+    PRAGMA data_version долгоживущего соединения меняется только после commit
+    в другом соединении (в том числе в другом процессе), поэтому таблица meta
+    перечитывается лишь после реальных изменений базы, а в остальных случаях
+    проверка версии не читает таблиц.
+    """
+    global _version_conn, _data_version, _versions
+    with _version_lock:
+        if _version_conn is None:
+            _version_conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+        data_version = _version_conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != _data_version:
+            _versions = dict(_version_conn.execute("SELECT key, value FROM meta").fetchall())
+            _data_version = data_version
+        return _versions.get(key, 0)
+
+def _reset_version_connection():
+    """Соединение SQLite нельзя использовать после fork: дочерний процесс откроет свое"""
+    global _version_lock, _version_conn, _data_version
+    _version_lock = threading.Lock()
+    _version_conn = None
+    _data_version = None
+
+os.register_at_fork(after_in_child=_reset_version_connection)
+
 def init_db():
     with get_db() as conn:
         cur = conn.cursor()
+        # Новая база создается с auto_vacuum = INCREMENTAL (свободные страницы возвращаются
+        # шагами, см. services/maintenance.py); для существующей базы PRAGMA ничего не меняет
+        cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
         cur.execute('''
             CREATE TABLE IF NOT EXISTS products (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -39,6 +152,20 @@ def init_db():
             # Колонка уже существует, игнорируем ошибку
             pass
         
+        # Миграция: добавляем колонку product_key (ключ товара для истории цен), если её нет
+        try:
+            cur.execute("ALTER TABLE products ADD COLUMN product_key TEXT")
+        except sqlite3.OperationalError:
+            # Колонка уже существует, игнорируем ошибку
+            pass
+        
+        # Миграция: добавляем колонку sort_key (ключ сортировки категории, services/ordering), если её нет
+        try:
+            cur.execute("ALTER TABLE products ADD COLUMN sort_key TEXT")
+        except sqlite3.OperationalError:
+            # Колонка уже существует, игнорируем ошибку
+            pass
+        
         # Обновляем существующие записи без source на 'standard'
         cur.execute("UPDATE products SET source = 'standard' WHERE source IS NULL")
         
@@ -49,6 +176,13 @@ def init_db():
                 value TEXT
             )
         ''')
+        # Версии данных для сброса кешей во всех процессах (см. bump_version / get_version)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
         # Устанавливаем дефолтную наценку, если её нет
         from config import DEFAULT_MARKUP_AMOUNT, DEFAULT_PREORDER_MARKUP_AMOUNT
         cur.execute('''
@@ -98,6 +232,10 @@ def init_db():
             )
         ''')
         
+        # Индексы для выгрузки заказов за период и позиций заказа
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)")
+        
         # Таблица персональных наценок пользователей
         # Миграция: проверяем, существует ли старая таблица с markup_percent
         cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_markups'")
@@ -150,6 +288,45 @@ def init_db():
         # Миграция settings: удаляем старый ключ markup_percent, если он существует
         cur.execute("DELETE FROM settings WHERE key = 'markup_percent'")
         
+        # Группы покупателей (розница, дилеры, VIP) с общей суммой наценки и состав групп.
+        # Персональная наценка (user_markups) важнее наценки группы
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS customer_groups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                markup_amount REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS customer_group_members (
+                user_id INTEGER PRIMARY KEY,
+                group_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_customer_group_members_group
+            ON customer_group_members (group_id)
+        ''')
+        
+        # Правила наценки по родительской категории, подкатегории и диапазону цены
+        # NULL в parent_category/category - любая категория, в min_price/max_price - без ограничения
+        # (min_price включительно, max_price не включительно)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS pricing_rules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                is_preorder INTEGER NOT NULL DEFAULT 0,
+                parent_category TEXT,
+                category TEXT,
+                min_price INTEGER,
+                max_price INTEGER,
+                markup_amount REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
         # Таблица товаров предзаказа (отдельная от основного прайса)
         cur.execute('''
             CREATE TABLE IF NOT EXISTS preorder_products (
@@ -171,6 +348,63 @@ def init_db():
             # Колонка уже существует, игнорируем ошибку
             pass
         
+        # Миграция: добавляем колонку product_key в preorder_products, если её нет
+        try:
+            cur.execute("ALTER TABLE preorder_products ADD COLUMN product_key TEXT")
+        except sqlite3.OperationalError:
+            # Колонка уже существует, игнорируем ошибку
+            pass
+        
+        # Индексы по ключу товара (сравнение с предыдущими ценами при загрузке прайса)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_products_source_key ON products (source, product_key)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_preorder_products_key ON preorder_products (product_key)")
+        
+        # Индекс для списка товаров категории сразу из нескольких прайсов (category = ? AND source IN (...))
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products (category, source, price)")
+        
+        # Индекс для списков подкатегорий: порядок моделей берется из индекса (ORDER BY sort_key)
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_products_source_sort
+            ON products (source, parent_category, sort_key, category)
+        ''')
+        
+        # Заполняем ключи сортировки товаров, загруженных до появления колонки или со старыми правилами
+        from services.ordering import update_sort_keys
+        update_sort_keys(cur)
+        
+        # Заполняем родительские категории (бренды) товаров, загруженных без них
+        from services.brands import fill_parent_categories
+        fill_parent_categories(cur)
+        
+        # Дерево категорий (родитель -> подкатегория) каждого прайса для навигации в боте.
+        # Пересчитывается при каждой загрузке прайса в той же транзакции
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS category_tree (
+                parent TEXT NOT NULL,
+                subcategory TEXT NOT NULL,
+                source TEXT NOT NULL,
+                product_count INTEGER NOT NULL,
+                min_price INTEGER,
+                sort_key TEXT NOT NULL,
+                PRIMARY KEY (source, parent, subcategory)
+            )
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_category_tree_sort
+            ON category_tree (source, parent, sort_key, subcategory)
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_category_tree_subcategory
+            ON category_tree (source, subcategory)
+        ''')
+        
+        # Пересчитываем деревья (товары могли быть загружены до появления таблицы
+        # или получить ключи сортировки и родительские категории выше)
+        from services.category import rebuild_all_category_trees
+        rebuild_all_category_trees(cur)
+        # Деревья и ключи сортировки могли измениться - кеши других процессов пересобираются
+        bump_version(cur, CATALOG_VERSION)
+        
         # Таблица корзины предзаказа (отдельная от основной корзины)
         cur.execute('''
             CREATE TABLE IF NOT EXISTS preorder_cart (
@@ -182,4 +416,128 @@ def init_db():
             )
         ''')
         
+        # Миграция: ключ товара в корзинах (после загрузки прайса позиция переносится
+        # на тот же товар нового прайса, см. services/maintenance.py)
+        for cart_table, products_table in (('cart', 'products'), ('preorder_cart', 'preorder_products')):
+            try:
+                cur.execute(f"ALTER TABLE {cart_table} ADD COLUMN product_key TEXT")
+            except sqlite3.OperationalError:
+                # Колонка уже существует, игнорируем ошибку
+                pass
+            cur.execute(f'''
+                UPDATE {cart_table}
+                SET product_key = (SELECT p.product_key FROM {products_table} p WHERE p.id = {cart_table}.product_id)
+                WHERE product_key IS NULL
+            ''')
+            # Миграция: время последнего изменения позиции (срок хранения считается от него,
+            # created_at остается временем добавления и задает порядок позиций в корзине)
+            try:
+                cur.execute(f"ALTER TABLE {cart_table} ADD COLUMN updated_at TIMESTAMP")
+            except sqlite3.OperationalError:
+                # Колонка уже существует, игнорируем ошибку
+                pass
+            cur.execute(f"UPDATE {cart_table} SET updated_at = created_at WHERE updated_at IS NULL")
+            # Индексы для удаления позиций по сроку и поиска позиции товара в корзине пользователя
+            cur.execute(f"DROP INDEX IF EXISTS idx_{cart_table}_created")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{cart_table}_updated ON {cart_table} (updated_at)")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{cart_table}_user ON {cart_table} (user_id, product_id)")
+        
+        # История цен: одна строка на изменение цены товара (append-only)
+        # price = NULL означает, что товар пропал из прайса
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS price_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_key TEXT NOT NULL,
+                source TEXT NOT NULL,
+                effective_from TIMESTAMP NOT NULL,
+                price INTEGER,
+                prev_price INTEGER
+            )
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_price_history_key
+            ON price_history (source, product_key, effective_from)
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_price_history_time
+            ON price_history (source, effective_from)
+        ''')
+        
+        # Последняя известная цена каждого товара (для сравнения при следующей загрузке)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS price_current (
+                source TEXT NOT NULL,
+                product_key TEXT NOT NULL,
+                price INTEGER NOT NULL,
+                PRIMARY KEY (source, product_key)
+            )
+        ''')
+        
+        # Журнал загрузок прайса
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS price_uploads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                uploaded_at TIMESTAMP NOT NULL,
+                products_count INTEGER,
+                changes_count INTEGER
+            )
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_price_uploads_source
+            ON price_uploads (source, uploaded_at)
+        ''')
+        
+        # Пересчитываем ключи товаров, сохраненные в старом формате
+        from services.history import update_product_keys
+        update_product_keys(cur)
+        
+        # Сводная статистика каталога для админа (пересчитывается при загрузке прайса)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_stats (
+                scope TEXT PRIMARY KEY,
+                product_count INTEGER NOT NULL,
+                category_count INTEGER NOT NULL,
+                updated_at TIMESTAMP
+            )
+        ''')
+        
+        # Продажи по дням: всего и по товарам (обновляются при оформлении заказа)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sales_daily (
+                day TEXT PRIMARY KEY,
+                orders_count INTEGER NOT NULL,
+                items_count INTEGER NOT NULL,
+                revenue INTEGER NOT NULL
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sales_daily_products (
+                day TEXT NOT NULL,
+                product_name TEXT NOT NULL,
+                category TEXT,
+                quantity INTEGER NOT NULL,
+                revenue INTEGER NOT NULL,
+                PRIMARY KEY (day, product_name)
+            )
+        ''')
+        
+        # Последний запуск каждой задачи фонового обслуживания базы (services/maintenance.py)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS maintenance_runs (
+                task TEXT PRIMARY KEY,
+                started_at TIMESTAMP NOT NULL,
+                duration REAL,
+                result TEXT,
+                error TEXT
+            )
+        ''')
+        
+        from services.stats import rebuild_sales_daily, refresh_catalog_stats
+        refresh_catalog_stats(cur)
+        # Заказы, оформленные до появления таблиц продаж
+        cur.execute("SELECT EXISTS (SELECT 1 FROM orders) AND NOT EXISTS (SELECT 1 FROM sales_daily)")
+        if cur.fetchone()[0]:
+            rebuild_sales_daily(cur)
+        
         conn.commit()
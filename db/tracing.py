@@ -0,0 +1,153 @@
+import contextvars
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from config import SQL_SLOW_MS, SQL_REQUEST_QUERY_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# Файлы, которые не считаются местом вызова запроса (обертки соединения и сам трассировщик)
+_INTERNAL_FILES = (
+    os.path.join('db', 'models.py'),
+    os.path.join('db', 'tracing.py'),
+)
+
+_lock = threading.Lock()
+_local = threading.local()
+
+# Статистика по запросам за все время работы
+# Формат: {(sql, call_site): [count, total_seconds, max_seconds]}
+_statement_stats = {}
+
+# Статистика текущего запроса пользователя (update) - для поиска N+1
+_request_stats = contextvars.ContextVar('sql_request_stats', default=None)
+
+def on_statement(expanded_sql):
+    """
+    Callback для sqlite3.set_trace_callback.
+    Вызывается SQLite для каждого выполняемого выражения (в том числе BEGIN/COMMIT)
+    с подставленными значениями параметров.
+    """
+    _local.last_expanded_sql = expanded_sql
+    stats = _request_stats.get()
+    if stats is not None:
+        stats['sqlite_statements'] += 1
+
+def _call_site():
+    """Находит первый кадр стека вне слоя работы с БД: 'db/crud.py:123 get_cart'"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.endswith(_INTERNAL_FILES) and 'sqlite3' not in filename:
+            return f"{os.path.relpath(filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+def _normalize_sql(sql):
+    """Схлопывает пробелы в SQL для компактного отображения и группировки"""
+    return ' '.join(sql.split())
+
+def _explain(connection, sql, parameters):
+    """Получает EXPLAIN QUERY PLAN для запроса (без трассировки самого EXPLAIN)"""
+    if parameters is None:
+        return None
+    keyword = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    if keyword not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE'):
+        return None
+    _local.explaining = True
+    try:
+        cur = connection.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+        return [row[3] for row in cur.fetchall()]
+    except Exception as e:
+        return [f"EXPLAIN недоступен: {e}"]
+    finally:
+        _local.explaining = False
+
+def record(connection, sql, parameters, elapsed):
+    """
+    Записывает выполненный запрос: время, место вызова, счетчик текущего update.
+    Медленные запросы (дольше SQL_SLOW_MS) пишутся в лог вместе с EXPLAIN QUERY PLAN.
+    parameters = None для executemany (план в этом случае не строится).
+    """
+    if getattr(_local, 'explaining', False):
+        return
+
+    normalized = _normalize_sql(sql)
+    call_site = _call_site()
+    key = (normalized, call_site)
+    with _lock:
+        stats = _statement_stats.get(key)
+        if stats is None:
+            stats = [0, 0.0, 0.0]
+            _statement_stats[key] = stats
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+    request_stats = _request_stats.get()
+    if request_stats is not None:
+        request_stats['statements'] += 1
+        request_stats['seconds'] += elapsed
+        request_stats['by_statement'][key] += 1
+
+    if elapsed * 1000 >= SQL_SLOW_MS:
+        plan = _explain(connection, sql, parameters)
+        expanded = getattr(_local, 'last_expanded_sql', None) or normalized
+        message = f"Медленный SQL-запрос {elapsed * 1000:.1f} мс ({call_site}): {_normalize_sql(expanded)}"
+        if plan:
+            message += "\n  QUERY PLAN:\n" + '\n'.join(f"    {line}" for line in plan)
+        logger.warning(message)
+
+def begin_request(label):
+    """Начинает подсчет запросов для обработки одного update"""
+    return _request_stats.set({
+        'label': label,
+        'statements': 0,
+        'sqlite_statements': 0,
+        'seconds': 0.0,
+        'by_statement': Counter(),
+    })
+
+def end_request(token):
+    """
+    Завершает подсчет запросов для update и возвращает статистику.
+    Если запросов больше SQL_REQUEST_QUERY_LIMIT, в лог пишутся самые частые из них (признак N+1).
+    """
+    stats = _request_stats.get()
+    _request_stats.reset(token)
+    if stats is None:
+        return None
+
+    if stats['statements'] >= SQL_REQUEST_QUERY_LIMIT:
+        lines = [
+            f"{count}× {call_site}: {sql[:150]}"
+            for (sql, call_site), count in stats['by_statement'].most_common(5)
+        ]
+        logger.warning(
+            f"Много SQL-запросов в одном update ({stats['label']}): {stats['statements']} запросов, "
+            f"{stats['seconds'] * 1000:.1f} мс\n  " + '\n  '.join(lines)
+        )
+    return stats
+
+def get_report(top=20):
+    """Самые затратные запросы за все время: список словарей, отсортированный по суммарному времени"""
+    with _lock:
+        items = [(key, list(stats)) for key, stats in _statement_stats.items()]
+
+    items.sort(key=lambda item: item[1][1], reverse=True)
+    return [
+        {
+            "sql": sql,
+            "call_site": call_site,
+            "count": count,
+            "total": total,
+            "max": max_seconds,
+        } for (sql, call_site), (count, total, max_seconds) in items[:top]
+    ]
+
+def reset():
+    """Сбрасывает накопленную статистику"""
+    with _lock:
+        _statement_stats.clear()
@@ -1,5 +1,10 @@
 import json
 from db.models import get_db, init_db
+from services.brands import parent_for_category
+from services.ordering import sort_key_value
+from services.category import bump_catalog_version, rebuild_category_tree
+from services.history import make_product_key, record_price_changes
+from services.stats import refresh_catalog_stats
 
 def setup_db():
     init_db()
@@ -12,14 +17,22 @@ def import_products_from_json(path):
         cur = conn.cursor()
         for prod in items:
             cur.execute(
-                "INSERT INTO products (category, name, memory, color, country, price) VALUES (?, ?, ?, ?, ?, ?)",
+                "INSERT INTO products (parent_category, category, name, memory, color, country, price, product_key, sort_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
                 (
+                    parent_for_category(prod["category"]),
                     prod["category"],
                     prod["name"],
                     prod["memory"],
                     prod["color"],
                     prod["country"],
-                    prod["price"]
+                    prod["price"],
+                    make_product_key(prod["category"], prod["name"], prod["memory"], prod["color"], prod["country"]),
+                    sort_key_value(prod["category"])
                 )
             )
+        # История цен в той же транзакции, что и загрузка товаров (как в store_products)
+        record_price_changes(cur, 'standard')
+        rebuild_category_tree(cur, 'standard')
+        refresh_catalog_stats(cur)
+        bump_catalog_version(cur)
         conn.commit()
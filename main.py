@@ -1,12 +1,10 @@
 import asyncio
 from aiogram import Bot, Dispatcher
-from config import BOT_TOKEN
+from config import BOT_TOKEN, METRICS_ENABLED, METRICS_HOST, METRICS_PORT, SQL_TRACE, WEBHOOK_WORKERS
 from bot.handlers import user, admin
 from db.utils import setup_db
 
-async def main():
-    setup_db()
-    bot = Bot(token=BOT_TOKEN)
+def create_dispatcher():
     dp = Dispatcher()
 
     # Регистрируем user.router первым, чтобы обработчики с StateFilter имели приоритет
@@ -14,7 +12,50 @@ async def main():
     dp.include_router(user.router)
     dp.include_router(admin.router)
 
-    await dp.start_polling(bot)
+    if METRICS_ENABLED:
+        from bot.middlewares.metrics import setup_metrics_middlewares
+        setup_metrics_middlewares(dp, [user.router, admin.router])
+
+    if SQL_TRACE:
+        from bot.middlewares.tracing import SqlTraceMiddleware
+        dp.update.outer_middleware(SqlTraceMiddleware())
+
+    return dp
+
+def create_bot():
+    bot = Bot(token=BOT_TOKEN)
+
+    if METRICS_ENABLED:
+        from bot.middlewares.metrics import TelegramRequestMiddleware
+        bot.session.middleware(TelegramRequestMiddleware())
+
+    return bot
+
+async def main():
+    setup_db()
+    bot = create_bot()
+    dp = create_dispatcher()
+
+    if METRICS_ENABLED and METRICS_PORT:
+        from services.metrics import start_metrics_server
+        await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+    # Фоновое обслуживание базы (корзины, ANALYZE, резервные копии, vacuum) в том же event loop
+    from services.maintenance import run_maintenance
+    maintenance = asyncio.create_task(run_maintenance(bot))
+    try:
+        await dp.start_polling(bot)
+    finally:
+        maintenance.cancel()
+
+def main_webhook():
+    # База создается и мигрируется один раз, до запуска процессов-обработчиков
+    setup_db()
+    from bot.webhook import run_supervisor
+    run_supervisor(WEBHOOK_WORKERS, create_bot, create_dispatcher)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if WEBHOOK_WORKERS > 0:
+        main_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,108 @@
+import re
+from functools import lru_cache
+
+# Таблица брендов (порядок - приоритет при совпадении нескольких брендов):
+# (родительская категория, заголовок бренда в простом прайсе, ключевые слова в названии категории).
+# Бренд без ключевых слов распознается только по заголовку простого прайса.
+BRANDS = [
+    ('Apple', 'APPLE', ['iPhone', 'iPad', 'MacBook', 'Apple', 'AirPods']),
+    ('Samsung', 'SAMSUNG', ['Samsung']),
+    ('Google Pixel', 'GOOGLE', ['Google', 'Pixel']),
+    ('Xiaomi', 'XIAOMI', ['Xiaomi']),
+    ('Redmi', 'REDMI', ['Redmi']),
+    ('POCO', 'POCO', ['POCO']),
+    ('Honor', 'HONOR', ['Honor']),
+    ('Huawei', 'HUAWEI', ['Huawei']),
+    ('Vivo', 'VIVO', ['Vivo']),
+    ('Realme', 'REALME', ['Realme']),
+    ('Yandex', 'YANDEX', ['Yandex']),
+    ('Meta Quest', 'META', ['Meta']),
+    ('Nintendo', 'NINTENDO', ['Nintendo']),
+    ('Valve', 'VALVE', ['Valve']),
+    ('Sony', 'SONY', ['Sony']),
+    ('GoPro', 'GOPRO', ['GoPro']),
+    ('Insta360', 'INSTA360', ['Insta360']),
+    ('Garmin', 'GARMIN', ['Garmin']),
+    ('Dyson', 'DYSON', ['Dyson']),
+    ('Nothing', 'NOTHING', []),
+]
+
+# Родительская категория для товаров без известного бренда
+DEFAULT_PARENT = 'Аксессуары'
+
+# Заголовки брендов в простом прайсе (APPLE, SAMSUNG...) и их нормализованные названия
+BRAND_HEADERS = {header: parent for parent, header, _ in BRANDS}
+
+def _compile(alternatives):
+    """
+    Одно регулярное выражение на всю таблицу: i-я альтернатива - группа b{i}.
+    Альтернативы проверяются в порядке таблицы (приоритет), а не по позиции в строке.
+    Пустые альтернативы пропускаются.
+    """
+    return re.compile('(?:' + '|'.join(
+        rf'.*?(?P<b{i}>{"|".join(re.escape(word) for word in words)})'
+        for i, words in enumerate(alternatives) if words
+    ) + ')')
+
+_KEYWORDS_PATTERN = _compile([keywords for _, _, keywords in BRANDS])
+_HEADERS_PATTERN = _compile([[header] for _, header, _ in BRANDS])
+
+def _match_brand(pattern, text):
+    """Номер бренда в таблице, найденного в text, или None"""
+    match = pattern.match(text)
+    if not match:
+        return None
+    return int(match.lastgroup[1:])
+
+@lru_cache(maxsize=8192)
+def parent_for_category(category):
+    """Родительская категория (бренд) по названию категории товара, например 'iPhone 16 Pro' -> 'Apple'"""
+    if not category:
+        return DEFAULT_PARENT
+    index = _match_brand(_KEYWORDS_PATTERN, category)
+    return BRANDS[index][0] if index is not None else DEFAULT_PARENT
+
+def find_brand_header(text_upper):
+    """Заголовок бренда (APPLE, SAMSUNG...), входящий в строку в верхнем регистре, или None"""
+    index = _match_brand(_HEADERS_PATTERN, text_upper)
+    return BRANDS[index][1] if index is not None else None
+
+def normalize_brand_header(category_name):
+    """
+    Нормализует заголовок категории из простого прайса: 'GOOGLE' -> 'Google Pixel',
+    'APPLE IPHONE 16' -> 'Apple Iphone 16', неизвестные бренды - с заглавной буквы.
+    """
+    if not category_name:
+        return category_name
+
+    category_upper = category_name.upper()
+
+    # Точное совпадение с заголовком бренда
+    if category_upper in BRAND_HEADERS:
+        return BRAND_HEADERS[category_upper]
+
+    # Частичное совпадение: заменяем бренд на нормализованный вариант
+    header = find_brand_header(category_upper)
+    if header:
+        return category_upper.replace(header, BRAND_HEADERS[header]).title()
+
+    return category_name.strip().title()
+
+def fill_parent_categories(cur):
+    """
+    Заполняет parent_category товаров, загруженных без родительской категории
+    (до классификации при загрузке прайса). Вызывается из init_db (до commit).
+    """
+    updated = 0
+    for table in ('products', 'preorder_products'):
+        cur.execute(f"""
+            SELECT DISTINCT category FROM {table}
+            WHERE parent_category IS NULL OR parent_category = ''
+        """)
+        categories = [row[0] for row in cur.fetchall()]
+        cur.executemany(f"""
+            UPDATE {table} SET parent_category = ?
+            WHERE category IS ? AND (parent_category IS NULL OR parent_category = '')
+        """, [(parent_for_category(category), category) for category in categories])
+        updated += len(categories)
+    return updated
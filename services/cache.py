@@ -0,0 +1,40 @@
+import threading
+from collections import OrderedDict
+
+class VersionedCache:
+    """
+    Кеш готовых значений (списков категорий, клавиатур), сбрасываемый при смене версии данных.
+    version - функция без аргументов, возвращающая текущую версию (например, catalog_version).
+    max_size - наибольшее число значений (вытесняются давно не запрошенные), None - без ограничения
+    """
+
+    def __init__(self, version, max_size=None):
+        self._version = version
+        self._max_size = max_size
+        self._seen_version = None
+        self._values = OrderedDict()
+        # Проверка версии и построение значения под одной блокировкой: обработчики из
+        # asyncio.to_thread не видят чужой clear() посреди build() и не строят значение дважды.
+        # RLock - build() может обратиться к этому же кешу за другим ключом
+        self._lock = threading.RLock()
+
+    def get(self, key, build):
+        """Значение по ключу; если его нет или версия данных сменилась, вычисляется build()"""
+        with self._lock:
+            version = self._version()
+            if version != self._seen_version:
+                self._values.clear()
+                self._seen_version = version
+            try:
+                self._values.move_to_end(key)
+                return self._values[key]
+            except KeyError:
+                value = self._values[key] = build()
+                if self._max_size is not None and len(self._values) > self._max_size:
+                    self._values.popitem(last=False)
+                return value
+
+    def clear(self):
+        """Сбрасывает все значения"""
+        with self._lock:
+            self._values.clear()
@@ -0,0 +1,158 @@
+from db.models import CATALOG_VERSION, bump_version, get_db, get_version
+from services.brands import DEFAULT_PARENT
+from services.cache import VersionedCache
+from services.ordering import sort_categories, sort_key_value
+
+# Товары предзаказа хранятся в отдельной таблице без source, в дереве категорий - под этим source
+PREORDER_SOURCE = 'preorder'
+
+# Прайсы, из которых собирается каталог бота (стандартный и простой формат)
+CATALOG_SOURCES = ('standard', 'simple')
+
+def catalog_version():
+    """Текущая версия каталога (общая для всех процессов бота; кеши навигации и клавиатур сбрасываются при ее смене)"""
+    return get_version(CATALOG_VERSION)
+
+def bump_catalog_version(cur):
+    """Отмечает изменение каталога; вызывается в транзакции загрузки прайса или очистки товаров (до commit)"""
+    bump_version(cur, CATALOG_VERSION)
+
+# Списки категорий и индексы для навигации по каталогу (в памяти до изменения каталога)
+_navigation = VersionedCache(catalog_version)
+
+def sources_clause(sources, column='source'):
+    """Условие отбора по набору прайсов: ('source IN (?, ?)', параметры)"""
+    sources = tuple(sources)
+    return f"{column} IN ({', '.join('?' * len(sources))})", sources
+
+def _source_query(source):
+    """Таблица и условие отбора товаров прайса source"""
+    if source == PREORDER_SOURCE:
+        return "preorder_products", "1 = 1", ()
+    return "products", "source = ?", (source,)
+
+def rebuild_category_tree(cur, source='standard'):
+    """
+    Пересчитывает дерево категорий (category_tree) прайса source по его товарам.
+    Вызывается в той же транзакции, что и загрузка товаров (до commit),
+    поэтому навигация по категориям никогда не видит дерево, не совпадающее с товарами.
+    Возвращает количество узлов дерева.
+    """
+    table, where, params = _source_query(source)
+    cur.execute(f"""
+        SELECT COALESCE(NULLIF(parent_category, ''), ?), category, COUNT(*), MIN(price)
+        FROM {table}
+        WHERE {where} AND category IS NOT NULL AND category != ''
+        GROUP BY 1, 2
+    """, (DEFAULT_PARENT,) + params)
+    nodes = [
+        (parent, category, source, count, min_price, sort_key_value(category))
+        for parent, category, count, min_price in cur.fetchall()
+    ]
+
+    cur.execute("DELETE FROM category_tree WHERE source = ?", (source,))
+    cur.executemany("""
+        INSERT INTO category_tree (parent, subcategory, source, product_count, min_price, sort_key)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, nodes)
+    return len(nodes)
+
+def rebuild_all_category_trees(cur):
+    """Пересчитывает деревья категорий всех прайсов (из init_db, до commit)"""
+    cur.execute("SELECT DISTINCT source FROM products WHERE source IS NOT NULL")
+    sources = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT DISTINCT source FROM category_tree")
+    sources += [row[0] for row in cur.fetchall() if row[0] not in sources]
+    if PREORDER_SOURCE not in sources:
+        sources.append(PREORDER_SOURCE)
+    return sum(rebuild_category_tree(cur, source) for source in sources)
+
+def _query_parent_categories(sources):
+    where, params = sources_clause(sources)
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT DISTINCT parent FROM category_tree WHERE {where}", params)
+        return sort_categories(row[0] for row in cur.fetchall())
+
+def _query_subcategories(parent_category, sources):
+    where, params = sources_clause(sources)
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT subcategory
+            FROM category_tree
+            WHERE {where} AND parent = ? AND subcategory != parent
+            GROUP BY subcategory
+            ORDER BY MIN(sort_key), subcategory
+        """, params + (parent_category,))
+        return [row[0] for row in cur.fetchall()]
+
+def _query_navigation_index(sources):
+    """Множество родительских категорий и словарь подкатегория -> родительская категория"""
+    where, params = sources_clause(sources)
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT parent, subcategory
+            FROM category_tree
+            WHERE {where}
+            ORDER BY parent
+        """, params)
+        parents = set()
+        subcategory_parents = {}
+        for parent, subcategory in cur.fetchall():
+            parents.add(parent)
+            # Категории с товарами прямо в родительской категории подкатегориями не считаются
+            if subcategory != parent:
+                subcategory_parents.setdefault(subcategory, parent)
+        return parents, subcategory_parents
+
+def _navigation_index(sources):
+    sources = tuple(sources)
+    return _navigation.get(('index', sources), lambda: _query_navigation_index(sources))
+
+def get_parent_categories(sources=CATALOG_SOURCES):
+    """Родительские категории, в которых есть товары прайсов sources (без повторов, в порядке умной сортировки)"""
+    sources = tuple(sources)
+    return list(_navigation.get(('parents', sources), lambda: _query_parent_categories(sources)))
+
+def get_subcategories(parent_category, sources=CATALOG_SOURCES):
+    """
+    Подкатегории родительской категории во всех прайсах sources (без повторов, в порядке умной сортировки).
+    Товары прямо в родительской категории подкатегорией не считаются.
+    """
+    sources = tuple(sources)
+    return list(_navigation.get(
+        ('subcategories', parent_category, sources),
+        lambda: _query_subcategories(parent_category, sources)
+    ))
+
+def has_parent_category(parent_category, sources=CATALOG_SOURCES):
+    """Проверяет, есть ли родительская категория хотя бы в одном из прайсов sources"""
+    parents, _ = _navigation_index(sources)
+    return parent_category in parents
+
+def get_parent_for_subcategory(subcategory, sources=CATALOG_SOURCES):
+    """
+    Родительская категория подкатегории в прайсах sources или None
+    (при нескольких родительских категориях - первая по алфавиту)
+    """
+    _, subcategory_parents = _navigation_index(sources)
+    return subcategory_parents.get(subcategory)
+
+def _query_categories(sources):
+    where, params = sources_clause(sources)
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT DISTINCT subcategory
+            FROM category_tree
+            WHERE {where}
+            ORDER BY subcategory
+        """, params)
+        return [row[0] for row in cur.fetchall()]
+
+def get_preorder_categories():
+    """Категории предзаказа по алфавиту"""
+    sources = (PREORDER_SOURCE,)
+    return list(_navigation.get(('categories', sources), lambda: _query_categories(sources)))
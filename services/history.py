@@ -0,0 +1,255 @@
+"""
+История цен товаров.
+
+Время изменений (effective_from, uploaded_at) хранится строкой UTC 'YYYY-MM-DD HH:MM:SS.SSS':
+формат CURRENT_TIMESTAMP с миллисекундами, чтобы две загрузки в одну секунду не смешивались.
+Моменты времени в запросах сравниваются как строки, поэтому можно передавать и дату
+'YYYY-MM-DD' (начало дня) или время без миллисекунд.
+"""
+from datetime import datetime, timezone
+from db.models import get_db
+from services.category import PREORDER_SOURCE
+
+# Версия формата ключа товара: при изменении make_product_key ключи пересчитываются в init_db
+PRODUCT_KEY_VERSION = '2'
+
+def make_product_key(category, name, memory, color, country):
+    """Формирует ключ товара для истории цен (одинаковый между загрузками прайса)"""
+    return f"{category or ''}|{name or ''}|{memory or ''}|{color or ''}|{country or ''}"
+
+def _now():
+    """Текущее время в формате истории цен (UTC, с миллисекундами)"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+def _source_filter(table, source):
+    """Условие отбора товаров прайса: предзаказ хранится в отдельной таблице без source"""
+    if table == 'products':
+        return "source = ?", (source,)
+    return "1 = 1", ()
+
+def record_price_changes(cur, source='standard', table='products'):
+    """
+    Записывает изменения цен после загрузки прайса.
+    Вызывается в той же транзакции, что и загрузка товаров (до commit).
+
+    В историю попадает строка только если цена товара изменилась, товар появился
+    или пропал из прайса (тогда price = NULL). Сравнение выполняется одним SQL-запросом
+    по индексам, без загрузки товаров в память.
+    Возвращает количество записанных изменений.
+    """
+    where, where_params = _source_filter(table, source)
+    effective_from = _now()
+
+    # Новые товары и товары с изменившейся ценой
+    cur.execute(f"""
+        INSERT INTO price_history (product_key, source, effective_from, price, prev_price)
+        SELECT p.product_key, ?, ?, p.price, c.price
+        FROM (
+            SELECT product_key, MIN(price) AS price
+            FROM {table}
+            WHERE {where} AND product_key IS NOT NULL
+            GROUP BY product_key
+        ) p
+        LEFT JOIN price_current c ON c.source = ? AND c.product_key = p.product_key
+        WHERE c.product_key IS NULL OR c.price != p.price
+    """, (source, effective_from) + where_params + (source,))
+    changes = cur.rowcount
+
+    # Товары, которые пропали из прайса
+    cur.execute(f"""
+        INSERT INTO price_history (product_key, source, effective_from, price, prev_price)
+        SELECT c.product_key, ?, ?, NULL, c.price
+        FROM price_current c
+        WHERE c.source = ? AND NOT EXISTS (
+            SELECT 1 FROM {table} p
+            WHERE {where} AND p.product_key = c.product_key
+        )
+    """, (source, effective_from, source) + where_params)
+    changes += cur.rowcount
+
+    # Обновляем последние известные цены: только изменившиеся, новые и пропавшие товары
+    cur.execute(f"""
+        DELETE FROM price_current
+        WHERE source = ? AND NOT EXISTS (
+            SELECT 1 FROM {table} p
+            WHERE {where} AND p.product_key = price_current.product_key
+        )
+    """, (source,) + where_params)
+    cur.execute(f"""
+        INSERT INTO price_current (source, product_key, price)
+        SELECT ?, product_key, MIN(price)
+        FROM {table}
+        WHERE {where} AND product_key IS NOT NULL
+        GROUP BY product_key
+        ON CONFLICT (source, product_key) DO UPDATE SET price = excluded.price
+        WHERE price != excluded.price
+    """, (source,) + where_params)
+    cur.execute(f"""
+        SELECT COUNT(DISTINCT product_key) FROM {table} WHERE {where} AND product_key IS NOT NULL
+    """, where_params)
+    products_count = cur.fetchone()[0]
+
+    cur.execute("""
+        INSERT INTO price_uploads (source, uploaded_at, products_count, changes_count)
+        VALUES (?, ?, ?, ?)
+    """, (source, effective_from, products_count, changes))
+
+    return changes
+
+def update_product_keys(cur):
+    """
+    Пересчитывает ключи товаров, сохраненные в старом формате (PRODUCT_KEY_VERSION).
+    Вызывается из init_db (до commit). Последние известные цены пересобираются по новым ключам
+    без записи в историю; прежние строки истории остаются под старыми ключами.
+    """
+    cur.execute("SELECT value FROM settings WHERE key = 'product_key_version'")
+    row = cur.fetchone()
+    if row and row[0] == PRODUCT_KEY_VERSION:
+        return 0
+
+    updated = 0
+    for table in ('products', 'preorder_products'):
+        cur.execute(f"SELECT id, category, name, memory, color, country FROM {table}")
+        keys = [(make_product_key(*product[1:]), product[0]) for product in cur.fetchall()]
+        cur.executemany(f"UPDATE {table} SET product_key = ? WHERE id = ?", keys)
+        updated += len(keys)
+    for cart_table, products_table in (('cart', 'products'), ('preorder_cart', 'preorder_products')):
+        cur.execute(f"""
+            UPDATE {cart_table}
+            SET product_key = (SELECT p.product_key FROM {products_table} p WHERE p.id = {cart_table}.product_id)
+            WHERE product_id IN (SELECT id FROM {products_table})
+        """)
+
+    cur.execute("DELETE FROM price_current")
+    cur.execute("""
+        INSERT INTO price_current (source, product_key, price)
+        SELECT source, product_key, MIN(price) FROM products
+        WHERE product_key IS NOT NULL
+        GROUP BY source, product_key
+    """)
+    cur.execute("""
+        INSERT INTO price_current (source, product_key, price)
+        SELECT ?, product_key, MIN(price) FROM preorder_products
+        WHERE product_key IS NOT NULL
+        GROUP BY product_key
+    """, (PREORDER_SOURCE,))
+    cur.execute(
+        "INSERT OR REPLACE INTO settings (key, value) VALUES ('product_key_version', ?)",
+        (PRODUCT_KEY_VERSION,)
+    )
+    return updated
+
+def get_price_at(product_key, moment, source='standard'):
+    """
+    Получает цену товара на момент времени moment (UTC, см. формат времени в начале модуля).
+    Возвращает None, если товара в этот момент не было в прайсе.
+    """
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT price
+            FROM price_history
+            WHERE source = ? AND product_key = ? AND effective_from <= ?
+            ORDER BY effective_from DESC, id DESC
+            LIMIT 1
+        """, (source, product_key, moment))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+def get_price_history(product_key, source='standard', limit=50):
+    """Получает историю изменений цены товара (от новых к старым)"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT effective_from, price, prev_price
+            FROM price_history
+            WHERE source = ? AND product_key = ?
+            ORDER BY effective_from DESC
+            LIMIT ?
+        """, (source, product_key, limit))
+        rows = cur.fetchall()
+        return [
+            {
+                "effective_from": row[0],
+                "price": row[1],
+                "prev_price": row[2],
+            } for row in rows
+        ]
+
+def get_last_upload(source='standard'):
+    """Получает информацию о последней загрузке прайса указанного типа"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, uploaded_at, products_count, changes_count
+            FROM price_uploads
+            WHERE source = ?
+            ORDER BY uploaded_at DESC
+            LIMIT 1
+        """, (source,))
+        row = cur.fetchone()
+        if row:
+            return {
+                "id": row[0],
+                "uploaded_at": row[1],
+                "products_count": row[2],
+                "changes_count": row[3],
+            }
+        return None
+
+def get_top_movers(source='standard', limit=10):
+    """
+    Получает товары с наибольшим изменением цены в последней загрузке прайса.
+    Новые и пропавшие товары не учитываются.
+    """
+    last_upload = get_last_upload(source)
+    if not last_upload:
+        return []
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT product_key, prev_price, price, price - prev_price AS delta
+            FROM price_history
+            WHERE source = ? AND effective_from >= ?
+                AND price IS NOT NULL AND prev_price IS NOT NULL
+            ORDER BY ABS(price - prev_price) DESC
+            LIMIT ?
+        """, (source, last_upload['uploaded_at'], limit))
+        rows = cur.fetchall()
+        return [
+            {
+                "product_key": row[0],
+                "prev_price": row[1],
+                "price": row[2],
+                "delta": row[3],
+            } for row in rows
+        ]
+
+def find_products(text, limit=5):
+    """Товары каталога и предзаказа с text в названии (для истории цен): [{"source", "product_key", "name", ...}]"""
+    pattern = f"%{text}%"
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT source, product_key, name, memory, color, country, MIN(price) FROM (
+                SELECT source, product_key, name, memory, color, country, price FROM products
+                WHERE name LIKE ? AND product_key IS NOT NULL
+                UNION ALL
+                SELECT ?, product_key, name, memory, color, country, price FROM preorder_products
+                WHERE name LIKE ? AND product_key IS NOT NULL
+            )
+            GROUP BY source, product_key
+            LIMIT ?
+        """, (pattern, PREORDER_SOURCE, pattern, limit))
+        return [
+            {
+                "source": row[0],
+                "product_key": row[1],
+                "name": row[2],
+                "memory": row[3],
+                "color": row[4],
+                "country": row[5],
+                "price": row[6],
+            } for row in cur.fetchall()
+        ]
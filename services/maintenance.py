@@ -0,0 +1,477 @@
+"""
+Фоновое обслуживание базы: планировщик asyncio в процессе бота (polling)
+или в супервизоре webhook (один раз на все процессы-обработчики).
+
+Задачи (время и итог последнего запуска - в таблице maintenance_runs, команда админа /maintenance):
+- cart_sweep - очистка корзин каждые MAINTENANCE_INTERVAL_MINUTES минут:
+  позиции, не изменявшиеся CART_TTL_DAYS дней, удаляются (по индексу updated_at), позиции товаров,
+  удаленных при загрузке прайса, переносятся на тот же товар нового прайса (по product_key)
+  или удаляются, если товара больше нет;
+- analyze - ANALYZE (с ограничением analysis_limit) и PRAGMA optimize после загрузки прайса
+  (смены версии каталога), чтобы планировщик запросов знал размеры таблиц и индексов;
+- backup - копия базы через backup API SQLite каждые BACKUP_INTERVAL_HOURS часов: по
+  BACKUP_PAGES_PER_STEP страниц за шаг с паузой между шагами, обработчики бота читают
+  и пишут базу во время копирования;
+- vacuum - PRAGMA incremental_vacuum небольшими шагами раз в сутки в тихие часы VACUUM_HOURS
+  (только для базы в режиме auto_vacuum = INCREMENTAL; старую базу один раз переводит админ
+  командой /maintenance vacuum - полный VACUUM по расписанию не выполняется).
+Строки корзин обрабатываются порциями по SWEEP_BATCH_SIZE, каждая порция - отдельная транзакция,
+чтобы не держать блокировку записи базы, пока обработчики бота работают с корзинами.
+Итог очистки корзин и ошибки задач отправляются админам.
+"""
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import time
+from html import escape
+from config import (
+    ADMIN_IDS, BACKUP_DIR, BACKUP_INTERVAL_HOURS, BACKUP_KEEP, CART_TTL_DAYS, DATABASE_PATH,
+    MAINTENANCE_INTERVAL_MINUTES, VACUUM_HOURS
+)
+from db.models import get_db
+from services import metrics
+from services.category import CATALOG_SOURCES, catalog_version, sources_clause
+
+logger = logging.getLogger(__name__)
+
+# Строк корзины в одной транзакции очистки
+SWEEP_BATCH_SIZE = 500
+
+# Страниц базы за один шаг копирования и пауза между шагами (секунды)
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_PAUSE = 0.005
+
+# Копирование начинается заново после каждой записи в базу из другого соединения;
+# после стольких перезапусков копия снимается одним шагом (запись ждет окончания копирования)
+BACKUP_MAX_RESTARTS = 5
+
+# Страниц, освобождаемых за один шаг incremental_vacuum, и пауза между шагами
+VACUUM_PAGES_PER_STEP = 256
+VACUUM_STEP_PAUSE = 0.01
+
+# Строк индекса, которые ANALYZE просматривает в каждой таблице (приблизительная статистика)
+ANALYSIS_LIMIT = 1000
+
+# Как часто планировщик проверяет, пора ли запускать задачи (секунды)
+TICK_SECONDS = 60
+
+# PRAGMA auto_vacuum: 2 - INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+# Корзины: (таблица корзины, таблица товаров, прайсы товаров корзины; None - все товары таблицы)
+CART_TABLES = (
+    ('cart', 'products', CATALOG_SOURCES),
+    ('preorder_cart', 'preorder_products', None),
+)
+
+def delete_expired_cart_rows(table, ttl_days):
+    """Удаляет позиции корзины, не изменявшиеся ttl_days дней, возвращает количество удаленных"""
+    deleted = 0
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        while True:
+            cur.execute(f"""
+                DELETE FROM {table}
+                WHERE id IN (
+                    SELECT id FROM {table}
+                    WHERE updated_at < datetime('now', ?)
+                    LIMIT ?
+                )
+            """, (f"-{ttl_days} days", SWEEP_BATCH_SIZE))
+            count = cur.rowcount
+            conn.commit()
+            deleted += count
+            if count < SWEEP_BATCH_SIZE:
+                return deleted
+    finally:
+        conn.close()
+
+def repair_orphan_cart_rows(table, products_table, sources=None):
+    """
+    Позиции корзины с удаленными товарами: переносит на товар с тем же product_key
+    (если такой товар уже есть в корзине пользователя - количества складываются)
+    или удаляет. Возвращает (перенесено, удалено).
+    Каждая порция обрабатывается несколькими запросами над всей порцией сразу:
+    новый товар для позиций порции вычисляется один раз во временную таблицу cart_remap.
+    """
+    if sources:
+        source_where, source_params = sources_clause(sources, 'p.source')
+    else:
+        source_where, source_params = "1 = 1", ()
+
+    repaired = removed = 0
+    last_id = 0
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS cart_remap (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                new_id INTEGER
+            )
+        """)
+        while True:
+            cur.execute("DELETE FROM cart_remap")
+            cur.execute(f"""
+                INSERT INTO cart_remap (id, user_id, quantity, new_id)
+                SELECT c.id, c.user_id, c.quantity, (
+                    SELECT MIN(p.id) FROM {products_table} p
+                    WHERE {source_where} AND p.product_key = c.product_key
+                )
+                FROM {table} c
+                WHERE c.id > ? AND NOT EXISTS (SELECT 1 FROM {products_table} p WHERE p.id = c.product_id)
+                ORDER BY c.id
+                LIMIT ?
+            """, source_params + (last_id, SWEEP_BATCH_SIZE))
+            if not cur.rowcount:
+                return repaired, removed
+            cur.execute("SELECT MAX(id), COUNT(new_id), COUNT(*) - COUNT(new_id) FROM cart_remap")
+            last_id, batch_repaired, batch_removed = cur.fetchone()
+
+            # Пользователь мог снова добавить этот товар после загрузки прайса: складываем количества
+            cur.execute(f"""
+                UPDATE {table}
+                SET quantity = quantity + (
+                        SELECT SUM(r.quantity) FROM cart_remap r
+                        WHERE r.user_id = {table}.user_id AND r.new_id = {table}.product_id
+                    ),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT e.id FROM cart_remap r
+                    JOIN {table} e ON e.user_id = r.user_id AND e.product_id = r.new_id
+                )
+            """)
+            cur.execute(f"""
+                DELETE FROM {table}
+                WHERE id IN (
+                    SELECT r.id FROM cart_remap r
+                    JOIN {table} e ON e.user_id = r.user_id AND e.product_id = r.new_id
+                )
+            """)
+            cur.execute(f"DELETE FROM cart_remap WHERE NOT EXISTS (SELECT 1 FROM {table} c WHERE c.id = cart_remap.id)")
+
+            # Несколько позиций порции переходят на один товар пользователя: остается первая с общим количеством
+            cur.execute(f"""
+                UPDATE {table}
+                SET quantity = (
+                    SELECT SUM(r2.quantity) FROM cart_remap r1
+                    JOIN cart_remap r2 ON r2.user_id = r1.user_id AND r2.new_id = r1.new_id
+                    WHERE r1.id = {table}.id
+                )
+                WHERE id IN (
+                    SELECT MIN(id) FROM cart_remap WHERE new_id IS NOT NULL
+                    GROUP BY user_id, new_id HAVING COUNT(*) > 1
+                )
+            """)
+            cur.execute(f"""
+                DELETE FROM {table}
+                WHERE id IN (
+                    SELECT r.id FROM cart_remap r
+                    WHERE r.new_id IS NOT NULL AND r.id > (
+                        SELECT MIN(r2.id) FROM cart_remap r2 WHERE r2.user_id = r.user_id AND r2.new_id = r.new_id
+                    )
+                )
+            """)
+
+            # Остальные позиции переносятся на новый товар, позиции без товара удаляются
+            cur.execute(f"""
+                UPDATE {table}
+                SET product_id = (SELECT r.new_id FROM cart_remap r WHERE r.id = {table}.id)
+                WHERE id IN (SELECT id FROM cart_remap WHERE new_id IS NOT NULL)
+            """)
+            cur.execute(f"DELETE FROM {table} WHERE id IN (SELECT id FROM cart_remap WHERE new_id IS NULL)")
+            conn.commit()
+            repaired += batch_repaired
+            removed += batch_removed
+    finally:
+        conn.close()
+
+def sweep_carts(ttl_days=CART_TTL_DAYS):
+    """Очистка обеих корзин: {"expired": ..., "repaired": ..., "removed": ...}"""
+    result = {"expired": 0, "repaired": 0, "removed": 0}
+    for table, products_table, sources in CART_TABLES:
+        if ttl_days > 0:
+            result["expired"] += delete_expired_cart_rows(table, ttl_days)
+        repaired, removed = repair_orphan_cart_rows(table, products_table, sources)
+        result["repaired"] += repaired
+        result["removed"] += removed
+    for action, count in result.items():
+        if count:
+            metrics.inc('cart_sweep_rows_total', {'action': action}, count)
+    return result
+
+def format_sweep_report(result, ttl_days=CART_TTL_DAYS):
+    """Текст отчета об очистке корзин для админов"""
+    return (
+        f"🧹 <b>Очистка корзин</b>\n\n"
+        f"Удалено позиций без изменений {ttl_days} дн.: <b>{result['expired']}</b>\n"
+        f"Перенесено на товары нового прайса: <b>{result['repaired']}</b>\n"
+        f"Удалено позиций удаленных товаров: <b>{result['removed']}</b>"
+    )
+
+async def notify_admins(bot, text):
+    """Отправляет сообщение всем админам (ошибки отправки не прерывают обслуживание)"""
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(admin_id, text, parse_mode='HTML')
+        except Exception:
+            logger.warning("Не удалось отправить отчет обслуживания админу %s", admin_id)
+
+# Названия задач для отчетов админу
+TASK_TITLES = {
+    'cart_sweep': "Очистка корзин",
+    'analyze': "ANALYZE / optimize",
+    'backup': "Резервная копия",
+    'vacuum': "Incremental vacuum",
+}
+
+def describe_result(task, result):
+    """Краткое описание итога задачи для админа"""
+    if task == 'cart_sweep':
+        return (
+            f"удалено по сроку {result['expired']}, перенесено {result['repaired']}, "
+            f"удалено позиций удаленных товаров {result['removed']}"
+        )
+    if task == 'analyze':
+        return f"таблиц со статистикой: {result['tables']}"
+    if task == 'backup':
+        return f"{result['file']}, {result['size'] / 1024 / 1024:.1f} МБ"
+    if task == 'vacuum':
+        if not result.get('incremental', True):
+            return "пропущено: база не в режиме auto_vacuum = INCREMENTAL (перевести - /maintenance vacuum)"
+        return f"освобождено страниц: {result['freed_pages']}"
+    return str(result)
+
+def parse_hours(text):
+    """Часы из диапазона 'с-по' по времени сервера ('3-5' - с 3:00 до 5:00, '23-2' - через полночь)"""
+    if not text.strip():
+        return set()
+    start, end = (int(part) % 24 for part in text.split('-', 1))
+    return set(range(start, end)) if start < end else set(range(start, 24)) | set(range(end))
+
+def analyze_database():
+    """ANALYZE всех таблиц с ограничением analysis_limit и PRAGMA optimize"""
+    conn = get_db()
+    try:
+        conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        conn.commit()
+        tables = conn.execute("SELECT COUNT(DISTINCT tbl) FROM sqlite_stat1").fetchone()[0]
+        return {"tables": tables}
+    finally:
+        conn.close()
+
+class _BackupRestarted(Exception):
+    """Копирование по шагам слишком часто начиналось заново из-за записи в базу"""
+
+def backup_database(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    """
+    Копия базы через backup API SQLite в backup_dir (хранятся keep последних копий).
+    Блокировка чтения базы держится только на время шага в BACKUP_PAGES_PER_STEP страниц.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    prefix = os.path.splitext(os.path.basename(DATABASE_PATH))[0] + '-'
+    name = f"{prefix}{datetime.datetime.now(datetime.timezone.utc):%Y%m%d-%H%M%S}.db"
+    path = os.path.join(backup_dir, name)
+    tmp_path = f"{path}.tmp"
+
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts >= BACKUP_MAX_RESTARTS:
+                raise _BackupRestarted()
+        last_remaining = remaining
+        # Пауза между шагами: запись в базу из обработчиков бота не ждет окончания копирования
+        time.sleep(BACKUP_STEP_PAUSE)
+
+    source = sqlite3.connect(DATABASE_PATH)
+    target = sqlite3.connect(tmp_path)
+    try:
+        try:
+            source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+        except _BackupRestarted:
+            source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    os.replace(tmp_path, path)
+
+    backups = sorted(
+        file_name for file_name in os.listdir(backup_dir)
+        if file_name.startswith(prefix) and file_name.endswith('.db')
+    )
+    for old_name in backups[:-keep] if keep > 0 else []:
+        os.remove(os.path.join(backup_dir, old_name))
+    return {"file": name, "size": os.path.getsize(path), "restarts": restarts}
+
+def incremental_vacuum():
+    """
+    Возвращает свободные страницы базы файловой системе шагами по VACUUM_PAGES_PER_STEP.
+    Только для базы в режиме auto_vacuum = INCREMENTAL (новые базы создаются в нем, старую переводит
+    convert_to_incremental_vacuum по команде админа); для остальных баз ничего не делает.
+    """
+    conn = get_db()
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            return {"incremental": False, "freed_pages": 0}
+
+        freed = 0
+        while True:
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free_pages:
+                return {"incremental": True, "freed_pages": freed}
+            # executescript выполняет PRAGMA до конца (execute освобождает только одну страницу)
+            conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP});")
+            freed += min(free_pages, VACUUM_PAGES_PER_STEP)
+            time.sleep(VACUUM_STEP_PAUSE)
+    finally:
+        conn.close()
+
+def convert_to_incremental_vacuum():
+    """
+    Переводит базу в режим auto_vacuum = INCREMENTAL полным VACUUM (команда админа /maintenance vacuum).
+    VACUUM переписывает весь файл базы, запись в базу ждет его окончания.
+    Возвращает False, если база уже в этом режиме.
+    """
+    conn = get_db()
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            return False
+        conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+def record_run(task, started_at, duration, result=None, error=None):
+    """Записывает итог запуска задачи обслуживания в maintenance_runs"""
+    with get_db() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO maintenance_runs (task, started_at, duration, result, error)
+            VALUES (?, ?, ?, ?, ?)
+        """, (task, started_at, duration, json.dumps(result) if result is not None else None, error))
+        conn.commit()
+
+def get_last_runs():
+    """Последние запуски задач: {task: {"started_at", "duration", "result", "error"}}"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT task, started_at, duration, result, error FROM maintenance_runs")
+        return {
+            row[0]: {
+                "started_at": row[1],
+                "duration": row[2],
+                "result": json.loads(row[3]) if row[3] else None,
+                "error": row[4],
+            } for row in cur.fetchall()
+        }
+
+def get_database_info():
+    """Размер базы и страницы: {"size", "page_size", "page_count", "freelist_count", "auto_vacuum"}"""
+    with get_db() as conn:
+        info = {
+            pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+            for pragma in ("page_size", "page_count", "freelist_count", "auto_vacuum")
+        }
+    info["size"] = os.path.getsize(DATABASE_PATH)
+    return info
+
+def _utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def _parse_time(text):
+    return datetime.datetime.strptime(text, '%Y-%m-%d %H:%M:%S')
+
+class MaintenanceScheduler:
+    """Запуск задач обслуживания по расписанию; проверка раз в TICK_SECONDS"""
+
+    def __init__(self, bot, interval_minutes=MAINTENANCE_INTERVAL_MINUTES, backup_hours=BACKUP_INTERVAL_HOURS,
+                 vacuum_hours=VACUUM_HOURS):
+        self.bot = bot
+        self.interval = datetime.timedelta(minutes=interval_minutes)
+        self.backup_interval = datetime.timedelta(hours=backup_hours) if backup_hours > 0 else None
+        self.vacuum_hours = parse_hours(vacuum_hours)
+        # Версия каталога, после которой выполнялся ANALYZE (None - еще не выполнялся в этом процессе)
+        self.analyzed_version = None
+
+    def due_tasks(self, last_runs, now=None, local_hour=None):
+        """Задачи, которые пора запустить"""
+        now = now or _utc_now()
+        local_hour = datetime.datetime.now().hour if local_hour is None else local_hour
+
+        def last_started(task):
+            run = last_runs.get(task)
+            return _parse_time(run["started_at"]) if run else None
+
+        tasks = []
+        started = last_started('cart_sweep')
+        if started is None or now - started >= self.interval:
+            tasks.append('cart_sweep')
+        if catalog_version() != self.analyzed_version:
+            tasks.append('analyze')
+        started = last_started('backup')
+        if self.backup_interval and (started is None or now - started >= self.backup_interval):
+            tasks.append('backup')
+        started = last_started('vacuum')
+        if local_hour in self.vacuum_hours and (started is None or now - started >= datetime.timedelta(hours=20)):
+            tasks.append('vacuum')
+        return tasks
+
+    async def run_task(self, task):
+        """Выполняет задачу в отдельном потоке (event loop продолжает обрабатывать update) и записывает итог"""
+        functions = {
+            'cart_sweep': sweep_carts,
+            'analyze': analyze_database,
+            'backup': backup_database,
+            'vacuum': incremental_vacuum,
+        }
+        started_at = _utc_now().strftime('%Y-%m-%d %H:%M:%S')
+        version = catalog_version()
+        started = time.perf_counter()
+        result = error = None
+        try:
+            result = await asyncio.to_thread(functions[task])
+        except Exception as e:
+            logger.exception("Ошибка обслуживания базы: %s", task)
+            error = str(e)
+        duration = time.perf_counter() - started
+        metrics.observe('maintenance_seconds', duration, {'task': task})
+        await asyncio.to_thread(record_run, task, started_at, duration, result, error)
+
+        if task == 'analyze' and error is None:
+            self.analyzed_version = version
+        if error:
+            await notify_admins(self.bot, f"⚠️ <b>Ошибка обслуживания базы</b> ({task}): {escape(error[:500])}")
+        elif task == 'cart_sweep' and any(result.values()):
+            logger.info("Очистка корзин: %s", result)
+            await notify_admins(self.bot, format_sweep_report(result))
+        return result
+
+    async def tick(self):
+        """Запускает задачи, которые пора выполнить (по очереди)"""
+        last_runs = await asyncio.to_thread(get_last_runs)
+        for task in self.due_tasks(last_runs):
+            await self.run_task(task)
+
+async def run_maintenance(bot, interval_minutes=MAINTENANCE_INTERVAL_MINUTES):
+    """Планировщик обслуживания базы до отмены задачи (первая проверка - сразу при запуске)"""
+    if interval_minutes <= 0:
+        return
+    scheduler = MaintenanceScheduler(bot, interval_minutes)
+    while True:
+        try:
+            await scheduler.tick()
+        except Exception:
+            logger.exception("Ошибка планировщика обслуживания базы")
+        await asyncio.sleep(min(TICK_SECONDS, interval_minutes * 60))
@@ -0,0 +1,175 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограмм (секунды)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Описания метрик для Prometheus (# HELP)
+METRIC_HELP = {
+    'bot_update_seconds': 'Время обработки update целиком (фильтры + обработчик)',
+    'bot_handler_seconds': 'Время работы обработчика',
+    'bot_handler_errors_total': 'Количество исключений в обработчиках',
+    'db_statement_seconds': 'Время выполнения SQL-запроса',
+    'telegram_api_requests_total': 'Количество вызовов Telegram Bot API',
+    'telegram_api_seconds': 'Время вызова Telegram Bot API',
+    'price_import_seconds': 'Время загрузки прайса',
+    'price_import_products_total': 'Количество загруженных товаров',
+    'orders_export_seconds': 'Время выгрузки заказов в файл',
+    'orders_export_items_total': 'Количество выгруженных позиций заказов',
+    'maintenance_seconds': 'Время задачи фонового обслуживания базы',
+    'cart_sweep_rows_total': 'Количество позиций корзин, удаленных или перенесенных при очистке',
+    'webhook_worker_restarts_total': 'Количество перезапусков упавших процессов-обработчиков webhook',
+}
+
+_lock = threading.Lock()
+
+# Хранилища метрик
+# Формат: {(name, labels_tuple): value}
+_counters = {}
+# Формат: {(name, labels_tuple): [bucket_counts, sum, count]}
+_histograms = {}
+
+def _labels_key(labels):
+    """Преобразует словарь меток в хешируемый отсортированный кортеж"""
+    if not labels:
+        return ()
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+def inc(name, labels=None, amount=1):
+    """Увеличивает счетчик"""
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def observe(name, value, labels=None):
+    """Добавляет наблюдение в гистограмму"""
+    key = (name, _labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = [[0] * len(DEFAULT_BUCKETS), 0.0, 0]
+            _histograms[key] = histogram
+        buckets = histogram[0]
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                buckets[i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+@contextmanager
+def timer(name, labels=None):
+    """Контекстный менеджер: измеряет время блока и записывает его в гистограмму"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, labels)
+
+def reset():
+    """Сбрасывает все метрики"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def _format_labels(labels_key, extra=None):
+    """Форматирует метки в синтаксисе Prometheus"""
+    items = list(labels_key)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ''
+    escaped = []
+    for k, v in items:
+        v = v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{k}="{v}"')
+    return '{' + ','.join(escaped) + '}'
+
+def render_prometheus():
+    """Возвращает все метрики в текстовом формате Prometheus"""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: [list(h[0]), h[1], h[2]] for key, h in _histograms.items()}
+
+    lines = []
+    described = set()
+
+    def describe(name, metric_type):
+        if name in described:
+            return
+        described.add(name)
+        if name in METRIC_HELP:
+            lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+    for (name, labels_key), value in sorted(counters.items()):
+        describe(name, 'counter')
+        lines.append(f"{name}{_format_labels(labels_key)} {value}")
+
+    for (name, labels_key), (buckets, total, count) in sorted(histograms.items()):
+        describe(name, 'histogram')
+        cumulative = 0
+        for bound, bucket_count in zip(DEFAULT_BUCKETS, buckets):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels_key, ('le', repr(bound)))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels_key, ('le', '+Inf'))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels_key)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels_key)} {count}")
+
+    return '\n'.join(lines) + '\n'
+
+def _quantile(buckets, count, q):
+    """Оценка квантиля по корзинам гистограммы (верхняя граница корзины)"""
+    if not count:
+        return 0.0
+    target = q * count
+    cumulative = 0
+    for bound, bucket_count in zip(DEFAULT_BUCKETS, buckets):
+        cumulative += bucket_count
+        if cumulative >= target:
+            return bound
+    return float('inf')
+
+def get_histogram_summary(name, top=10):
+    """
+    Сводка по гистограмме: список словарей, отсортированный по суммарному времени.
+    Используется для команды /metrics в чате.
+    """
+    with _lock:
+        items = [(labels_key, list(h[0]), h[1], h[2]) for (n, labels_key), h in _histograms.items() if n == name]
+
+    summary = []
+    for labels_key, buckets, total, count in items:
+        summary.append({
+            "labels": dict(labels_key),
+            "count": count,
+            "total": total,
+            "avg": total / count if count else 0.0,
+            "p95": _quantile(buckets, count, 0.95),
+        })
+    summary.sort(key=lambda item: item['total'], reverse=True)
+    return summary[:top]
+
+def get_counter_values(name):
+    """Значения счетчика по меткам: {labels_tuple: value}"""
+    with _lock:
+        return {labels_key: value for (n, labels_key), value in _counters.items() if n == name}
+
+async def start_metrics_server(host, port):
+    """Запускает локальный HTTP-сервер с метриками в формате Prometheus (GET /metrics)"""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(
+            text=render_prometheus(),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
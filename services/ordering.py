@@ -0,0 +1,104 @@
+import hashlib
+import json
+import re
+from functools import lru_cache
+from config import CATEGORY_ORDER_RULES_FILE
+
+# Правила сортировки моделей (порядок правил - порядок групп брендов в списке категорий).
+# prefix - регулярное выражение перед номером модели, variants - приоритеты вариантов
+# (проверяются по порядку вхождением подстроки, базовая модель без варианта идет первой),
+# default - приоритет варианта, не найденного в списке
+DEFAULT_ORDER_RULES = [
+    {'prefix': r'iPhone\s+', 'variants': [['Air', 1], ['Pro Max', 3], ['Pro', 2], ['Ultra', 4]], 'default': 5},
+    {'prefix': r'Samsung Galaxy S', 'variants': [['Ultra', 2], ['+', 1]], 'default': 3},
+    {'prefix': r'Xiaomi\s+', 'variants': [['Pro', 1], ['Ultra', 2]], 'default': 3},
+    {'prefix': r'Google Pixel\s+', 'variants': [['Pro XL', 2], ['Pro', 1]], 'default': 3},
+]
+
+# Группа категорий, не подходящих ни под одно правило (сортируются по алфавиту)
+OTHER_GROUP = 999
+
+def load_rules(path=None):
+    """Таблица правил из JSON файла (тот же формат, что DEFAULT_ORDER_RULES) или встроенная"""
+    if not path:
+        return DEFAULT_ORDER_RULES
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def compile_rules(rules):
+    """
+    Собирает все правила в одно регулярное выражение.
+    Альтернативы проверяются в порядке правил (как последовательные re.search),
+    номер сработавшего правила определяется по имени группы варианта.
+    """
+    alternatives = [
+        rf'.*?{rule["prefix"]}(?P<model_{i}>\d+)\s*(?P<variant_{i}>.*)'
+        for i, rule in enumerate(rules)
+    ]
+    return re.compile('(?:' + '|'.join(alternatives) + ')')
+
+ORDER_RULES = load_rules(CATEGORY_ORDER_RULES_FILE)
+_ORDER_PATTERN = compile_rules(ORDER_RULES)
+
+# Версия правил: при ее изменении сохраненные ключи сортировки пересчитываются
+RULES_VERSION = hashlib.sha1(json.dumps(ORDER_RULES, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+@lru_cache(maxsize=8192)
+def category_sort_key(category):
+    """
+    Ключ сортировки категории: (группа бренда, номер модели, приоритет варианта, вариант).
+    Например: iPhone 15, iPhone 15 Pro, iPhone 16, iPhone 16 Pro, iPhone 17, iPhone 17 Air, iPhone 17 Pro
+    """
+    match = _ORDER_PATTERN.match(category)
+    if not match:
+        # Для остальных категорий - сортируем по алфавиту
+        return (OTHER_GROUP, 0, 0, category)
+
+    group = int(match.lastgroup.rsplit('_', 1)[1])
+    rule = ORDER_RULES[group]
+    model_num = int(match.group(f'model_{group}'))
+    variant = match.group(f'variant_{group}').strip()
+
+    # Базовая модель идет первой, затем варианты по приоритету из таблицы
+    variant_priority = 0
+    if variant:
+        variant_priority = rule['default']
+        for substring, priority in rule['variants']:
+            if substring in variant:
+                variant_priority = priority
+                break
+    return (group, model_num, variant_priority, variant)
+
+def sort_key_value(category):
+    """
+    Ключ сортировки в виде строки для колонки products.sort_key:
+    числа фиксированной ширины, поэтому ORDER BY sort_key дает тот же порядок, что и category_sort_key
+    """
+    group, model_num, variant_priority, variant = category_sort_key(category or '')
+    return f"{group:03d}{model_num:09d}{variant_priority:03d}{variant}"
+
+def sort_categories(categories):
+    """Сортирует категории по номерам моделей и вариантам (ключи кешируются)"""
+    return sorted(categories, key=category_sort_key)
+
+def update_sort_keys(cur):
+    """
+    Заполняет products.sort_key для товаров без ключа; при смене таблицы правил
+    пересчитывает ключи всех товаров. Вызывается из init_db (до commit).
+    """
+    cur.execute("SELECT value FROM settings WHERE key = 'category_order_rules'")
+    row = cur.fetchone()
+    if not row or row[0] != RULES_VERSION:
+        cur.execute("UPDATE products SET sort_key = NULL")
+
+    cur.execute("SELECT DISTINCT category FROM products WHERE sort_key IS NULL")
+    categories = [row[0] for row in cur.fetchall()]
+    cur.executemany(
+        "UPDATE products SET sort_key = ? WHERE category IS ? AND sort_key IS NULL",
+        [(sort_key_value(category), category) for category in categories]
+    )
+    cur.execute(
+        "INSERT OR REPLACE INTO settings (key, value) VALUES ('category_order_rules', ?)",
+        (RULES_VERSION,)
+    )
+    return len(categories)
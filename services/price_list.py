@@ -0,0 +1,109 @@
+"""
+Файл прайса для покупателей ("Скачать прайс"): весь каталог бота с ценами покупателя.
+
+Файл пишется одним проходом по каталогу (категория за категорией) и сохраняется на диск
+под именем с версией каталога, версией наценок и набором цен покупателя (price_group_key),
+поэтому повторные запросы пользователей с теми же ценами отдаются готовым файлом.
+Файлы прошлых версий удаляются при создании нового.
+"""
+import datetime
+import os
+from admin.discount import price_group_key, price_listing
+from config import PRICE_EXPORT_DIR
+from db.models import SETTINGS_VERSION, get_version
+from services.category import catalog_version, get_parent_categories, get_subcategories
+from services.product import get_products_by_category
+
+PRICE_FILE_FORMATS = ('xlsx', 'txt')
+
+PRICE_FILE_COLUMNS = ["Бренд", "Модель", "Товар", "Страна / SIM", "Цена, ₽"]
+
+def _versions_prefix():
+    return f"price-{catalog_version()}-{get_version(SETTINGS_VERSION)}-"
+
+def price_file_path(user_id, file_format):
+    """Путь к файлу прайса для набора цен пользователя в текущих версиях каталога и наценок"""
+    key = price_group_key(user_id)
+    owner = '-'.join(str(part) for part in key) if key else 'all'
+    return os.path.join(PRICE_EXPORT_DIR, f"{_versions_prefix()}{owner}.{file_format}")
+
+def iter_price_sections(user_id=None):
+    """
+    Категории каталога в порядке навигации бота: (родительская категория, подкатегория, товары),
+    у товаров добавлена final_price - цена с наценкой пользователя
+    """
+    seen = set()
+    for parent in get_parent_categories():
+        # Как в боте: товары прямо в родительской категории показываются, только если нет подкатегорий
+        for category in get_subcategories(parent) or [parent]:
+            if category in seen:
+                continue
+            seen.add(category)
+            products = get_products_by_category(category)
+            for product, final_price in zip(products, price_listing(products, user_id)):
+                product['final_price'] = final_price
+            if products:
+                yield parent, category, products
+
+def _write_xlsx(path, sections):
+    # openpyxl нужен только для файла прайса - не импортируем его при запуске бота
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Прайс")
+    sheet.append(PRICE_FILE_COLUMNS)
+    for parent, category, products in sections:
+        for product in products:
+            sheet.append([parent, category, product['name'], product['country'], product['final_price']])
+    workbook.save(path)
+
+def _write_txt(path, sections):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"Прайс на {datetime.date.today():%d.%m.%Y}\n")
+        last_parent = None
+        for parent, category, products in sections:
+            if parent != last_parent:
+                f.write(f"\n=== {parent} ===\n")
+                last_parent = parent
+            f.write(f"\n{category}\n")
+            for product in products:
+                country = f", {product['country']}" if product['country'] else ""
+                f.write(f"{product['name']}{country} — {product['final_price']}₽\n")
+
+def remove_stale_price_files(keep_prefix):
+    """Удаляет файлы прайса прошлых версий каталога и наценок"""
+    for name in os.listdir(PRICE_EXPORT_DIR):
+        # Недописанные файлы (.tmp) удаляет процесс, который их пишет
+        if name.startswith('price-') and not name.startswith(keep_prefix) and not name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(PRICE_EXPORT_DIR, name))
+            except OSError:
+                pass
+
+def build_price_file(user_id, file_format='xlsx'):
+    """
+    Путь к файлу прайса с ценами пользователя; файл создается, только если его еще нет
+    для текущих версий каталога и наценок. Выполняется вне event loop (asyncio.to_thread).
+    """
+    if file_format not in PRICE_FILE_FORMATS:
+        raise ValueError(f"Неизвестный формат прайса: {file_format}")
+
+    path = price_file_path(user_id, file_format)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(PRICE_EXPORT_DIR, exist_ok=True)
+    remove_stale_price_files(_versions_prefix())
+
+    # Пишем во временный файл и переименовываем: другие процессы бота не увидят недописанный файл
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        if file_format == 'xlsx':
+            _write_xlsx(tmp_path, iter_price_sections(user_id))
+        else:
+            _write_txt(tmp_path, iter_price_sections(user_id))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
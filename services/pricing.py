@@ -0,0 +1,84 @@
+"""
+Правила наценки по родительской категории, подкатегории и диапазону цены (таблица pricing_rules).
+
+Правила компилируются в индекс: для каждой пары (родительская категория, подкатегория)
+один раз строится таблица диапазонов цены с уже выбранной наценкой, после чего наценка
+строки прайса находится одним двоичным поиском по цене, без перебора правил.
+"""
+from bisect import bisect_right
+from services.brands import DEFAULT_PARENT
+
+def rule_priority(rule):
+    """
+    Приоритет правила (больше - важнее): правило подкатегории важнее правила родительской
+    категории, правило с диапазоном цены - правила без диапазона, при прочих равных - более новое
+    """
+    return (
+        rule['category'] is not None,
+        rule['parent_category'] is not None,
+        rule['min_price'] is not None or rule['max_price'] is not None,
+        rule['id'],
+    )
+
+class BandTable:
+    """Наценки по диапазонам цены для одной пары (родительская категория, подкатегория)"""
+
+    __slots__ = ('breakpoints', 'amounts')
+
+    def __init__(self, rules):
+        # Границы всех диапазонов; между соседними границами применимое правило не меняется
+        self.breakpoints = sorted({
+            bound for rule in rules
+            for bound in (rule['min_price'], rule['max_price'])
+            if bound is not None
+        })
+        lows = [None] + self.breakpoints
+        highs = self.breakpoints + [None]
+        self.amounts = [self._amount_for(rules, low, high) for low, high in zip(lows, highs)]
+
+    @staticmethod
+    def _amount_for(rules, low, high):
+        """Наценка самого приоритетного правила, покрывающего интервал [low, high) (None - нет правила)"""
+        for rule in rules:
+            if rule['min_price'] is not None and (low is None or low < rule['min_price']):
+                continue
+            if rule['max_price'] is not None and (high is None or high > rule['max_price']):
+                continue
+            return rule['markup_amount']
+        return None
+
+    def markup(self, price, default):
+        """Наценка для цены price (default, если ни одно правило не подходит)"""
+        amount = self.amounts[bisect_right(self.breakpoints, price)]
+        return default if amount is None else amount
+
+class PricingIndex:
+    """Скомпилированные правила наценки; таблицы диапазонов строятся при первом обращении к категории"""
+
+    def __init__(self, rules):
+        self._rules = {False: [], True: []}
+        for rule in sorted(rules, key=rule_priority, reverse=True):
+            self._rules[bool(rule['is_preorder'])].append(rule)
+        self._tables = {}
+
+    def __bool__(self):
+        return bool(self._rules[False] or self._rules[True])
+
+    def table(self, is_preorder, parent_category, category):
+        """Таблица диапазонов цены для товаров категории"""
+        parent_category = parent_category or DEFAULT_PARENT
+        key = (bool(is_preorder), parent_category, category)
+        try:
+            return self._tables[key]
+        except KeyError:
+            rules = [
+                rule for rule in self._rules[key[0]]
+                if rule['parent_category'] in (None, parent_category)
+                and rule['category'] in (None, category)
+            ]
+            table = self._tables[key] = BandTable(rules)
+            return table
+
+    def markup(self, price, default, is_preorder=False, parent_category=None, category=None):
+        """Наценка для одной цены (default, если ни одно правило не подходит)"""
+        return self.table(is_preorder, parent_category, category).markup(price, default)
@@ -0,0 +1,27 @@
+from db.models import get_db
+from services.category import CATALOG_SOURCES, sources_clause
+
+def get_products_by_category(category, sources=CATALOG_SOURCES):
+    """Товары категории из всех прайсов sources одним запросом (по возрастанию цены)"""
+    where, params = sources_clause(sources)
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT id, name, memory, color, country, price, parent_category, category
+            FROM products
+            WHERE category = ? AND {where}
+            ORDER BY price
+        """, (category,) + params)
+        rows = cur.fetchall()
+        return [
+            {
+                "id": row[0],
+                "name": row[1],
+                "memory": row[2],
+                "color": row[3],
+                "country": row[4],
+                "price": row[5],
+                "parent_category": row[6],
+                "category": row[7],
+            } for row in rows
+        ]
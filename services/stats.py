@@ -0,0 +1,144 @@
+"""
+Сводные таблицы для экрана статистики админа.
+
+catalog_stats - количество товаров и категорий каталога и предзаказа; пересчитывается
+при загрузке прайса и очистке товаров в той же транзакции.
+sales_daily / sales_daily_products - продажи по дням (всего и по товарам); обновляются
+при оформлении заказа в той же транзакции, поэтому экран статистики читает
+несколько готовых строк, а не все товары и заказы.
+Дни - по UTC, как даты заказов (created_at).
+"""
+from db.models import get_db
+from services.category import CATALOG_SOURCES, sources_clause
+
+# Области статистики каталога: основной каталог (таблица products) и предзаказ
+CATALOG_SCOPE = 'catalog'
+PREORDER_SCOPE = 'preorder'
+
+_SCOPE_TABLES = {CATALOG_SCOPE: 'products', PREORDER_SCOPE: 'preorder_products'}
+
+def refresh_catalog_stats(cur):
+    """Пересчитывает catalog_stats по товарам (в транзакции загрузки прайса или очистки товаров, до commit)"""
+    for scope, table in _SCOPE_TABLES.items():
+        cur.execute(f"""
+            INSERT OR REPLACE INTO catalog_stats (scope, product_count, category_count, updated_at)
+            SELECT ?, COUNT(*), COUNT(DISTINCT category), CURRENT_TIMESTAMP
+            FROM {table}
+        """, (scope,))
+
+def record_order_sales(cur, order_id, total_price, items):
+    """
+    Добавляет заказ в продажи по дням (в транзакции оформления заказа, до commit).
+    items - кортежи (product_name, category, quantity, price) позиций заказа.
+    """
+    cur.execute("SELECT date(created_at) FROM orders WHERE id = ?", (order_id,))
+    day = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO sales_daily (day, orders_count, items_count, revenue)
+        VALUES (?, 1, ?, ?)
+        ON CONFLICT (day) DO UPDATE SET
+            orders_count = orders_count + 1,
+            items_count = items_count + excluded.items_count,
+            revenue = revenue + excluded.revenue
+    """, (day, sum(item[2] for item in items), total_price))
+    cur.executemany("""
+        INSERT INTO sales_daily_products (day, product_name, category, quantity, revenue)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (day, product_name) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            revenue = revenue + excluded.revenue
+    """, [
+        (day, product_name, category, quantity, quantity * price)
+        for product_name, category, quantity, price in items
+    ])
+
+def rebuild_sales_daily(cur):
+    """
+    Заполняет продажи по дням по уже оформленным заказам (из init_db, до commit).
+    Категория позиции берется из товара, если он еще есть в базе.
+    """
+    cur.execute("DELETE FROM sales_daily")
+    cur.execute("DELETE FROM sales_daily_products")
+    cur.execute("""
+        INSERT INTO sales_daily (day, orders_count, items_count, revenue)
+        SELECT date(o.created_at), COUNT(*), COALESCE(SUM(i.quantity), 0), COALESCE(SUM(o.total_price), 0)
+        FROM orders o
+        LEFT JOIN (
+            SELECT order_id, SUM(quantity) AS quantity FROM order_items GROUP BY order_id
+        ) i ON i.order_id = o.id
+        GROUP BY 1
+    """)
+    cur.execute("""
+        INSERT INTO sales_daily_products (day, product_name, category, quantity, revenue)
+        SELECT date(o.created_at), i.product_name,
+               MAX(CASE WHEN i.product_name LIKE '[ПРЕДЗАКАЗ]%' THEN pp.category ELSE p.category END),
+               SUM(i.quantity), SUM(i.quantity * i.price)
+        FROM order_items i
+        JOIN orders o ON o.id = i.order_id
+        LEFT JOIN products p ON p.id = i.product_id
+        LEFT JOIN preorder_products pp ON pp.id = i.product_id
+        GROUP BY 1, 2
+    """)
+
+def get_catalog_stats():
+    """Количество товаров и категорий: {область: {"products": ..., "categories": ...}}"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT scope, product_count, category_count FROM catalog_stats")
+        stats = {scope: {"products": 0, "categories": 0} for scope in _SCOPE_TABLES}
+        for scope, products, categories in cur.fetchall():
+            stats[scope] = {"products": products, "categories": categories}
+        return stats
+
+def get_top_categories(limit=5):
+    """Категории основного каталога с наибольшим количеством товаров (по дереву категорий)"""
+    where, params = sources_clause(CATALOG_SOURCES)
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT subcategory, SUM(product_count) AS count
+            FROM category_tree
+            WHERE {where}
+            GROUP BY subcategory
+            ORDER BY count DESC
+            LIMIT ?
+        """, params + (limit,))
+        return cur.fetchall()
+
+def get_sales_summary(days=None):
+    """
+    Продажи за последние days дней, включая сегодня (None - за все время):
+    {"orders": ..., "items": ..., "revenue": ...}
+    """
+    with get_db() as conn:
+        cur = conn.cursor()
+        if days is None:
+            cur.execute("SELECT SUM(orders_count), SUM(items_count), SUM(revenue) FROM sales_daily")
+        else:
+            cur.execute("""
+                SELECT SUM(orders_count), SUM(items_count), SUM(revenue)
+                FROM sales_daily
+                WHERE day > date('now', ?)
+            """, (f"-{days} days",))
+        orders, items, revenue = cur.fetchone()
+        return {"orders": orders or 0, "items": items or 0, "revenue": revenue or 0}
+
+def get_top_sellers(days=30, limit=5):
+    """Товары с наибольшим количеством проданных штук за последние days дней"""
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT product_name, SUM(quantity) AS quantity, SUM(revenue)
+            FROM sales_daily_products
+            WHERE day > date('now', ?)
+            GROUP BY product_name
+            ORDER BY quantity DESC
+            LIMIT ?
+        """, (f"-{days} days", limit))
+        return [
+            {
+                "product_name": row[0],
+                "quantity": row[1],
+                "revenue": row[2],
+            } for row in cur.fetchall()
+        ]
@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Тесты работают с отдельной базой и без метрик/трассировки; настройки читаются при импорте config
+_work_dir = tempfile.mkdtemp(prefix='phonemarketbot-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(_work_dir, 'tests.db')
+os.environ['METRICS_ENABLED'] = '0'
+os.environ['SQL_TRACE'] = '0'
+
+import pytest
+
+@pytest.fixture
+def db():
+    """База с актуальной схемой; товары, корзины и история цен очищены"""
+    from db.models import get_db, init_db
+
+    init_db()
+    with get_db() as conn:
+        for table in ('products', 'preorder_products', 'cart', 'preorder_cart',
+                      'price_history', 'price_current', 'price_uploads'):
+            conn.execute(f"DELETE FROM {table}")
+    return get_db
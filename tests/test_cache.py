@@ -0,0 +1,44 @@
+"""Кеш готовых значений (services/cache.py)"""
+import threading
+import time
+
+from services.cache import VersionedCache
+
+def test_value_is_rebuilt_after_version_change():
+    version = [1]
+    cache = VersionedCache(lambda: version[0])
+    assert cache.get('key', lambda: 'first') == 'first'
+    assert cache.get('key', lambda: 'second') == 'first'
+    version[0] = 2
+    assert cache.get('key', lambda: 'second') == 'second'
+
+def test_concurrent_get_builds_once():
+    cache = VersionedCache(lambda: 1)
+    builds = []
+
+    def build():
+        builds.append(1)
+        time.sleep(0.05)
+        return object()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('key', build))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert len({id(value) for value in results}) == 1
+
+def test_build_may_use_same_cache():
+    cache = VersionedCache(lambda: 1)
+    assert cache.get('outer', lambda: cache.get('inner', lambda: 2) + 1) == 3
+
+def test_max_size_evicts_least_recently_used():
+    cache = VersionedCache(lambda: 1, max_size=2)
+    cache.get('a', lambda: 'a')
+    cache.get('b', lambda: 'b')
+    cache.get('a', lambda: 'a2')
+    cache.get('c', lambda: 'c')
+    assert cache.get('a', lambda: 'a3') == 'a'
+    assert cache.get('b', lambda: 'b2') == 'b2'
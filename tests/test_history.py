@@ -0,0 +1,108 @@
+"""История цен (services/history.py) при загрузке прайса через store_products"""
+import time
+
+from admin.price_loader import store_products
+from services import history
+
+def offer(name, price, memory='256GB', color='Black', country='США'):
+    return ('Apple', 'Apple iPhone 16', name, memory, color, country, price)
+
+def history_rows(get_db, source='standard'):
+    with get_db() as conn:
+        return conn.execute("""
+            SELECT product_key, price, prev_price FROM price_history WHERE source = ? ORDER BY id
+        """, (source,)).fetchall()
+
+def test_product_key_includes_memory_and_color():
+    keys = {
+        history.make_product_key('Apple iPhone 16', 'iPhone 16', memory, color, 'США')
+        for memory in ('128GB', '256GB') for color in ('Black', 'White')
+    }
+    assert len(keys) == 4
+
+def test_variants_keep_separate_series(db):
+    store_products([offer('iPhone 16', 70000), offer('iPhone 16', 80000, memory='512GB')], 'standard')
+    rows = history_rows(db)
+    assert sorted(price for _, price, _ in rows) == [70000, 80000]
+    assert len({key for key, _, _ in rows}) == 2
+
+def test_only_changes_are_recorded(db):
+    store_products([offer('A', 100), offer('B', 200), offer('C', 300)], 'standard')
+    with db() as conn:
+        rowids = dict(conn.execute("SELECT product_key, rowid FROM price_current"))
+    time.sleep(0.002)
+    # A без изменений, B дороже, C пропал, D появился
+    store_products([offer('A', 100), offer('B', 250), offer('D', 400)], 'standard')
+
+    key = {name: history.make_product_key(*offer(name, 0)[1:6]) for name in 'ABCD'}
+    assert history_rows(db)[3:] == [(key['B'], 250, 200), (key['D'], 400, None), (key['C'], None, 300)]
+    with db() as conn:
+        current = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT product_key, price, rowid FROM price_current")}
+    assert {k: price for k, (price, _) in current.items()} == {key['A']: 100, key['B']: 250, key['D']: 400}
+    # Строка неизменившегося товара не перезаписывается
+    assert current[key['A']][1] == rowids[key['A']]
+
+    upload = history.get_last_upload('standard')
+    assert (upload['products_count'], upload['changes_count']) == (3, 3)
+    movers = history.get_top_movers('standard')
+    assert [(m['product_key'], m['delta']) for m in movers] == [(key['B'], 50)]
+
+def test_price_at_moment(db):
+    store_products([offer('A', 100)], 'standard')
+    key = history.make_product_key(*offer('A', 0)[1:6])
+    first = history.get_last_upload('standard')['uploaded_at']
+    time.sleep(0.002)
+    store_products([offer('A', 120)], 'standard')
+    second = history.get_last_upload('standard')['uploaded_at']
+
+    assert history.get_price_at(key, '2000-01-01') is None
+    assert history.get_price_at(key, first) == 100
+    assert history.get_price_at(key, second) == 120
+    # Время без миллисекунд и дата сравниваются с временем истории как строки
+    assert history.get_price_at(key, first[:10]) is None
+    assert history.get_price_at(key, '9999-01-01') == 120
+    assert [change['price'] for change in history.get_price_history(key)] == [120, 100]
+
+def test_find_products(db):
+    store_products([offer('iPhone 16', 70000), offer('iPhone 16', 80000, memory='512GB')], 'standard')
+    found = history.find_products('iphone 16')
+    assert sorted(product['memory'] for product in found) == ['256GB', '512GB']
+
+def test_old_keys_are_migrated(db):
+    store_products([offer('A', 100)], 'standard')
+    with db() as conn:
+        conn.execute("UPDATE products SET product_key = 'Apple iPhone 16|A|США'")
+        conn.execute("UPDATE price_current SET product_key = 'Apple iPhone 16|A|США'")
+        conn.execute("DELETE FROM settings WHERE key = 'product_key_version'")
+        history.update_product_keys(conn.cursor())
+        key = history.make_product_key(*offer('A', 0)[1:6])
+        assert conn.execute("SELECT product_key FROM products").fetchall() == [(key,)]
+        assert conn.execute("SELECT product_key, price FROM price_current").fetchall() == [(key, 100)]
+        # Повторный вызов ничего не пересчитывает
+        assert history.update_product_keys(conn.cursor()) == 0
+
+def test_json_import_records_keys_and_history(db, tmp_path):
+    import json
+    from db.crud import add_to_cart
+    from db.utils import import_products_from_json
+    from services.maintenance import CATALOG_SOURCES, repair_orphan_cart_rows
+
+    path = tmp_path / 'products.json'
+    path.write_text(json.dumps([{
+        'category': 'Apple iPhone 16', 'name': 'A', 'memory': '256GB',
+        'color': 'Black', 'country': 'США', 'price': 100,
+    }]), encoding='utf-8')
+    import_products_from_json(path)
+    key = history.make_product_key(*offer('A', 0)[1:6])
+    assert history_rows(db) == [(key, 100, None)]
+
+    with db() as conn:
+        product_id = conn.execute("SELECT id FROM products").fetchone()[0]
+    add_to_cart(1, product_id, 2)
+    # Позиция корзины переносится на тот же товар нового прайса
+    store_products([offer('A', 120)], 'standard')
+    assert repair_orphan_cart_rows('cart', 'products', CATALOG_SOURCES) == (1, 0)
+    with db() as conn:
+        assert conn.execute("""
+            SELECT p.name, c.quantity FROM cart c JOIN products p ON p.id = c.product_id
+        """).fetchall() == [('A', 2)]
@@ -0,0 +1,110 @@
+"""Фоновое обслуживание базы (services/maintenance.py)"""
+import sqlite3
+
+import pytest
+
+from services import maintenance
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """База без auto_vacuum (создана старой версией бота) со свободными страницами"""
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (value TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?)", [('x' * 1000,)] * 500)
+    conn.commit()
+    conn.execute("DELETE FROM t")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(maintenance, 'get_db', lambda: sqlite3.connect(path))
+    return path
+
+def pragma(path, name):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+    finally:
+        conn.close()
+
+def test_scheduled_vacuum_does_not_convert_legacy_db(legacy_db):
+    free_pages = pragma(legacy_db, 'freelist_count')
+    assert maintenance.incremental_vacuum() == {"incremental": False, "freed_pages": 0}
+    assert pragma(legacy_db, 'auto_vacuum') == 0
+    assert pragma(legacy_db, 'freelist_count') == free_pages
+
+def test_convert_then_incremental_vacuum(legacy_db):
+    assert maintenance.convert_to_incremental_vacuum() is True
+    assert pragma(legacy_db, 'auto_vacuum') == maintenance.AUTO_VACUUM_INCREMENTAL
+    assert maintenance.convert_to_incremental_vacuum() is False
+
+    conn = sqlite3.connect(legacy_db)
+    conn.executemany("INSERT INTO t VALUES (?)", [('y' * 1000,)] * 300)
+    conn.commit()
+    conn.execute("DELETE FROM t")
+    conn.commit()
+    conn.close()
+    free_pages = pragma(legacy_db, 'freelist_count')
+    assert free_pages > 0
+    assert maintenance.incremental_vacuum() == {"incremental": True, "freed_pages": free_pages}
+    assert pragma(legacy_db, 'freelist_count') == 0
+
+def cart_rows(get_db):
+    with get_db() as conn:
+        return sorted(conn.execute("""
+            SELECT c.user_id, p.name, c.quantity FROM cart c JOIN products p ON p.id = c.product_id
+        """).fetchall())
+
+def product_ids(get_db):
+    with get_db() as conn:
+        return dict(conn.execute("SELECT name, id FROM products"))
+
+def offers(names):
+    return [('Apple', 'Apple iPhone 16', name, '256GB', 'Black', 'США', 70000) for name in names]
+
+@pytest.mark.parametrize('batch_size', [2, 500])
+def test_orphan_rows_are_remapped_merged_or_removed(db, monkeypatch, batch_size):
+    from admin.price_loader import store_products
+    from db.crud import add_to_cart
+
+    monkeypatch.setattr(maintenance, 'SWEEP_BATCH_SIZE', batch_size)
+    store_products(offers(['A', 'B', 'C']), 'standard')
+    ids = product_ids(db)
+    add_to_cart(1, ids['A'], 2)
+    add_to_cart(1, ids['C'], 1)
+    add_to_cart(2, ids['A'], 1)
+    add_to_cart(2, ids['B'], 4)
+    # Две позиции пользователя 3 после загрузки прайса ведут на один товар
+    with db() as conn:
+        conn.execute("INSERT INTO cart (user_id, product_id, quantity, product_key, updated_at) "
+                     "SELECT 3, id, 5, product_key, CURRENT_TIMESTAMP FROM products WHERE name IN ('A', 'B')")
+        conn.execute("UPDATE cart SET product_key = (SELECT product_key FROM products WHERE name = 'A') "
+                     "WHERE user_id = 3")
+
+    # Новый прайс: A и B остались с новыми ID, C пропал; пользователь 2 снова добавил A
+    store_products(offers(['A', 'B']), 'standard')
+    add_to_cart(2, product_ids(db)['A'], 3)
+
+    assert maintenance.repair_orphan_cart_rows('cart', 'products', maintenance.CATALOG_SOURCES) == (5, 1)
+    assert cart_rows(db) == [(1, 'A', 2), (2, 'A', 4), (2, 'B', 4), (3, 'A', 10)]
+    with db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM cart").fetchone()[0] == 4
+    assert maintenance.repair_orphan_cart_rows('cart', 'products', maintenance.CATALOG_SOURCES) == (0, 0)
+
+def test_cart_ttl_counts_from_last_change(db):
+    from admin.price_loader import store_products
+    from db.crud import add_to_cart, get_cart, update_cart_quantity
+
+    store_products(offers(['A', 'B']), 'standard')
+    ids = product_ids(db)
+    add_to_cart(1, ids['A'], 1)
+    add_to_cart(1, ids['B'], 1)
+    add_to_cart(2, ids['A'], 1)
+    with db() as conn:
+        conn.execute("UPDATE cart SET created_at = datetime('now', '-40 days'), updated_at = datetime('now', '-40 days')")
+
+    # Изменение количества продлевает срок позиции, порядок позиций в корзине не меняется
+    add_to_cart(1, ids['A'], 1)
+    update_cart_quantity(1, get_cart(1)[1]['cart_id'], 5)
+    assert maintenance.delete_expired_cart_rows('cart', 30) == 1
+    assert [(item['name'], item['quantity']) for item in get_cart(1)] == [('A', 2), ('B', 5)]
+    assert get_cart(2) == []
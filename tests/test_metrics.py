@@ -0,0 +1,20 @@
+"""Замер времени SQL-запросов (db/models.py)"""
+import sqlite3
+
+from db import models
+from services import metrics
+
+def test_connection_execute_is_timed(tmp_path, monkeypatch):
+    monkeypatch.setattr(models, 'METRICS_ENABLED', True)
+    metrics.reset()
+    conn = sqlite3.connect(tmp_path / 'timed.db', factory=models.TimedConnection)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t (x) VALUES (?)", [(1,), (2,)])
+    conn.cursor().execute("SELECT x FROM t").fetchall()
+    conn.execute("ANALYZE")
+    conn.close()
+    counts = {
+        item['labels']['operation']: item['count']
+        for item in metrics.get_histogram_summary('db_statement_seconds', top=None)
+    }
+    assert counts == {'CREATE': 1, 'INSERT': 1, 'SELECT': 1, 'ANALYZE': 1}
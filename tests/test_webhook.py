@@ -0,0 +1,119 @@
+"""
+Процессы-обработчики webhook (bot/webhook.py): настоящий Supervisor с процессами,
+вместо бота и диспетчера aiogram - заглушки, которые записывают обработку update в журнал.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+
+from bot import webhook
+
+class FakeSession:
+    async def close(self):
+        pass
+
+class FakeBot:
+    session = FakeSession()
+
+class JournalDispatcher:
+    """Записывает в журнал (user_id, update_id, pid, начало, конец) каждого обработанного update"""
+
+    def __init__(self, journal):
+        self.journal = journal
+
+    async def feed_raw_update(self, bot, update):
+        started = time.perf_counter()
+        # Случайная длительность: без упорядочивания update пользователя завершались бы не по порядку
+        await asyncio.sleep(random.random() * 0.005)
+        self.journal.put((webhook.update_user_id(update), update['update_id'], os.getpid(),
+                          started, time.perf_counter()))
+
+def make_update(update_id, user_id):
+    return {
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'chat': {'id': user_id}, 'from': {'id': user_id}, 'text': 'x'},
+    }
+
+def make_supervisor(workers, journal):
+    return webhook.Supervisor(workers, FakeBot, lambda: JournalDispatcher(journal))
+
+def dispatch_interleaved(supervisor, users, per_user):
+    """update пользователей вперемешку, update каждого пользователя - по возрастанию update_id"""
+    sent = defaultdict(list)
+    update_id = 0
+    for _ in range(per_user):
+        for user_id in users:
+            update_id += 1
+            sent[user_id].append(update_id)
+            supervisor.dispatch(make_update(update_id, user_id))
+    return sent
+
+def collect(journal, count):
+    handled = defaultdict(list)
+    for _ in range(count):
+        user_id, update_id, pid, begin, end = journal.get(timeout=30)
+        handled[user_id].append((begin, end, update_id, pid))
+    for entries in handled.values():
+        entries.sort()
+    return handled
+
+def test_shard_for_user_is_stable():
+    for user_id in range(1000, 1100):
+        shard = webhook.shard_for_user(user_id, 4)
+        assert 0 <= shard < 4
+        assert webhook.shard_for_user(user_id, 4) == shard
+    assert webhook.shard_for_user(None, 4) == 0
+
+def test_user_updates_reach_one_worker_in_order():
+    journal = webhook._mp.Queue()
+    supervisor = make_supervisor(3, journal)
+    supervisor.start()
+    try:
+        users = list(range(5000, 5030))
+        sent = dispatch_interleaved(supervisor, users, per_user=8)
+        handled = collect(journal, sum(len(ids) for ids in sent.values()))
+    finally:
+        supervisor.stop()
+
+    pids = set()
+    for user_id in users:
+        entries = handled[user_id]
+        user_pids = {pid for _, _, _, pid in entries}
+        assert len(user_pids) == 1
+        pids |= user_pids
+        # Порядок начала обработки совпадает с порядком отправки, обработки не пересекаются
+        assert [update_id for _, _, update_id, _ in entries] == sent[user_id]
+        assert all(entries[i][1] <= entries[i + 1][0] for i in range(len(entries) - 1))
+    assert len(pids) == 3
+
+def test_workers_are_not_daemon_and_stop_explicitly():
+    supervisor = make_supervisor(2, webhook._mp.Queue())
+    supervisor.start()
+    assert not any(process.daemon for process in supervisor.processes)
+    supervisor.stop()
+    assert not any(process.is_alive() for process in supervisor.processes)
+
+def test_dead_worker_is_restarted():
+    journal = webhook._mp.Queue()
+    supervisor = make_supervisor(2, journal)
+    supervisor.start()
+    try:
+        assert supervisor.restart_dead() == []
+        dead = supervisor.processes[1]
+        dead.kill()
+        dead.join()
+        assert supervisor.restart_dead() == [(1, dead.exitcode)]
+        assert supervisor.processes[1] is not dead and supervisor.processes[1].is_alive()
+        assert supervisor.restarts == [0, 1]
+
+        # update пользователей упавшего процесса снова обрабатываются
+        users = [user_id for user_id in range(6000, 6100) if webhook.shard_for_user(user_id, 2) == 1][:5]
+        sent = dispatch_interleaved(supervisor, users, per_user=3)
+        handled = collect(journal, sum(len(ids) for ids in sent.values()))
+        for user_id in users:
+            assert [update_id for _, _, update_id, _ in handled[user_id]] == sent[user_id]
+            assert {pid for _, _, _, pid in handled[user_id]} == {supervisor.processes[1].pid}
+    finally:
+        supervisor.stop()